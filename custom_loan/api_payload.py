@@ -0,0 +1,129 @@
+"""
+Compact responses for the loan list and summary APIs
+
+Callers on slow connections can ask for only the fields they show, page
+through long lists with a cursor and have the response gzip or msgpack
+encoded. Without any of these options the APIs answer exactly as before.
+The size of every response, before and after encoding, is counted per
+method for get_payload_metrics.
+"""
+
+import base64
+import gzip
+import json
+
+import frappe
+import redis
+from frappe.utils import cint
+from frappe.utils.response import json_handler
+
+PAYLOAD_METRICS_KEY = "custom_loan:payload_metrics"
+
+MAX_PAGE_LENGTH = 500
+
+
+def parse_fields(fields, allowed, always=None):
+    """
+    Requested fields, checked against what the API may return
+
+    Args:
+        fields (str|list): JSON list or comma separated field names
+        allowed (list): Fields the caller may ask for
+        always (list): Fields always included, e.g. the cursor field
+
+    Returns:
+        list: field names, or None when no projection was asked for
+    """
+    if not fields:
+        return None
+
+    if isinstance(fields, str):
+        fields = json.loads(fields) if fields.lstrip().startswith("[") else fields.split(",")
+    fields = [field.strip() for field in fields if field and field.strip()]
+
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        frappe.throw(f"Unknown fields: {', '.join(unknown)}")
+
+    return list(dict.fromkeys((always or []) + fields))
+
+
+def get_page_length(page_length):
+    return min(cint(page_length) or 100, MAX_PAGE_LENGTH)
+
+
+def make_page(rows, page_length, cursor_field="name"):
+    """Trim rows fetched with one extra and return them with the next cursor"""
+    if len(rows) > page_length:
+        rows = rows[:page_length]
+        return rows, rows[-1][cursor_field]
+
+    return rows, None
+
+
+def encode_payload(method, payload, encoding=None):
+    """
+    Encode a response as asked and count its size
+
+    gzip and msgpack bodies are returned base64 encoded, under "data", so
+    they travel through the normal JSON response of a whitelisted method.
+    """
+    raw = json.dumps(payload, default=json_handler, separators=(",", ":")).encode()
+
+    if not encoding or encoding == "json":
+        record_payload_size(method, len(raw), len(raw))
+        return payload
+
+    if encoding == "gzip":
+        data = gzip.compress(raw)
+    elif encoding == "msgpack":
+        try:
+            import msgpack
+        except ImportError:
+            frappe.throw("msgpack encoding needs the msgpack package installed on the server")
+        data = msgpack.packb(payload, default=json_handler)
+    else:
+        frappe.throw(f"Unsupported encoding {encoding}; use json, gzip or msgpack")
+
+    data = base64.b64encode(data).decode()
+    record_payload_size(method, len(raw), len(data))
+
+    return {"encoding": encoding, "raw_bytes": len(raw), "data": data}
+
+
+def record_payload_size(method, raw_bytes, sent_bytes):
+    cache = frappe.cache()
+    key = cache.make_key(PAYLOAD_METRICS_KEY)
+    cache.hincrby(key, f"{method}|calls", 1)
+    cache.hincrby(key, f"{method}|raw_bytes", raw_bytes)
+    cache.hincrby(key, f"{method}|sent_bytes", sent_bytes)
+
+
+@frappe.whitelist()
+def get_payload_metrics():
+    """Calls and average response size per method, before and after encoding"""
+    frappe.only_for("System Manager")
+
+    cache = frappe.cache()
+    totals = {}
+    # Raw read: RedisWrapper.hgetall would prefix the key again and unpickle the integer counters
+    for field, value in redis.Redis.hgetall(cache, cache.make_key(PAYLOAD_METRICS_KEY)).items():
+        method, metric = frappe.safe_decode(field).rsplit("|", 1)
+        totals.setdefault(method, {"calls": 0, "raw_bytes": 0, "sent_bytes": 0})[metric] = int(value)
+
+    return {
+        method: {
+            "calls": total["calls"],
+            "average_raw_bytes": round(total["raw_bytes"] / total["calls"]) if total["calls"] else 0,
+            "average_sent_bytes": round(total["sent_bytes"] / total["calls"]) if total["calls"] else 0,
+            "saved_percent": round(100 - total["sent_bytes"] / total["raw_bytes"] * 100, 1)
+            if total["raw_bytes"] else 0
+        }
+        for method, total in totals.items()
+    }
+
+
+@frappe.whitelist()
+def reset_payload_metrics():
+    frappe.only_for("System Manager")
+    frappe.cache().delete(frappe.cache().make_key(PAYLOAD_METRICS_KEY))
@@ -0,0 +1,517 @@
+"""
+Reconciliation of bank and UPI statements with loan payments
+
+A statement file (CSV or MT940) is read line by line and handled in chunks.
+Every credit line is matched, in order, against:
+
+1. unreconciled payments carrying the same reference number and amount
+2. unreconciled payments of the same amount within the date window
+3. open loans, by the customer's mobile number in the narration, or by an
+   installment of the same amount falling due within the date window
+
+Each step is one indexed query for the whole chunk. Where several candidates
+remain, the customer's name and mobile number are fuzzy-matched against the
+line. Confident matches are reconciled, or for new collections posted as
+Loan Payments; the rest are kept as Loan Bank Statement Lines for review.
+"""
+
+import csv
+import difflib
+import hashlib
+import os
+import re
+import time
+from datetime import datetime
+
+import frappe
+from frappe.utils import add_days, cint, flt, getdate, now_datetime, today
+from custom_loan.duplicate_payments import find_batch_duplicates
+
+LINE_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "statement", "transaction_date", "amount", "bank_reference", "counterparty", "description", "line_hash",
+    "status", "match_rule", "match_score", "loan_payment", "loan", "branch"
+]
+
+# Header names banks use for each statement field, lower case
+CSV_COLUMNS = {
+    "transaction_date": ("date", "transaction date", "txn date", "value date", "posting date", "tran date"),
+    "credit": ("credit", "credit amount", "deposit", "deposits", "deposit amount", "cr"),
+    "amount": ("amount", "transaction amount"),
+    "bank_reference": ("reference", "reference number", "ref no", "ref no.", "utr", "utr number", "transaction id",
+                       "cheque/ref no", "chq/ref no"),
+    "description": ("description", "narration", "particulars", "remarks", "details"),
+    "counterparty": ("name", "counterparty", "payer", "payer name", "remitter", "remitter name")
+}
+
+DATE_FORMATS = ("%Y-%m-%d", "%d/%m/%Y", "%d-%m-%Y", "%d/%m/%y", "%d-%m-%y", "%d-%b-%Y", "%d %b %Y", "%d-%b-%y")
+
+MOBILE_PATTERN = re.compile(r"(?<!\d)(?:91)?(\d{10})(?!\d)")
+MT940_TRANSACTION = re.compile(r"^(\d{6})(\d{4})?(R?[CD])[A-Z]?([\d,]+)(?:[A-Z]\w{3})?([^/]*)(?://(.*))?$")
+
+
+def read_statement(path, statement_format=None):
+    """Credit lines of a statement file, one dict at a time"""
+    if not statement_format:
+        statement_format = "MT940" if os.path.splitext(path)[1].lower() in (".sta", ".mt940", ".940") else "CSV"
+
+    reader = read_mt940_lines if statement_format == "MT940" else read_csv_lines
+    for line in reader(path):
+        if flt(line["amount"]) > 0:
+            yield line
+
+
+def read_csv_lines(path):
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.reader(f)
+        header = [column.strip().lower() for column in next(reader, [])]
+        columns = {
+            field: next((header.index(name) for name in names if name in header), None)
+            for field, names in CSV_COLUMNS.items()
+        }
+        if columns["transaction_date"] is None or (columns["credit"] is None and columns["amount"] is None):
+            frappe.throw("The statement needs a date column and a credit or amount column")
+
+        def value(row, field):
+            index = columns[field]
+            return row[index].strip() if index is not None and index < len(row) else ""
+
+        for row in reader:
+            if not any(row):
+                continue
+
+            if columns["credit"] is not None:
+                amount = parse_amount(value(row, "credit"))
+            else:
+                # A single signed amount column; a Dr marker or minus sign is money going out
+                amount = parse_amount(value(row, "amount"))
+
+            yield {
+                "transaction_date": parse_date(value(row, "transaction_date")),
+                "amount": amount,
+                "bank_reference": value(row, "bank_reference"),
+                "description": value(row, "description"),
+                "counterparty": value(row, "counterparty")
+            }
+
+
+def read_mt940_lines(path):
+    """Transactions of an MT940 file from their :61: and :86: fields"""
+    transaction, tag = None, None
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for raw_line in f:
+            line = raw_line.rstrip("\r\n")
+            match = re.match(r"^:(\d{2}[A-Z]?):(.*)$", line)
+            if match:
+                tag, content = match.groups()
+                if tag == "61":
+                    if transaction:
+                        yield transaction
+                    transaction = parse_mt940_transaction(content)
+                elif tag == "86" and transaction:
+                    transaction["description"] = content
+                elif tag in ("62F", "62M") and transaction:
+                    yield transaction
+                    transaction = None
+            elif tag == "86" and transaction:
+                # Narrations continue over several lines
+                transaction["description"] += " " + line.strip()
+
+    if transaction:
+        yield transaction
+
+
+def parse_mt940_transaction(content):
+    match = MT940_TRANSACTION.match(content.strip())
+    if not match:
+        return None
+
+    value_date, _, mark, amount, reference, bank_reference = match.groups()
+    amount = flt(amount.replace(",", "."))
+    return {
+        "transaction_date": datetime.strptime(value_date, "%y%m%d").date(),
+        # C is a credit and RD the reversal of a debit; both bring money in
+        "amount": amount if mark in ("C", "RD") else -amount,
+        "bank_reference": (reference if reference.strip() not in ("", "NONREF") else bank_reference or "").strip(),
+        "description": "",
+        "counterparty": ""
+    }
+
+
+def parse_amount(value):
+    value = (value or "").replace(",", "").strip()
+    sign = -1 if value.startswith("-") or value.lower().endswith("dr") else 1
+    value = re.sub(r"[^\d.]", "", value)
+    return sign * flt(value) if value else 0
+
+
+def parse_date(value):
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format).date()
+        except ValueError:
+            continue
+    return getdate(value)
+
+
+def get_line_key(line):
+    return "|".join((str(line["transaction_date"]), f"{flt(line['amount'], 2):.2f}", line["bank_reference"],
+                     line["counterparty"], line["description"]))
+
+
+def get_line_hash(line):
+    """
+    Identity of a statement line across imports
+
+    Two genuine credits can look the same (a customer paying twice in a day
+    by UPI, with no reference and the same narration), so the line's
+    occurrence among identical lines of the statement is part of it. An
+    overlapping statement numbers its repeats the same way.
+    """
+    key = f"{get_line_key(line)}|{line.get('occurrence') or 1}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def normalize_name(value):
+    return " ".join(re.sub(r"[^a-z ]", " ", (value or "").lower()).split())
+
+
+def get_mobile(value):
+    digits = re.sub(r"\D", "", value or "")
+    return digits[-10:] if len(digits) >= 10 else None
+
+
+def get_identity_score(line, name, mobile):
+    """How surely a statement line comes from a customer, from 0 to 1"""
+    if mobile and get_mobile(mobile) in line["mobiles"]:
+        return 1.0
+
+    name = normalize_name(name)
+    if not name:
+        return 0
+
+    score = 0
+    if line["name_key"]:
+        score = difflib.SequenceMatcher(None, line["name_key"], name).ratio()
+
+    # Narrations carry the payer name among other words; count the customer's name words found there
+    tokens = [token for token in name.split() if len(token) > 1]
+    if tokens:
+        score = max(score, len([token for token in tokens if token in line["tokens"]]) / len(tokens))
+
+    return score
+
+
+def pick_best(line, candidates, threshold):
+    """
+    The candidate a line most likely belongs to
+
+    Returns:
+        tuple: (candidate, score, confident); candidate is None when there are none
+    """
+    if not candidates:
+        return None, 0, False
+
+    scored = sorted(
+        ((get_identity_score(line, c.customer_name, c.mobile_number),
+          -abs((getdate(c.date) - line["transaction_date"]).days), c)
+         for c in candidates),
+        key=lambda row: row[:2], reverse=True
+    )
+    best_score, _, best = scored[0]
+    # Several payments or installments of one loan are not competing candidates
+    runner_up = next((score for score, _, c in scored[1:] if c.loan != best.loan), 0)
+
+    confident = best_score >= threshold and best_score - runner_up >= 0.1
+    return best, best_score, confident
+
+
+@frappe.whitelist()
+def import_bank_statement(file_url, statement_format=None, auto_post=1):
+    """Queue reconciliation of an uploaded bank statement"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    frappe.enqueue(
+        "custom_loan.bank_reconciliation.reconcile_bank_statement",
+        queue="long",
+        timeout=7200,
+        file_url=file_url,
+        statement_format=statement_format,
+        auto_post=cint(auto_post),
+        notify_user=frappe.session.user
+    )
+
+    return {"queued": True}
+
+
+def reconcile_bank_statement(file_url, statement_format=None, auto_post=1, chunk_size=2000, notify_user=None):
+    """
+    Match every credit line of a statement, committing chunk by chunk
+
+    Importing the same statement again skips lines already imported, and a
+    collection is never posted twice thanks to the payment fingerprint check.
+    """
+    start = time.monotonic()
+    path = frappe.get_doc("File", {"file_url": file_url}).get_full_path()
+    statement = f"{os.path.basename(path)} {now_datetime():%Y-%m-%d %H:%M:%S}"
+
+    settings = frappe.get_cached_doc("Loan Settings")
+    options = frappe._dict(
+        statement=statement,
+        window=cint(settings.reconciliation_date_window_days) or 3,
+        threshold=flt(settings.reconciliation_match_threshold or 90) / 100,
+        auto_post=cint(auto_post)
+    )
+
+    counts, occurrences, chunk = {}, {}, []
+    for line in read_statement(path, statement_format):
+        key = get_line_key(line)
+        occurrences[key] = line["occurrence"] = occurrences.get(key, 0) + 1
+        chunk.append(line)
+        if len(chunk) >= chunk_size:
+            count_statuses(counts, reconcile_chunk(chunk, options))
+            chunk = []
+    if chunk:
+        count_statuses(counts, reconcile_chunk(chunk, options))
+
+    result = {
+        "statement": statement,
+        "lines": sum(counts.values()),
+        "statuses": counts,
+        "elapsed": round(time.monotonic() - start, 2)
+    }
+
+    if notify_user:
+        frappe.publish_realtime("custom_loan_bank_reconciliation", result, user=notify_user)
+
+    return result
+
+
+def count_statuses(counts, lines):
+    for line in lines:
+        counts[line["status"]] = counts.get(line["status"], 0) + 1
+
+
+def reconcile_chunk(lines, options):
+    """Match, post and store one chunk of statement lines in one transaction"""
+    for line in lines:
+        line.update(
+            line_hash=get_line_hash(line),
+            status=None, match_rule=None, match_score=0, loan_payment=None, loan=None, branch=None,
+            mobiles={match for match in MOBILE_PATTERN.findall(f"{line['description']} {line['counterparty']}")},
+            name_key=normalize_name(line["counterparty"]),
+            tokens=set(normalize_name(f"{line['counterparty']} {line['description']}").split())
+        )
+
+    skip_imported_lines(lines)
+    match_by_reference(open_lines(lines))
+    match_by_amount_and_date(open_lines(lines), options)
+    match_open_loans(open_lines(lines), options)
+
+    for line in open_lines(lines):
+        line["status"] = "Unmatched"
+
+    reconciled = [line["loan_payment"] for line in lines if line["status"] == "Matched"]
+    if reconciled:
+        frappe.db.sql("""
+            UPDATE `tabLoan Payment`
+            SET is_reconciled = 1, reconciled_on = %s
+            WHERE name IN %s
+        """, (today(), tuple(reconciled)))
+
+    insert_lines(lines, options.statement)
+    frappe.db.commit()
+
+    return lines
+
+
+def open_lines(lines):
+    return [line for line in lines if not line["status"]]
+
+
+def skip_imported_lines(lines):
+    """Lines of an earlier import of the same statement, or of an overlapping one"""
+    imported = set(frappe.db.sql_list("""
+        SELECT line_hash FROM `tabLoan Bank Statement Line` WHERE line_hash IN %s
+    """, (tuple({line["line_hash"] for line in lines}),)))
+
+    for line in lines:
+        if line["line_hash"] in imported:
+            line.update(status="Duplicate", match_rule="Already Imported")
+        imported.add(line["line_hash"])
+
+
+def match_by_reference(lines):
+    references = {line["bank_reference"] for line in lines if line["bank_reference"]}
+    if not references:
+        return
+
+    payments = {}
+    for payment in frappe.db.sql("""
+        SELECT name, loan, branch, amount, reference_number
+        FROM `tabLoan Payment`
+        WHERE reference_number IN %s AND docstatus = 1 AND is_reconciled = 0
+    """, (tuple(references),), as_dict=True):
+        payments.setdefault((payment.reference_number, flt(payment.amount, 2)), []).append(payment)
+
+    for line in lines:
+        candidates = payments.get((line["bank_reference"], flt(line["amount"], 2)))
+        if candidates:
+            payment = candidates.pop(0)
+            line.update(status="Matched", match_rule="Reference", match_score=100,
+                        loan_payment=payment.name, loan=payment.loan, branch=payment.branch)
+
+
+def get_window(lines, window):
+    dates = [line["transaction_date"] for line in lines]
+    return add_days(min(dates), -window), add_days(max(dates), window)
+
+
+def match_by_amount_and_date(lines, options):
+    """Payments recorded at the counter that the bank statement now confirms"""
+    if not lines:
+        return
+
+    from_date, to_date = get_window(lines, options.window)
+    candidates = {}
+    for payment in frappe.db.sql("""
+        SELECT p.name, p.loan, p.branch, p.amount, p.payment_date as date, p.customer_name, l.mobile_number
+        FROM `tabLoan Payment` p
+        INNER JOIN `tabLoan` l ON l.name = p.loan
+        WHERE p.amount IN %(amounts)s
+        AND p.payment_date BETWEEN %(from_date)s AND %(to_date)s
+        AND p.docstatus = 1 AND p.is_reconciled = 0
+    """, {
+        "amounts": tuple({flt(line["amount"], 2) for line in lines}),
+        "from_date": from_date,
+        "to_date": to_date
+    }, as_dict=True):
+        candidates.setdefault(flt(payment.amount, 2), []).append(payment)
+
+    used = set()
+    for line in lines:
+        in_window = [
+            payment for payment in candidates.get(flt(line["amount"], 2), [])
+            if payment.name not in used
+            and abs((getdate(payment.date) - line["transaction_date"]).days) <= options.window
+        ]
+        payment, score, confident = pick_best(line, in_window, options.threshold)
+        if not payment:
+            continue
+
+        # A lone payment of that amount in the window matches unless the line names someone else
+        if confident or (len(in_window) == 1 and not line["name_key"] and not line["mobiles"]):
+            used.add(payment.name)
+            line.update(status="Matched", match_rule="Amount and Date", match_score=score * 100,
+                        loan_payment=payment.name, loan=payment.loan, branch=payment.branch)
+        else:
+            line.update(status="Review", match_rule="Amount and Date", match_score=score * 100,
+                        loan_payment=payment.name, loan=payment.loan, branch=payment.branch)
+
+
+def match_open_loans(lines, options):
+    """New collections: find the loan by mobile number or by an installment due, and post them"""
+    if not lines:
+        return
+
+    from_date, to_date = get_window(lines, options.window)
+    by_mobile, by_amount = {}, {}
+
+    mobiles = set().union(*(line["mobiles"] for line in lines))
+    if mobiles:
+        for loan in frappe.db.sql("""
+            SELECT name as loan, branch, customer_name, mobile_number, loan_date as date
+            FROM `tabLoan`
+            WHERE mobile_number IN %s AND status IN ('Active', 'Overdue')
+        """, (tuple(mobiles),), as_dict=True):
+            by_mobile.setdefault(get_mobile(loan.mobile_number), []).append(loan)
+
+    for installment in frappe.db.sql("""
+        SELECT l.name as loan, l.branch, l.customer_name, l.mobile_number, s.due_date as date, s.installment_amount
+        FROM `tabLoan Repayment Schedule` s
+        INNER JOIN `tabLoan` l ON l.name = s.parent AND s.parenttype = 'Loan'
+        WHERE s.installment_amount IN %(amounts)s
+        AND s.due_date BETWEEN %(from_date)s AND %(to_date)s
+        AND s.status IN ('Pending', 'Partial', 'Overdue')
+        AND l.status IN ('Active', 'Overdue')
+    """, {
+        "amounts": tuple({flt(line["amount"], 2) for line in lines}),
+        "from_date": from_date,
+        "to_date": to_date
+    }, as_dict=True):
+        by_amount.setdefault(flt(installment.installment_amount, 2), []).append(installment)
+
+    to_post = []
+    for line in lines:
+        candidates = [loan for mobile in line["mobiles"] for loan in by_mobile.get(mobile, [])]
+        rule = "Mobile Number"
+        if len({loan.loan for loan in candidates}) != 1:
+            # No loan, or several for the same mobile; an installment of the paid amount settles it
+            installments = [
+                row for row in by_amount.get(flt(line["amount"], 2), [])
+                if abs((getdate(row.date) - line["transaction_date"]).days) <= options.window
+            ]
+            candidates = [row for row in installments if row.loan in {loan.loan for loan in candidates}] \
+                or installments
+            rule = "Installment Due"
+
+        loan, score, confident = pick_best(line, candidates, options.threshold)
+        if not loan:
+            continue
+
+        line.update(match_rule=rule, match_score=score * 100, loan=loan.loan, branch=loan.branch)
+        if confident and options.auto_post:
+            to_post.append(line)
+        else:
+            line["status"] = "Review"
+
+    post_payments(to_post)
+
+
+def post_payments(lines):
+    """Post confident new collections, checking the whole batch for duplicates up front"""
+    if not lines:
+        return
+
+    payments = [
+        {
+            "loan": line["loan"],
+            "amount": line["amount"],
+            "payment_date": line["transaction_date"],
+            "reference_number": line["bank_reference"],
+            "payment_method": "UPI" if "UPI" in f"{line['description']} {line['bank_reference']}".upper()
+            else "Bank Transfer"
+        }
+        for line in lines
+    ]
+
+    for line, payment, duplicate in zip(lines, payments, find_batch_duplicates(payments)):
+        # Repeats within the batch are separate lines of the statement, so separate credits
+        if isinstance(duplicate, str):
+            line.update(status="Duplicate", loan_payment=duplicate)
+            continue
+
+        frappe.db.savepoint("post_statement_line")
+        try:
+            doc = frappe.get_doc(dict(payment, doctype="Loan Payment", is_reconciled=1, reconciled_on=today()))
+            doc.flags.duplicate_checked = True
+            doc.insert()
+            doc.submit()
+            line.update(status="Posted", loan_payment=doc.name)
+        except Exception:
+            frappe.db.rollback(save_point="post_statement_line")
+            frappe.clear_messages()
+            # For instance more than the loan's outstanding; someone has to look at it
+            line["status"] = "Review"
+
+
+def insert_lines(lines, statement):
+    now, user = now_datetime(), frappe.session.user
+    frappe.db.bulk_insert("Loan Bank Statement Line", fields=LINE_FIELDS, values=[
+        (frappe.generate_hash(length=10), now, now, user, user,
+         statement, line["transaction_date"], line["amount"], line["bank_reference"][:140],
+         line["counterparty"][:140], line["description"], line["line_hash"],
+         line["status"], line["match_rule"], flt(line["match_score"], 2), line["loan_payment"],
+         line["loan"], line["branch"])
+        for line in lines
+    ])
@@ -0,0 +1,284 @@
+"""
+Append-only change feed of loans and payments for downstream consumers
+
+Every change to a Loan or Loan Payment appends a Loan Change Event in the
+same transaction as the change itself, so an event exists exactly when the
+change was committed. Events are numbered by an auto-increment sequence and
+consumers read them incrementally with get_changes, keeping the last
+sequence number they have seen as their cursor.
+
+Sequence numbers are taken at insert but become visible at commit, so a
+long transaction (a chunk of bulk disbursal, rate revision or bank
+reconciliation) can leave a gap that fills minutes later. Readers stop at a
+gap while any open transaction that started before the event after the gap
+was written could still hold it, read from information_schema.innodb_trx.
+Without the PROCESS privilege that table cannot be read, and readers wait
+Gap Settle Time from Loan Settings at each gap instead.
+"""
+
+import json
+import os
+import time
+
+import frappe
+from frappe.utils import add_days, cint, now_datetime, time_diff_in_seconds
+
+CHANGE_QUEUE_KEY = "custom_loan:change_feed"
+CHANGE_QUEUE_MAX_LENGTH = 100000
+
+# A gap younger than this may still fill, whatever innodb_trx says; it also
+# covers clock difference between the app and database servers
+GAP_SETTLE_SECONDS = 10
+# Wait at a gap when open transactions cannot be read
+DEFAULT_GAP_SETTLE_SECONDS = 900
+
+PAYLOAD_FIELDS = {
+    "Loan": [
+        "customer", "customer_name", "mobile_number", "branch", "loan_type", "loan_date", "loan_amount", "interest_rate", "revised_rate",
+        "tenure_months", "status", "total_amount", "paid_amount", "outstanding_amount", "last_payment_date"
+    ],
+    "Loan Payment": [
+        "loan", "customer", "branch", "payment_date", "amount", "payment_type",
+        "principal_paid", "interest_paid", "penalty_paid", "balance_after_payment"
+    ]
+}
+
+EVENTS = {
+    "on_submit": "Submit",
+    "on_cancel": "Cancel",
+    "on_trash": "Delete"
+}
+
+
+def is_change_feed_enabled():
+    return bool(frappe.db.get_single_value("Loan Settings", "enable_change_feed", cache=True))
+
+
+def get_payload(doc):
+    payload = {field: doc.get(field) for field in PAYLOAD_FIELDS[doc.doctype]}
+
+    if doc.doctype == "Loan Payment":
+        # Posting a payment changes the loan and its schedule with direct updates,
+        # so the resulting loan state and touched installments travel with it
+        payload["allocations"] = [
+            {"installment_number": row.installment_number, "allocated_amount": row.allocated_amount}
+            for row in doc.get("allocations") or []
+        ]
+        payload["loan_status"], payload["loan_outstanding_amount"] = frappe.db.get_value(
+            "Loan", doc.loan, ["status", "outstanding_amount"])
+
+    return payload
+
+
+def insert_change(event, reference_doctype, reference_name, loan, payload):
+    now, user = now_datetime(), frappe.session.user
+
+    frappe.db.sql("""
+        INSERT INTO `tabLoan Change Event`
+            (creation, modified, owner, modified_by, docstatus, idx,
+            event, reference_doctype, reference_name, loan, payload)
+        VALUES (%s, %s, %s, %s, 0, 0, %s, %s, %s, %s, %s)
+    """, (now, now, user, user, event, reference_doctype, reference_name, loan,
+          json.dumps(payload, default=str, separators=(",", ":"))))
+
+
+def record_change(doc, method=None):
+    """Append a change event for a Loan or Loan Payment; runs from doc_events"""
+    if not is_change_feed_enabled():
+        return
+
+    if method == "on_update":
+        event = "Update" if doc.get_doc_before_save() else "Insert"
+    else:
+        event = EVENTS[method]
+
+    loan = doc.name if doc.doctype == "Loan" else doc.loan
+    insert_change(event, doc.doctype, doc.name, loan, get_payload(doc))
+
+
+def read_changes(after, limit):
+    """Events after a cursor, cut short at a gap that may still be filled"""
+    rows = frappe.db.sql("""
+        SELECT name as seq, creation, event, reference_doctype, reference_name, loan, payload
+        FROM `tabLoan Change Event`
+        WHERE name > %(after)s
+        ORDER BY name
+        LIMIT %(limit)s
+    """, {"after": after, "limit": limit}, as_dict=True)
+
+    now, horizon = now_datetime(), None
+    changes, expected = [], after + 1
+    for row in rows:
+        if row.seq != expected:
+            if horizon is None:
+                horizon = get_gap_horizon()
+            if time_diff_in_seconds(now, row.creation) < horizon:
+                break
+
+        row.payload = json.loads(row.payload) if row.payload else {}
+        changes.append(row)
+        expected = row.seq + 1
+
+    return changes
+
+
+def get_gap_horizon():
+    """
+    Age in seconds below which an event after a gap may still see the gap filled
+
+    A missing sequence number is held by a transaction that started before
+    the next event was written, so the gap is open while any such writing
+    transaction is. Ages rather than times are compared, as the app and the
+    database may run in different time zones.
+    """
+    try:
+        oldest = frappe.db.sql("""
+            SELECT MAX(TIMESTAMPDIFF(SECOND, trx_started, NOW()))
+            FROM information_schema.innodb_trx
+            WHERE trx_mysql_thread_id != CONNECTION_ID()
+            AND trx_rows_modified > 0
+        """)[0][0]
+    except Exception:
+        # Reading innodb_trx needs the PROCESS privilege
+        return cint(frappe.db.get_single_value("Loan Settings", "change_feed_gap_settle_seconds", cache=True)) \
+            or DEFAULT_GAP_SETTLE_SECONDS
+
+    return cint(oldest) + GAP_SETTLE_SECONDS if oldest is not None else GAP_SETTLE_SECONDS
+
+
+@frappe.whitelist()
+def get_changes(after=0, limit=500):
+    """
+    Pull change events after a cursor
+
+    Args:
+        after (int): Sequence number of the last event already consumed, 0 to start
+        limit (int): Maximum number of events to return
+
+    Returns:
+        dict: changes, the cursor to pass next time and whether more are waiting
+    """
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    after, limit = cint(after), min(cint(limit) or 500, 5000)
+    changes = read_changes(after, limit)
+
+    return {
+        "changes": changes,
+        "cursor": changes[-1].seq if changes else after,
+        "has_more": len(changes) == limit
+    }
+
+
+def push_change_feed(batch_size=1000):
+    """Push new events to the configured sink; run every few minutes by the scheduler"""
+    settings = frappe.get_cached_doc("Loan Settings")
+    if not (settings.enable_change_feed and settings.change_feed_sink):
+        return
+
+    cursor, pushed = cint(settings.change_feed_sink_cursor), 0
+    while True:
+        changes = read_changes(cursor, batch_size)
+        if not changes:
+            break
+
+        lines = [json.dumps(change, default=str, separators=(",", ":")) for change in changes]
+        if settings.change_feed_sink == "File":
+            write_to_file(lines)
+        else:
+            write_to_queue(lines)
+
+        cursor = changes[-1].seq
+        pushed += len(changes)
+        # Commit the cursor with every batch so a crash resends at most one batch
+        frappe.db.set_single_value("Loan Settings", "change_feed_sink_cursor", cursor)
+        frappe.db.commit()
+
+    return {"pushed": pushed, "cursor": cursor}
+
+
+def write_to_file(lines):
+    """Append JSON lines to a daily file under the site's private folder"""
+    folder = frappe.get_site_path("private", "loan_change_feed")
+    os.makedirs(folder, exist_ok=True)
+
+    with open(os.path.join(folder, f"{now_datetime():%Y-%m-%d}.jsonl"), "a") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_to_queue(lines):
+    """Append JSON lines to a capped Redis list consumers can pop from"""
+    cache = frappe.cache()
+    key = cache.make_key(CHANGE_QUEUE_KEY)
+
+    cache.rpush(key, *lines)
+    cache.ltrim(key, -CHANGE_QUEUE_MAX_LENGTH, -1)
+
+
+def compact_change_feed(chunk_size=10000):
+    """
+    Drop events past retention that a later event of the same document supersedes
+
+    The latest event of every document is kept whatever its age, so a new
+    consumer can still rebuild current state from the feed. Delete events
+    are dropped once past retention. Runs daily from the scheduler.
+    """
+    retention_days = cint(frappe.db.get_single_value("Loan Settings", "change_feed_retention_days")) or 30
+    cutoff = add_days(now_datetime(), -retention_days)
+
+    deleted = 0
+    while True:
+        names = frappe.db.sql_list("""
+            SELECT e.name
+            FROM `tabLoan Change Event` e
+            WHERE e.creation < %(cutoff)s
+            AND (e.event = 'Delete' OR EXISTS (
+                SELECT 1 FROM `tabLoan Change Event` n
+                WHERE n.reference_doctype = e.reference_doctype
+                AND n.reference_name = e.reference_name
+                AND n.name > e.name
+            ))
+            LIMIT %(limit)s
+        """, {"cutoff": cutoff, "limit": chunk_size})
+        if not names:
+            break
+
+        frappe.db.delete("Loan Change Event", {"name": ["in", names]})
+        frappe.db.commit()
+        deleted += len(names)
+
+    return {"deleted": deleted, "cutoff": str(cutoff)}
+
+
+def benchmark_change_feed(events=10000, page_size=1000):
+    """
+    Measure write and read throughput of the feed; everything is rolled back
+
+    Run with `bench execute custom_loan.change_feed.benchmark_change_feed`.
+    """
+    events, page_size = cint(events), cint(page_size)
+    cursor = cint(frappe.db.sql("SELECT IFNULL(MAX(name), 0) FROM `tabLoan Change Event`")[0][0])
+    payload = {field: None for field in PAYLOAD_FIELDS["Loan Payment"]}
+
+    start = time.monotonic()
+    for i in range(events):
+        insert_change("Submit", "Loan Payment", f"BENCH-{i}", "BENCH", payload)
+    write_seconds = time.monotonic() - start
+
+    start, read = time.monotonic(), 0
+    while True:
+        changes = read_changes(cursor, page_size)
+        if not changes:
+            break
+        cursor = changes[-1].seq
+        read += len(changes)
+    read_seconds = time.monotonic() - start
+
+    frappe.db.rollback()
+
+    return {
+        "events": events,
+        "write_per_second": round(events / write_seconds) if write_seconds else None,
+        "read": read,
+        "read_per_second": round(read / read_seconds) if read_seconds else None
+    }
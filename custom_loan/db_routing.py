@@ -0,0 +1,153 @@
+"""
+Routing of read-only report and summary queries to a read replica
+
+The replica is the one Frappe itself uses, configured in site_config with
+`replica_host` and optionally `replica_db_port`, `replica_db_name` and
+`replica_db_password` (with `different_credentials_for_replica`). For a
+local test, point `replica_host` and `replica_db_port` at a second database
+server holding a copy of the site database.
+
+Functions decorated with use_replica run with frappe.db pointed at the
+replica when routing is switched on in Loan Settings and the replica is
+within the allowed lag. Otherwise, or if the replica cannot be reached,
+they run on the primary. Either way the outcome is counted per function.
+
+The replica connection is opened read only: a routed function that tries to
+write fails with MariaDB's read-only transaction error instead of changing
+the replica behind the primary's back.
+"""
+
+import time
+from functools import wraps
+
+import frappe
+import redis
+from frappe.utils import cint
+
+ROUTING_STATS_KEY = "custom_loan:db_routing"
+
+# Replication lag is read at most this often per worker
+LAG_CHECK_INTERVAL = 5
+_lag = {"checked_at": 0, "seconds": None}
+
+
+def is_routing_enabled():
+    return bool(frappe.conf.replica_host
+                and frappe.db.get_single_value("Loan Settings", "route_reads_to_replica", cache=True))
+
+
+def use_replica(fn):
+    """Run a read-only function on the read replica when it is fresh enough"""
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        # Already on the replica, e.g. a summary called from a routed report
+        if getattr(frappe.local, "replica_db", None) is not None and frappe.db is frappe.local.replica_db:
+            return fn(*args, **kwargs)
+
+        if not is_routing_enabled():
+            return fn(*args, **kwargs)
+
+        name = f"{fn.__module__}.{fn.__name__}"
+        max_lag = cint(frappe.db.get_single_value("Loan Settings", "replica_max_lag_seconds", cache=True))
+        try:
+            switch_to_replica()
+            lag = get_replica_lag()
+        except Exception:
+            switch_to_primary()
+            frappe.log_error(f"Read replica unavailable for {name}", "Read Replica")
+            record_route(name, "fallback_error")
+            return fn(*args, **kwargs)
+
+        if lag is None or (max_lag and lag > max_lag):
+            switch_to_primary()
+            record_route(name, "fallback_lag")
+            return fn(*args, **kwargs)
+
+        record_route(name, "replica")
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            switch_to_primary()
+
+    return wrapper
+
+
+def switch_to_replica():
+    from frappe.database import get_db
+
+    conf = frappe.local.conf
+    user, password = conf.db_name, conf.db_password
+    if conf.different_credentials_for_replica:
+        user, password = conf.replica_db_name, conf.replica_db_password
+
+    replica_db = get_db(host=conf.replica_host, user=user, password=password, port=conf.replica_db_port)
+    replica_db.connect()
+    replica_db.sql("SET SESSION TRANSACTION READ ONLY")
+
+    frappe.local.primary_db = frappe.local.db
+    frappe.local.replica_db = frappe.local.db = replica_db
+
+
+def switch_to_primary():
+    """Close the replica connection and put the primary back; safe to call twice"""
+    replica_db = getattr(frappe.local, "replica_db", None)
+    if replica_db is None:
+        return
+
+    frappe.local.db = frappe.local.primary_db
+    frappe.local.replica_db = frappe.local.primary_db = None
+    replica_db.close()
+
+
+def get_replica_lag():
+    """
+    Seconds the replica is behind the primary
+
+    Returns:
+        int: lag in seconds, 0 for a standalone copy with no replication
+             configured, or None when replication is broken
+    """
+    if time.monotonic() - _lag["checked_at"] < LAG_CHECK_INTERVAL:
+        return _lag["seconds"]
+
+    status = frappe.db.sql("SHOW SLAVE STATUS", as_dict=True)
+    if not status:
+        seconds = 0
+    else:
+        lag = status[0].get("Seconds_Behind_Master")
+        seconds = None if lag is None else cint(lag)
+
+    _lag.update(checked_at=time.monotonic(), seconds=seconds)
+
+    return seconds
+
+
+def record_route(name, outcome):
+    cache = frappe.cache()
+    cache.hincrby(cache.make_key(ROUTING_STATS_KEY), f"{name}|{outcome}", 1)
+
+
+@frappe.whitelist()
+def get_routing_stats():
+    """Counts of queries run on the replica or falling back to the primary, per function"""
+    frappe.only_for("System Manager")
+
+    cache = frappe.cache()
+    stats = {}
+    # Raw read: RedisWrapper.hgetall would prefix the key again and unpickle the integer counters
+    for field, count in redis.Redis.hgetall(cache, cache.make_key(ROUTING_STATS_KEY)).items():
+        name, outcome = frappe.safe_decode(field).split("|")
+        stats.setdefault(name, {"replica": 0, "fallback_lag": 0, "fallback_error": 0})[outcome] = int(count)
+
+    return {
+        "enabled": is_routing_enabled(),
+        "replica_lag_seconds": _lag["seconds"],
+        "functions": stats
+    }
+
+
+@frappe.whitelist()
+def reset_routing_stats():
+    frappe.only_for("System Manager")
+    frappe.cache().delete(frappe.cache().make_key(ROUTING_STATS_KEY))
@@ -3,17 +3,32 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import add_months, flt, cint
-import math
+from frappe.utils import flt
 from datetime import datetime, timedelta
+from custom_loan.api_payload import encode_payload, get_page_length, make_page, parse_fields
+from custom_loan.db_routing import use_replica
+from custom_loan.profiling import profiled
+from custom_loan.utils import build_repayment_schedule, calculate_loan_totals
+
+LOAN_SUMMARY_FIELDS = ["name", "customer", "customer_name", "branch", "loan_amount", "outstanding_amount", "status",
+					   "loan_date"]
+# Fields a caller may project get_loan_summary down to
+LOAN_PROJECTABLE_FIELDS = LOAN_SUMMARY_FIELDS + ["mobile_number", "loan_type", "interest_rate", "tenure_months",
+												 "emi_amount", "paid_amount", "last_payment_date"]
 
 
 class Loan(Document):
+	@profiled
 	def validate(self):
 		self.validate_amounts()
 		self.calculate_loan_amounts()
 		self.update_outstanding_amount()
 	
+	def onload(self):
+		# Archived schedules are decoded only when the form asks for them
+		if not self.repayment_schedule and frappe.db.exists("Loan Schedule Archive", self.name):
+			self.set_onload("has_archived_schedule", True)
+	
 	def on_submit(self):
 		self.generate_repayment_schedule()
 		self.status = "Active"
@@ -32,29 +47,14 @@ class Loan(Document):
 	
 	def calculate_loan_amounts(self):
 		"""Calculate total interest, total amount, and EMI"""
-		principal = flt(self.loan_amount)
-		rate = flt(self.interest_rate) / 100
-		tenure = cint(self.tenure_months)
-		
-		if self.loan_type == "Flat Rate":
-			# Flat interest calculation
-			self.total_interest = principal * rate * tenure
-			self.total_amount = principal + self.total_interest
-			self.emi_amount = self.total_amount / tenure
-		
-		elif self.loan_type == "EMI":
-			# EMI calculation using reducing balance
-			monthly_rate = rate / 12 if self.payment_frequency == "Monthly" else rate
-			
-			if monthly_rate == 0:
-				self.emi_amount = principal / tenure
-				self.total_interest = 0
-			else:
-				self.emi_amount = (principal * monthly_rate * math.pow(1 + monthly_rate, tenure)) / \
-								  (math.pow(1 + monthly_rate, tenure) - 1)
-			
-			self.total_amount = self.emi_amount * tenure
-			self.total_interest = self.total_amount - principal
+		if self.revised_from_installment and self.repayment_schedule:
+			# Installments before the revision keep the original rate, so the schedule is the only full record
+			self.total_interest = sum(flt(row.interest_amount) for row in self.repayment_schedule)
+			self.total_amount = flt(self.loan_amount) + self.total_interest
+		else:
+			totals = calculate_loan_totals(self.loan_type, self.loan_amount, self.interest_rate,
+										   self.tenure_months, self.payment_frequency)
+			self.update(totals)
 		
 		# Set outstanding amount if not set
 		if not self.outstanding_amount:
@@ -84,41 +84,10 @@ class Loan(Document):
 		"""Generate repayment schedule based on loan type"""
 		self.repayment_schedule = []
 		
-		start_date = self.loan_date
-		principal = flt(self.loan_amount)
-		remaining_principal = principal
-		
-		for month in range(1, self.tenure_months + 1):
-			due_date = add_months(start_date, month)
-			
-			if self.loan_type == "Flat Rate":
-				# Flat rate - same amount each month
-				installment_amount = flt(self.total_amount / self.tenure_months)
-				principal_amount = flt(self.loan_amount / self.tenure_months)
-				interest_amount = installment_amount - principal_amount
-			
-			elif self.loan_type == "EMI":
-				# EMI - reducing balance
-				installment_amount = flt(self.emi_amount)
-				interest_amount = remaining_principal * (flt(self.interest_rate) / 100)
-				principal_amount = installment_amount - interest_amount
-				
-				if principal_amount > remaining_principal:
-					principal_amount = remaining_principal
-					installment_amount = principal_amount + interest_amount
-			
-			remaining_principal -= principal_amount
-			
-			schedule_row = {
-				"installment_number": month,
-				"due_date": due_date,
-				"installment_amount": installment_amount,
-				"principal_amount": principal_amount,
-				"interest_amount": interest_amount,
-				"remaining_balance": max(0, remaining_principal),
-				"status": "Pending"
-			}
-			
+		for schedule_row in build_repayment_schedule(self.loan_type, self.loan_amount, self.interest_rate,
+													 self.tenure_months, self.loan_date,
+													 self.total_amount, self.emi_amount, self.payment_frequency):
+			schedule_row["status"] = "Pending"
 			self.append("repayment_schedule", schedule_row)
 	
 	def is_overdue(self):
@@ -160,29 +129,70 @@ class Loan(Document):
 		return overdue_amount
 
 
+def on_doctype_update():
+	# Branch managers list and filter their own book by status and date
+	frappe.db.add_index("Loan", ["branch", "status", "loan_date"])
+	# Bank reconciliation finds the loan from the mobile number in a UPI narration
+	frappe.db.add_index("Loan", ["mobile_number"])
+
+
 @frappe.whitelist()
-def get_loan_summary(customer=None):
-	"""Get loan summary for customer or all loans"""
+@profiled
+@use_replica
+def get_loan_summary(customer=None, branch=None, fields=None, cursor=None, page_length=None, encoding=None):
+	"""
+	Get loan summary for customer, branch or all loans the user may see
+	
+	Passing fields, cursor or page_length returns a page of loans, newest
+	first, with the cursor of the next page; the totals cover every page and
+	come with the first one only.
+	"""
 	filters = {"status": ["!=", "Closed"]}
 	if customer:
 		filters["customer"] = customer
+	if branch:
+		filters["branch"] = branch
+	
+	if not (fields or cursor or page_length):
+		# get_list applies the branch permission query for branch managers
+		loans = frappe.get_list("Loan",
+							   filters=filters,
+							   fields=LOAN_SUMMARY_FIELDS,
+							   limit_page_length=0)
+		
+		return encode_payload("get_loan_summary", {
+			"loans": loans,
+			"summary": get_summary_totals(len(loans),
+										  sum(loan.loan_amount for loan in loans),
+										  sum(loan.outstanding_amount for loan in loans))
+		}, encoding)
 	
-	loans = frappe.get_all("Loan",
-						   filters=filters,
-						   fields=["name", "customer", "customer_name", "loan_amount", 
-								  "outstanding_amount", "status", "loan_date"])
+	page_length = get_page_length(page_length)
+	loans = frappe.get_list("Loan",
+						   filters=dict(filters, name=["<", cursor]) if cursor else filters,
+						   fields=parse_fields(fields, LOAN_PROJECTABLE_FIELDS, always=["name"]) or LOAN_SUMMARY_FIELDS,
+						   order_by="name desc",
+						   limit_page_length=page_length + 1)
+	loans, next_cursor = make_page(loans, page_length)
 	
-	total_principal = sum(loan.loan_amount for loan in loans)
-	total_outstanding = sum(loan.outstanding_amount for loan in loans)
+	payload = {"loans": loans, "next_cursor": next_cursor}
+	if not cursor:
+		totals = frappe.get_list("Loan",
+								filters=filters,
+								fields=["count(name) as total_loans", "sum(loan_amount) as total_principal",
+										"sum(outstanding_amount) as total_outstanding"])[0]
+		payload["summary"] = get_summary_totals(totals.total_loans, flt(totals.total_principal),
+												flt(totals.total_outstanding))
 	
+	return encode_payload("get_loan_summary", payload, encoding)
+
+
+def get_summary_totals(total_loans, total_principal, total_outstanding):
 	return {
-		"loans": loans,
-		"summary": {
-			"total_loans": len(loans),
-			"total_principal": total_principal,
-			"total_outstanding": total_outstanding,
-			"collection_rate": ((total_principal - total_outstanding) / total_principal * 100) if total_principal else 0
-		}
+		"total_loans": total_loans,
+		"total_principal": total_principal,
+		"total_outstanding": total_outstanding,
+		"collection_rate": ((total_principal - total_outstanding) / total_principal * 100) if total_principal else 0
 	}
 
 
@@ -0,0 +1,91 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import json
+import os
+import shutil
+import subprocess
+import unittest
+
+import frappe
+from frappe.utils import getdate
+from custom_loan.utils import build_repayment_schedule, calculate_loan_totals, get_calculator_spec
+
+CASES_PATH = os.path.join(os.path.dirname(__file__), "calculator_cases.json")
+
+# Runs every case through loan_calculator.js and prints the results as JSON
+NODE_RUNNER = """
+const calculator = require(process.argv[1]);
+const input = JSON.parse(require("fs").readFileSync(0, "utf8"));
+console.log(JSON.stringify(calculator.batch_quote(input.cases, input.spec)));
+"""
+
+
+def quote(case):
+	"""Server-side totals and schedule for a calculator case"""
+	totals = calculate_loan_totals(case["loan_type"], case["principal"], case["interest_rate"],
+								   case["tenure_months"], case["payment_frequency"])
+	totals["schedule"] = build_repayment_schedule(case["loan_type"], case["principal"], case["interest_rate"],
+												  case["tenure_months"], getdate(case["start_date"]),
+												  totals["total_amount"], totals["emi_amount"], case["payment_frequency"])
+	for row in totals["schedule"]:
+		row["due_date"] = str(row["due_date"])
+
+	return totals
+
+
+class TestLoanCalculatorParity(unittest.TestCase):
+	def setUp(self):
+		"""Load the cases shared with the browser calculator"""
+		with open(CASES_PATH) as f:
+			self.cases = json.load(f)
+
+	def assert_same_quote(self, expected, actual, case):
+		for field in ("total_interest", "total_amount", "emi_amount"):
+			self.assertAlmostEqual(expected[field], actual[field], places=6, msg=f"{field} for {case}")
+
+		self.assertEqual(len(expected["schedule"]), len(actual["schedule"]))
+		for expected_row, actual_row in zip(expected["schedule"], actual["schedule"]):
+			self.assertEqual(expected_row["due_date"], actual_row["due_date"], msg=str(case))
+			for field in ("installment_amount", "principal_amount", "interest_amount", "remaining_balance"):
+				self.assertAlmostEqual(expected_row[field], actual_row[field], places=6,
+									   msg=f"{field} of installment {expected_row['installment_number']} for {case}")
+
+	def test_loan_amounts(self):
+		"""The Loan controller stores the expected totals and a schedule that repays the principal"""
+		for case in self.cases:
+			loan = frappe.get_doc({
+				"doctype": "Loan",
+				"loan_type": case["loan_type"],
+				"loan_amount": case["principal"],
+				"interest_rate": case["interest_rate"],
+				"tenure_months": case["tenure_months"],
+				"payment_frequency": case["payment_frequency"],
+				"loan_date": case["start_date"]
+			})
+			loan.calculate_loan_amounts()
+			loan.generate_repayment_schedule()
+
+			for field, expected in case["expected"].items():
+				self.assertAlmostEqual(loan.get(field), expected, places=2, msg=f"{field} for {case}")
+
+			schedule = loan.repayment_schedule
+			self.assertEqual(len(schedule), case["tenure_months"])
+			self.assertAlmostEqual(sum(row.principal_amount for row in schedule), case["principal"], places=6)
+			self.assertAlmostEqual(sum(row.installment_amount for row in schedule), loan.total_amount, places=2)
+			self.assertAlmostEqual(schedule[-1].remaining_balance, 0, places=6)
+			for row in schedule:
+				self.assertGreater(row.principal_amount, 0, msg=f"installment {row.installment_number} for {case}")
+
+	@unittest.skipUnless(shutil.which("node"), "node is not installed")
+	def test_browser_calculator_parity(self):
+		"""loan_calculator.js gives the same figures as the server for every case"""
+		script = frappe.get_app_path("custom_loan", "public", "js", "loan_calculator.js")
+		output = subprocess.run(
+			["node", "-e", NODE_RUNNER, script],
+			input=json.dumps({"cases": self.cases, "spec": get_calculator_spec()}),
+			capture_output=True, text=True, check=True
+		).stdout
+
+		for case, actual in zip(self.cases, json.loads(output)):
+			self.assert_same_quote(quote(case), actual, case)
@@ -3,10 +3,18 @@
 
 import frappe
 from frappe.model.document import Document
+from frappe.utils import cint, today
+from custom_loan.profiling import profiled
 from datetime import datetime
+import json
+import time
+
+LOAN_SOURCE_FIELDS = ["name", "status", "customer", "branch", "loan_type", "approved_amount", "approved_rate",
+					  "tenure_months", "purpose"]
 
 
 class LoanApplication(Document):
+	@profiled
 	def validate(self):
 		self.validate_amounts()
 		self.set_interest_rate()
@@ -43,7 +51,12 @@ class LoanApplication(Document):
 	
 	def create_loan(self):
 		"""Create loan document from approved application"""
-		if self.status != "Approved":
+		# Bulk conversion holds the same lock, and a locking read returns the latest committed status,
+		# so a conversion that finished meanwhile is seen here even if this document was loaded before it
+		status = frappe.db.sql("""
+			SELECT status FROM `tabLoan Application` WHERE name = %s FOR UPDATE
+		""", (self.name,))[0][0]
+		if status != "Approved" or self.status != "Approved":
 			frappe.throw("Only approved applications can be converted to loans")
 		
 		# Check if loan already exists
@@ -51,19 +64,7 @@ class LoanApplication(Document):
 		if existing_loan:
 			frappe.throw(f"Loan {existing_loan} already exists for this application")
 		
-		# Create new loan
-		loan = frappe.get_doc({
-			"doctype": "Loan",
-			"loan_application": self.name,
-			"customer": self.customer,
-			"loan_type": self.loan_type,
-			"loan_amount": self.approved_amount,
-			"interest_rate": self.approved_rate,
-			"tenure_months": self.tenure_months,
-			"purpose": self.purpose,
-			"status": "Active"
-		})
-		
+		loan = make_loan(self)
 		loan.insert()
 		
 		# Update application status
@@ -73,6 +74,34 @@ class LoanApplication(Document):
 		return loan.name
 
 
+def on_doctype_update():
+	# Review queues are worked per branch
+	frappe.db.add_index("Loan Application", ["branch", "status"])
+
+
+def make_loan(application):
+	"""Build a Loan with its repayment schedule from an approved application"""
+	loan = frappe.get_doc({
+		"doctype": "Loan",
+		"loan_application": application.name,
+		"customer": application.customer,
+		"branch": application.branch,
+		"loan_date": today(),
+		"loan_type": application.loan_type,
+		"loan_amount": application.approved_amount,
+		"interest_rate": application.approved_rate,
+		"tenure_months": application.tenure_months,
+		"purpose": application.purpose,
+		"status": "Active"
+	})
+	
+	# Schedule rows go in with the loan's own insert instead of a second save
+	loan.calculate_loan_amounts()
+	loan.generate_repayment_schedule()
+	
+	return loan
+
+
 @frappe.whitelist()
 def approve_application(application_name, approved_amount=None, approved_rate=None):
 	"""Approve loan application"""
@@ -103,7 +132,112 @@ def reject_application(application_name, rejection_reason):
 
 
 @frappe.whitelist()
+@profiled
 def convert_to_loan(application_name):
 	"""Convert approved application to loan"""
 	doc = frappe.get_doc("Loan Application", application_name)
 	return doc.create_loan()
+
+
+@frappe.whitelist()
+def disburse_approved_applications(applications=None, chunk_size=50, branch=None):
+	"""Queue conversion of approved applications (all of them, or a branch's, if none are given) into loans"""
+	frappe.only_for(["System Manager", "Loan Manager"])
+	
+	if isinstance(applications, str):
+		applications = json.loads(applications)
+	
+	frappe.enqueue(
+		"custom_loan.doctype.loan_application.loan_application.bulk_convert_to_loans",
+		queue="long",
+		timeout=3600,
+		applications=applications,
+		chunk_size=cint(chunk_size) or 50,
+		notify_user=frappe.session.user,
+		branch=branch
+	)
+	
+	return {"queued": True}
+
+
+def bulk_convert_to_loans(applications=None, chunk_size=50, notify_user=None, branch=None):
+	"""
+	Convert approved applications into loans, one transaction per chunk
+	
+	Safe to run again over the same applications: an application that already
+	has a loan is reported as skipped, never converted twice. A failure only
+	rolls back that one application.
+	"""
+	start = time.monotonic()
+	
+	if not applications:
+		filters = {"status": "Approved"}
+		if branch:
+			filters["branch"] = branch
+		
+		applications = frappe.get_all("Loan Application",
+									  filters=filters,
+									  order_by="approval_date asc",
+									  pluck="name")
+	
+	outcomes = []
+	for i in range(0, len(applications), chunk_size):
+		outcomes.extend(convert_chunk(applications[i:i + chunk_size]))
+		frappe.db.commit()
+	
+	result = {
+		"total": len(outcomes),
+		"created": len([o for o in outcomes if o["status"] == "Created"]),
+		"skipped": len([o for o in outcomes if o["status"] == "Skipped"]),
+		"failed": len([o for o in outcomes if o["status"] == "Failed"]),
+		"elapsed": round(time.monotonic() - start, 2),
+		"outcomes": outcomes
+	}
+	
+	if notify_user:
+		frappe.publish_realtime("custom_loan_bulk_disbursal", result, user=notify_user)
+	
+	return result
+
+
+def convert_chunk(application_names):
+	"""Convert one chunk of applications inside the current transaction"""
+	# Lock the applications so a parallel run or a manual conversion (create_loan) waits for this chunk
+	frappe.db.sql("""
+		SELECT name FROM `tabLoan Application` WHERE name IN %s FOR UPDATE
+	""", (tuple(application_names),))
+	
+	applications = frappe.get_all("Loan Application",
+								  filters={"name": ["in", application_names]},
+								  fields=LOAN_SOURCE_FIELDS)
+	existing_loans = dict(frappe.get_all("Loan",
+										 filters={"loan_application": ["in", application_names]},
+										 fields=["loan_application", "name"],
+										 as_list=True))
+	
+	outcomes = []
+	for application in applications:
+		if existing_loans.get(application.name):
+			outcomes.append({"application": application.name, "loan": existing_loans[application.name],
+							 "status": "Skipped", "message": "Loan already exists"})
+			continue
+		
+		if application.status != "Approved":
+			outcomes.append({"application": application.name, "loan": None,
+							 "status": "Skipped", "message": f"Application is {application.status}"})
+			continue
+		
+		frappe.db.savepoint("convert_application")
+		try:
+			loan = make_loan(application)
+			loan.insert()
+			frappe.db.set_value("Loan Application", application.name, "status", "Disbursed")
+			outcomes.append({"application": application.name, "loan": loan.name,
+							 "status": "Created", "message": None})
+		except Exception as e:
+			frappe.db.rollback(save_point="convert_application")
+			frappe.clear_messages()
+			outcomes.append({"application": application.name, "loan": None,
+							 "status": "Failed", "message": str(e)})
+	
+	return outcomes
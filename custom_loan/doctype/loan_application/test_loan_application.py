@@ -0,0 +1,141 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import frappe
+import threading
+import unittest
+from collections import Counter
+from unittest.mock import patch
+from frappe.utils import today
+from custom_loan.doctype.loan_application.loan_application import bulk_convert_to_loans
+from custom_loan.underwriting import MAX_EMI_TO_INCOME, score_application
+from custom_loan.utils import calculate_loan_totals
+
+
+class TestLoanApplicationUnderwriting(unittest.TestCase):
+	def setUp(self):
+		"""Set up test data"""
+		self.application = frappe._dict({
+			"loan_type": "Flat Rate",
+			"requested_amount": 50000,
+			"interest_rate": 2,
+			"tenure_months": 12,
+			"monthly_income": 30000,
+			"credit_score": 8,
+			"payment_frequency": "Monthly"
+		})
+
+	def test_good_application_is_approved(self):
+		"""Affordable request with good credit and no other loans"""
+		result = score_application(self.application)
+
+		self.assertEqual(result["underwriting_recommendation"], "Approve")
+		self.assertEqual(result["recommended_amount"], 50000)
+		self.assertEqual(result["recommended_rate"], 2)
+
+	def test_existing_obligations_reduce_amount(self):
+		"""Installments on open loans count against the income limit"""
+		exposure = frappe._dict(loans=2, outstanding=200000, monthly_obligation=12000, overdue_loans=1)
+		result = score_application(self.application, exposure)
+
+		self.assertGreater(result["emi_to_income_ratio"], MAX_EMI_TO_INCOME)
+		self.assertNotEqual(result["underwriting_recommendation"], "Approve")
+		self.assertLess(result["recommended_amount"], 50000)
+
+	def test_emi_application_uses_loan_installment(self):
+		"""An EMI application is measured against the EMI its Loan will charge, at the annual rate over 12"""
+		application = frappe._dict(self.application, loan_type="EMI", requested_amount=60000, interest_rate=24,
+								   monthly_income=10000)
+		result = score_application(application)
+
+		# 60000 at 2% a month over 12 months is an EMI of 5673.58
+		self.assertEqual(result["emi_to_income_ratio"], 56.74)
+		self.assertNotEqual(result["underwriting_recommendation"], "Approve")
+
+		# The recommended amount at the recommended rate takes exactly the allowed half of income
+		self.assertEqual(result["recommended_amount"], 52809.12)
+		totals = calculate_loan_totals("EMI", result["recommended_amount"], result["recommended_rate"], 12, "Monthly")
+		self.assertAlmostEqual(totals["emi_amount"], 5000, places=1)
+
+	def test_batch_scoring_needs_no_queries(self):
+		"""Scoring is pure computation once exposure is preloaded"""
+		applications = [frappe._dict(self.application, credit_score=i % 11) for i in range(20000)]
+		exposure = frappe._dict(loans=1, outstanding=20000, monthly_obligation=2000, overdue_loans=0)
+
+		with patch.object(frappe.db, "sql", side_effect=AssertionError("score_application queried the database")):
+			results = [score_application(application, exposure) for application in applications]
+
+		# Everything but credit is fixed at 44.56 points, so a credit score of 7 or more crosses the approval mark
+		recommendations = Counter(result["underwriting_recommendation"] for result in results)
+		self.assertEqual(recommendations, {"Approve": 4 * 1818, "Refer": 20000 - 4 * 1818})
+		for application, result in zip(applications, results):
+			self.assertEqual(result["underwriting_recommendation"],
+							 "Approve" if application.credit_score >= 7 else "Refer")
+
+
+class TestLoanConversion(unittest.TestCase):
+	def setUp(self):
+		"""An approved application, committed so that a worker connection can convert it"""
+		if not frappe.db.exists("Loan Customer", "Conversion Test Customer"):
+			frappe.get_doc({
+				"doctype": "Loan Customer",
+				"customer_name": "Conversion Test Customer",
+				"mobile_number": "9876500032",
+				"customer_type": "Individual",
+				"status": "Active"
+			}).insert()
+
+		self.application = frappe.get_doc({
+			"doctype": "Loan Application",
+			"customer": "Conversion Test Customer",
+			"application_date": today(),
+			"status": "Approved",
+			"loan_type": "Flat Rate",
+			"requested_amount": 10000,
+			"interest_rate": 2,
+			"tenure_months": 12
+		}).insert()
+		frappe.db.commit()
+
+	def test_converting_twice_creates_one_loan(self):
+		"""A manual conversion of a document loaded before a bulk run finished is refused"""
+		site, errors = frappe.local.site, []
+		# Loaded, and the transaction's snapshot taken, before the bulk run converts it
+		application = frappe.get_doc("Loan Application", self.application.name)
+
+		def convert():
+			frappe.init(site=site)
+			frappe.connect()
+			frappe.set_user("Administrator")
+			try:
+				result = bulk_convert_to_loans([self.application.name])
+				if result["created"] != 1:
+					errors.append(result["outcomes"])
+			except Exception as e:
+				errors.append(e)
+			finally:
+				frappe.destroy()
+
+		worker = threading.Thread(target=convert)
+		worker.start()
+		worker.join()
+		self.assertEqual(errors, [])
+
+		# Refused before a second Loan is inserted, not by the save that follows the insert
+		with self.assertRaisesRegex(frappe.ValidationError, "Only approved applications"):
+			application.create_loan()
+		frappe.db.rollback()
+
+		self.assertEqual(frappe.db.count("Loan", {"loan_application": self.application.name}), 1)
+		self.assertEqual(frappe.db.get_value("Loan Application", self.application.name, "status"), "Disbursed")
+
+	def tearDown(self):
+		"""Clean up committed test data"""
+		frappe.db.rollback()
+		loans = frappe.get_all("Loan", filters={"loan_application": self.application.name}, pluck="name")
+		for loan in loans:
+			frappe.delete_doc("Loan", loan, force=True)
+		frappe.db.delete("Loan Change Event", {"reference_name": ["in", loans + [self.application.name]]})
+		frappe.delete_doc("Loan Application", self.application.name, force=True)
+		frappe.delete_doc("Loan Customer", "Conversion Test Customer", force=True)
+		frappe.db.commit()
@@ -0,0 +1,15 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoanChangeEvent(Document):
+	pass
+
+
+def on_doctype_update():
+	# Compaction looks up the latest event of each document
+	frappe.db.add_index("Loan Change Event", ["reference_doctype", "reference_name"])
+	frappe.db.add_index("Loan Change Event", ["creation"])
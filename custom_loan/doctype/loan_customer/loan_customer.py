@@ -4,6 +4,25 @@
 
 import frappe
 from frappe.model.document import Document
+from custom_loan.api_payload import encode_payload, parse_fields
+from custom_loan.change_feed import get_payload, insert_change, is_change_feed_enabled
+from custom_loan.doctype.loan.loan import LOAN_PROJECTABLE_FIELDS
+from custom_loan.loan_state import get_loan_state, invalidate_loan_state
+from custom_loan.payoff import invalidate_payoff_quotes
+from custom_loan.profiling import profiled
+from custom_loan.utils import normalize_mobile_number
+
+ACTIVE_LOAN_FIELDS = ["name", "loan_amount", "outstanding_amount", "interest_rate", "status"]
+# Customer details sent to mobile agents asking for a compact summary
+COMPACT_CUSTOMER_FIELDS = ["name", "customer_name", "mobile_number", "status", "branch"]
+
+# Customer fields copied onto other doctypes, as {doctype: {copied field: Loan Customer field}}.
+# branch is fetched once and then left alone: a customer moving branch does not move their past business.
+DENORMALIZED_FIELDS = {
+	"Loan": {"customer_name": "customer_name", "mobile_number": "mobile_number"},
+	"Loan Application": {"customer_name": "customer_name", "mobile_number": "mobile_number"},
+	"Loan Payment": {"customer_name": "customer_name"}
+}
 
 
 class LoanCustomer(Document):
@@ -11,15 +30,19 @@ class LoanCustomer(Document):
 		self.validate_mobile_number()
 		self.set_full_name()
 	
+	def on_update(self):
+		self.propagate_denormalized_fields()
+	
 	def validate_mobile_number(self):
 		"""Validate mobile number format and check for duplicates"""
 		if self.mobile_number:
-			# Remove spaces and special characters
-			mobile = self.mobile_number.replace(" ", "").replace("-", "").replace("+", "")
+			# Stored as bare digits so loans and bank narrations can be matched on it exactly
+			mobile = normalize_mobile_number(self.mobile_number)
 			
 			# Check if it's a valid 10-digit mobile number
-			if not mobile.isdigit() or len(mobile) != 10:
+			if len(mobile) != 10:
 				frappe.throw("Please enter a valid 10-digit mobile number")
+			self.mobile_number = mobile
 			
 			# Check for duplicate mobile numbers
 			existing = frappe.db.get_value("Loan Customer", 
@@ -33,11 +56,24 @@ class LoanCustomer(Document):
 		if not self.customer_name:
 			self.customer_name = f"Customer-{self.mobile_number}"
 	
-	def get_active_loans(self):
-		"""Get all active loans for this customer"""
+	def propagate_denormalized_fields(self):
+		"""Refresh the copies held on loans, applications and payments in the background"""
+		if self.is_new():
+			return
+		
+		source_fields = {source for fields in DENORMALIZED_FIELDS.values() for source in fields.values()}
+		if any(self.has_value_changed(field) for field in source_fields):
+			frappe.enqueue(
+				"custom_loan.doctype.loan_customer.loan_customer.propagate_customer_fields",
+				customers=[self.name],
+				enqueue_after_commit=True
+			)
+	
+	def get_active_loans(self, fields=None):
+		"""Get all active loans for this customer, with the given fields or the usual ones"""
 		return frappe.get_all("Loan", 
 							  filters={"customer": self.name, "status": ["in", ["Active", "Approved"]]},
-							  fields=["name", "loan_amount", "outstanding_amount", "interest_rate", "status"])
+							  fields=fields or ACTIVE_LOAN_FIELDS)
 	
 	def get_total_outstanding(self):
 		"""Get total outstanding amount across all loans"""
@@ -58,14 +94,137 @@ class LoanCustomer(Document):
 							  limit=limit)
 
 
+def on_doctype_update():
+	frappe.db.add_index("Loan Customer", ["branch", "status"])
+
+
 @frappe.whitelist()
-def get_customer_summary(customer):
-	"""Get customer summary including loans and payments"""
+@profiled
+def get_customer_summary(customer, customer_fields=None, loan_fields=None, encoding=None):
+	"""
+	Get customer summary including loans and payments
+	
+	customer_fields and loan_fields trim the customer details and active loans
+	to the fields given; "compact" as customer_fields sends just the
+	identifying ones.
+	"""
 	doc = frappe.get_doc("Loan Customer", customer)
+	active_loans = doc.get_active_loans(parse_fields(loan_fields, LOAN_PROJECTABLE_FIELDS, always=["name"]))
 	
-	return {
-		"customer_details": doc.as_dict(),
-		"active_loans": doc.get_active_loans(),
+	if customer_fields == "compact":
+		customer_fields = COMPACT_CUSTOMER_FIELDS
+	customer_fields = parse_fields(customer_fields, frappe.get_meta("Loan Customer").get_valid_columns())
+	
+	return encode_payload("get_customer_summary", {
+		"customer_details": {field: doc.get(field) for field in customer_fields} if customer_fields else doc.as_dict(),
+		"active_loans": active_loans,
+		"loan_states": [get_loan_state(loan.name) for loan in active_loans],
 		"total_outstanding": doc.get_total_outstanding(),
 		"recent_payments": doc.get_payment_history()
-	}
+	}, encoding)
+
+
+def get_drift_condition(fields):
+	"""SQL condition matching rows whose copied fields differ from the customer"""
+	return " OR ".join(
+		f"COALESCE(t.`{target}`, '') != COALESCE(c.`{source}`, '')"
+		for target, source in fields.items()
+	)
+
+
+def propagate_customer_fields(customers=None):
+	"""
+	Copy customer fields onto every dependent row in set-based updates
+	
+	The updates skip the Loan hooks, so the loans they touch get their cached
+	state dropped and a change event here instead.
+	
+	Args:
+		customers (list): Limit to these customers; all customers when empty
+	"""
+	customer_condition = "AND c.name IN %(customers)s" if customers else ""
+	params = {"customers": tuple(customers or [])}
+	
+	loans = frappe.db.sql_list(f"""
+		SELECT t.name
+		FROM `tabLoan` t
+		INNER JOIN `tabLoan Customer` c ON c.name = t.customer
+		WHERE ({get_drift_condition(DENORMALIZED_FIELDS["Loan"])})
+		{customer_condition}
+	""", params)
+	
+	for doctype, fields in DENORMALIZED_FIELDS.items():
+		set_clause = ", ".join(f"t.`{target}` = c.`{source}`" for target, source in fields.items())
+		
+		frappe.db.sql(f"""
+			UPDATE `tab{doctype}` t
+			INNER JOIN `tabLoan Customer` c ON c.name = t.customer
+			SET {set_clause}
+			WHERE ({get_drift_condition(fields)})
+			{customer_condition}
+		""", params)
+	
+	record_changes = is_change_feed_enabled()
+	for loan in loans:
+		doc = frappe._dict(doctype="Loan", name=loan)
+		invalidate_loan_state(doc)
+		invalidate_payoff_quotes(doc)
+		
+		if record_changes:
+			insert_change("Update", "Loan", loan, loan, get_payload(frappe.get_doc("Loan", loan)))
+
+
+def normalize_mobile_numbers():
+	"""
+	Store mobile numbers saved before validation normalized them as bare digits
+	
+	The copies on loans and applications are refreshed with them. Run once with
+	`bench execute custom_loan.doctype.loan_customer.loan_customer.normalize_mobile_numbers`.
+	"""
+	changed = []
+	for name, mobile_number in frappe.db.sql("""
+		SELECT name, mobile_number
+		FROM `tabLoan Customer`
+		WHERE mobile_number REGEXP '[^0-9]' OR LENGTH(mobile_number) != 10
+	"""):
+		mobile = normalize_mobile_number(mobile_number)
+		if len(mobile) == 10:
+			frappe.db.set_value("Loan Customer", name, "mobile_number", mobile, update_modified=False)
+			changed.append(name)
+	
+	if changed:
+		propagate_customer_fields(changed)
+	frappe.db.commit()
+	
+	return {"updated": len(changed)}
+
+
+@frappe.whitelist()
+def find_customer_field_drift():
+	"""Count rows whose copied customer fields no longer match Loan Customer"""
+	frappe.only_for("System Manager")
+	
+	drift = {}
+	
+	for doctype, fields in DENORMALIZED_FIELDS.items():
+		drift[doctype] = frappe.db.sql(f"""
+			SELECT COUNT(*)
+			FROM `tab{doctype}` t
+			INNER JOIN `tabLoan Customer` c ON c.name = t.customer
+			WHERE {get_drift_condition(fields)}
+		""")[0][0]
+	
+	return drift
+
+
+@frappe.whitelist()
+def fix_customer_field_drift():
+	"""Find and repair drift across all customers; run daily by the scheduler as Administrator"""
+	frappe.only_for("System Manager")
+	
+	drift = find_customer_field_drift()
+	
+	if any(drift.values()):
+		propagate_customer_fields()
+	
+	return drift
@@ -3,6 +3,10 @@
 
 import frappe
 import unittest
+from frappe.utils import today
+from custom_loan.doctype.loan_customer.loan_customer import propagate_customer_fields
+from custom_loan.doctype.loan_payment.test_loan_payment import make_test_loan
+from custom_loan.loan_state import LOAN_STATE_KEY, get_loan_state
 
 class TestLoanCustomer(unittest.TestCase):
 	def setUp(self):
@@ -60,3 +64,52 @@ class TestLoanCustomer(unittest.TestCase):
 			frappe.db.delete("Loan Customer", {"mobile_number": "9876543210"})
 		except:
 			pass
+
+
+class TestCustomerFieldPropagation(unittest.TestCase):
+	def setUp(self):
+		"""A loan with a posted payment, its state cached, and the change feed on"""
+		self.loan = make_test_loan(mobile_number="9876500033", customer="Propagation Test Customer")
+		self.payment = frappe.get_doc({
+			"doctype": "Loan Payment",
+			"loan": self.loan.name,
+			"amount": 1240,
+			"payment_date": today()
+		}).insert()
+		self.payment.submit()
+		frappe.db.set_value("Loan Payment", self.payment.name, "branch", "Branch At Collection")
+		
+		get_loan_state(self.loan.name)
+		frappe.db.set_single_value("Loan Settings", "enable_change_feed", 1)
+		frappe.clear_cache(doctype="Loan Settings")
+	
+	def test_name_and_mobile_reach_loans_and_payments(self):
+		frappe.db.set_value("Loan Customer", self.loan.customer, {
+			"customer_name": "Propagation Test Renamed",
+			"mobile_number": "9876500034",
+			"branch": None
+		})
+		events = frappe.db.count("Loan Change Event", {"reference_name": self.loan.name})
+		
+		propagate_customer_fields([self.loan.customer])
+		
+		loan = frappe.db.get_value("Loan", self.loan.name, ["customer_name", "mobile_number"], as_dict=True)
+		self.assertEqual((loan.customer_name, loan.mobile_number), ("Propagation Test Renamed", "9876500034"))
+		self.assertEqual(frappe.db.get_value("Loan Payment", self.payment.name, "customer_name"),
+						 "Propagation Test Renamed")
+		# A posted collection stays with the branch that took it
+		self.assertEqual(frappe.db.get_value("Loan Payment", self.payment.name, "branch"), "Branch At Collection")
+		
+		# Counter screens rebuild the loan's state, and feed readers hear of the change
+		self.assertIsNone(frappe.cache().hget(LOAN_STATE_KEY, self.loan.name))
+		self.assertEqual(frappe.db.count("Loan Change Event", {"reference_name": self.loan.name}), events + 1)
+		
+		# Nothing drifts any more, so running again changes nothing
+		propagate_customer_fields([self.loan.customer])
+		self.assertEqual(frappe.db.count("Loan Change Event", {"reference_name": self.loan.name}), events + 1)
+	
+	def tearDown(self):
+		"""Clean up test data"""
+		frappe.cache().hdel(LOAN_STATE_KEY, self.loan.name)
+		frappe.db.rollback()
+		frappe.clear_cache(doctype="Loan Settings")
@@ -0,0 +1,14 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoanGLQueueEntry(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan GL Queue Entry", ["is_posted", "posting_date"])
+	frappe.db.add_index("Loan GL Queue Entry", ["reference_doctype", "reference_name"])
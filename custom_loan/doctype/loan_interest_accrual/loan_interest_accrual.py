@@ -0,0 +1,13 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoanInterestAccrual(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Interest Accrual", ["period_start", "loan"])
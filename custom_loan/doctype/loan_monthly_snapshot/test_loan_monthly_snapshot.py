@@ -0,0 +1,47 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import frappe
+import unittest
+from frappe.utils import add_months, get_first_day, today
+from custom_loan.doctype.loan_monthly_snapshot.loan_monthly_snapshot import take_monthly_snapshot
+from custom_loan.doctype.loan_payment.test_loan_payment import make_test_loan
+
+
+class TestLoanMonthlySnapshot(unittest.TestCase):
+	def setUp(self):
+		self.loan = make_test_loan(mobile_number="9876500030", customer="Snapshot Test Customer").name
+		self.last_month = add_months(today(), -1)
+
+	def get_bucket(self, as_of_date):
+		return frappe.db.get_value("Loan Monthly Snapshot",
+			{"loan": self.loan, "snapshot_month": get_first_day(as_of_date)}, "dpd_bucket")
+
+	def test_open_loan_is_recorded(self):
+		take_monthly_snapshot(today())
+
+		# The first installment fell due about a month ago
+		self.assertIn(self.get_bucket(today()), ["1-30", "31-60"])
+
+	def test_loan_closed_in_month_is_recorded_once(self):
+		frappe.db.set_value("Loan", self.loan, {"status": "Closed", "last_payment_date": self.last_month})
+
+		take_monthly_snapshot(self.last_month)
+		take_monthly_snapshot(today())
+
+		self.assertEqual(self.get_bucket(self.last_month), "Closed")
+		self.assertIsNone(self.get_bucket(today()))
+
+	def test_write_off_is_recorded_in_the_month_it_exits(self):
+		take_monthly_snapshot(self.last_month)
+		frappe.db.set_value("Loan", self.loan, "status", "Written Off")
+
+		take_monthly_snapshot(today())
+		take_monthly_snapshot(add_months(today(), 1))
+
+		self.assertEqual(self.get_bucket(today()), "Written Off")
+		self.assertIsNone(self.get_bucket(add_months(today(), 1)))
+
+	def tearDown(self):
+		"""Clean up test data"""
+		frappe.db.rollback()
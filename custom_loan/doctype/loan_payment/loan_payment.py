@@ -3,18 +3,41 @@
 
 import frappe
 from frappe.model.document import Document
-from frappe.utils import flt
+from frappe.utils import flt, today
+from custom_loan.duplicate_payments import find_duplicate, get_duplicate_action, get_payment_fingerprint
+from custom_loan.loan_state import get_loan_state
+from custom_loan.profiling import profiled
+from custom_loan.schedule_archive import restore_schedule
+from custom_loan.utils import get_penalty_due, lock_loan
 
 
 class LoanPayment(Document):
+	@profiled
 	def validate(self):
 		self.validate_amount()
+		self.check_duplicate_payment()
 		self.set_balance_amounts()
 		self.allocate_payment()
 	
+	@profiled
 	def on_submit(self):
+		# Postings against the same loan are serialised until this transaction commits
+		lock_loan(self.loan)
+		# A twin submitted in parallel passed validate unseen; under the loan lock it is visible
+		if get_duplicate_action() == "Reject":
+			self.check_duplicate_payment(submitted_only=True)
 		self.update_loan_balance()
 		self.update_repayment_schedule()
+		self.update_loan_status()
+	
+	@profiled
+	def on_cancel(self):
+		lock_loan(self.loan)
+		# Cancelling the closing payment reopens the loan, which needs its schedule back
+		restored = restore_schedule(self.loan)
+		self.reverse_repayment_schedule(by_installment_number=bool(restored))
+		self.reverse_loan_balance()
+		self.update_loan_status()
 	
 	def validate_amount(self):
 		"""Validate payment amount"""
@@ -27,6 +50,27 @@ class LoanPayment(Document):
 			if self.payment_type not in ["Prepayment", "Adjustment"]:
 				frappe.throw(f"Payment amount cannot exceed outstanding amount of {loan.outstanding_amount}")
 	
+	def check_duplicate_payment(self, submitted_only=False):
+		"""Flag or reject a payment matching another for the same loan, amount, date and reference"""
+		self.payment_fingerprint = get_payment_fingerprint(self.loan, self.amount, self.payment_date,
+															self.reference_number, self.payment_method)
+		
+		# Batch uploads check their rows up front with find_batch_duplicates
+		if self.flags.duplicate_checked:
+			return
+		
+		duplicate = find_duplicate(self.payment_fingerprint, exclude=self.name, submitted_only=submitted_only)
+		self.is_possible_duplicate = 1 if duplicate else 0
+		self.duplicate_of = duplicate
+		if not duplicate:
+			return
+		
+		if get_duplicate_action() == "Reject":
+			frappe.throw(f"Payment looks like a duplicate of {duplicate}: same loan, amount, date and reference",
+						 title="Duplicate Payment")
+		
+		frappe.msgprint(f"Payment looks like a duplicate of {duplicate}", indicator="orange", alert=True)
+	
 	def set_balance_amounts(self):
 		"""Set balance before and after payment"""
 		loan = frappe.get_doc("Loan", self.loan)
@@ -62,10 +106,8 @@ class LoanPayment(Document):
 		loan = frappe.get_doc("Loan", self.loan)
 		overdue_amount = loan.get_overdue_amount()
 		
-		# Simple penalty calculation - 1% of overdue amount per month
 		if overdue_amount > 0:
-			# This is a simplified penalty calculation
-			return overdue_amount * 0.01
+			return get_penalty_due(overdue_amount)
 		
 		return 0
 	
@@ -83,55 +125,171 @@ class LoanPayment(Document):
 	
 	def update_loan_balance(self):
 		"""Update loan outstanding amount"""
-		loan = frappe.get_doc("Loan", self.loan)
-		loan.paid_amount = (loan.paid_amount or 0) + self.amount
-		loan.outstanding_amount = loan.total_amount - loan.paid_amount
-		loan.last_payment_date = self.payment_date
+		# Re-read the balance under the loan lock; the value seen in validate may be stale
+		balance_before_payment = flt(frappe.db.get_value("Loan", self.loan, "outstanding_amount"))
+		if self.amount > balance_before_payment and self.payment_type not in ["Prepayment", "Adjustment"]:
+			frappe.throw(f"Payment amount cannot exceed outstanding amount of {balance_before_payment}")
 		
-		# Update status
-		if loan.outstanding_amount <= 0:
-			loan.status = "Closed"
-		elif loan.is_overdue():
-			loan.status = "Overdue"
-		else:
-			loan.status = "Active"
+		# Increment in place so concurrent writers can never overwrite each other
+		frappe.db.sql("""
+			UPDATE `tabLoan`
+			SET outstanding_amount = total_amount - COALESCE(paid_amount, 0) - %(amount)s,
+				paid_amount = COALESCE(paid_amount, 0) + %(amount)s,
+				last_payment_date = %(payment_date)s
+			WHERE name = %(loan)s
+		""", {"loan": self.loan, "amount": flt(self.amount), "payment_date": self.payment_date})
 		
-		loan.save()
+		self.db_set({
+			"balance_before_payment": balance_before_payment,
+			"balance_after_payment": max(0, balance_before_payment - flt(self.amount))
+		})
+	
+	def update_loan_status(self):
+		"""Refresh loan status once balance and schedule reflect this payment"""
+		outstanding_amount = flt(frappe.db.get_value("Loan", self.loan, "outstanding_amount"))
+		frappe.db.set_value("Loan", self.loan, "status", get_loan_status(self.loan, outstanding_amount))
 	
 	def update_repayment_schedule(self):
 		"""Update repayment schedule with payment allocation"""
-		loan = frappe.get_doc("Loan", self.loan)
 		remaining_payment = flt(self.amount)
 		
+		# Only unpaid installments are read and only the ones receiving money are written
+		schedules = frappe.db.sql("""
+			SELECT name, installment_number, due_date, installment_amount, paid_amount, paid_date, status
+			FROM `tabLoan Repayment Schedule`
+			WHERE parent = %s AND parenttype = 'Loan' AND status IN ('Pending', 'Partial')
+			ORDER BY idx
+		""", (self.loan,), as_dict=True)
+		
 		# Update schedule starting from oldest pending installment
-		for schedule in loan.repayment_schedule:
-			if schedule.status in ["Pending", "Partial"] and remaining_payment > 0:
-				outstanding_for_installment = schedule.installment_amount - (schedule.paid_amount or 0)
-				
-				if remaining_payment >= outstanding_for_installment:
-					# Full payment for this installment
-					schedule.paid_amount = schedule.installment_amount
-					schedule.paid_date = self.payment_date
-					schedule.status = "Paid"
-					remaining_payment -= outstanding_for_installment
-				else:
-					# Partial payment
-					schedule.paid_amount = (schedule.paid_amount or 0) + remaining_payment
-					schedule.status = "Partial"
-					remaining_payment = 0
+		for schedule in schedules:
+			if remaining_payment <= 0:
+				break
+			
+			outstanding_for_installment = schedule.installment_amount - (schedule.paid_amount or 0)
+			self.log_allocation(schedule, min(remaining_payment, outstanding_for_installment))
+			
+			if remaining_payment >= outstanding_for_installment:
+				# Full payment for this installment
+				values = {
+					"paid_amount": schedule.installment_amount,
+					"paid_date": self.payment_date,
+					"status": "Paid"
+				}
+				remaining_payment -= outstanding_for_installment
+			else:
+				# Partial payment
+				values = {
+					"paid_amount": (schedule.paid_amount or 0) + remaining_payment,
+					"status": "Partial"
+				}
+				remaining_payment = 0
+			
+			frappe.db.set_value("Loan Repayment Schedule", schedule.name, values, update_modified=False)
+	
+	def log_allocation(self, schedule, allocated_amount):
+		"""Record the amount applied to an installment so that cancel can undo it exactly"""
+		# The document is already saved when on_submit runs, so log rows are inserted directly
+		self.append("allocations", {
+			"installment_number": schedule.installment_number,
+			"schedule_row": schedule.name,
+			"due_date": schedule.due_date,
+			"allocated_amount": allocated_amount,
+			"previous_status": schedule.status,
+			"previous_paid_date": schedule.paid_date
+		}).db_insert()
+	
+	def reverse_repayment_schedule(self, by_installment_number=False):
+		"""
+		Undo the installment allocation recorded at submit
+		
+		A schedule restored from the archive has new row names, so its
+		installments are found by number instead.
+		"""
+		for allocation in self.allocations:
+			row = {"parent": self.loan, "parenttype": "Loan", "installment_number": allocation.installment_number} \
+				if by_installment_number else allocation.schedule_row
+			schedule = frappe.db.get_value("Loan Repayment Schedule", row,
+										   ["name", "installment_amount", "paid_amount", "paid_date"], as_dict=True)
+			if not schedule:
+				# Schedule was regenerated after this payment; nothing left to undo
+				continue
+			
+			paid_amount = max(0, flt(schedule.paid_amount) - flt(allocation.allocated_amount))
+			
+			if paid_amount <= 0:
+				status = "Pending"
+			elif paid_amount < flt(schedule.installment_amount):
+				status = "Partial"
+			else:
+				status = "Paid"
+			
+			frappe.db.set_value("Loan Repayment Schedule", schedule.name, {
+				"paid_amount": paid_amount,
+				"status": status,
+				"paid_date": schedule.paid_date if status == "Paid" else allocation.previous_paid_date
+			}, update_modified=False)
+	
+	def reverse_loan_balance(self):
+		"""Take this payment back out of the loan balance"""
+		last_payment = frappe.db.sql("""
+			SELECT payment_date
+			FROM `tabLoan Payment`
+			WHERE loan = %s AND docstatus = 1 AND name != %s
+			ORDER BY payment_date DESC
+			LIMIT 1
+		""", (self.loan, self.name))
 		
-		loan.save()
+		frappe.db.sql("""
+			UPDATE `tabLoan`
+			SET outstanding_amount = total_amount - GREATEST(COALESCE(paid_amount, 0) - %(amount)s, 0),
+				paid_amount = GREATEST(COALESCE(paid_amount, 0) - %(amount)s, 0),
+				last_payment_date = %(last_payment_date)s
+			WHERE name = %(loan)s
+		""", {
+			"loan": self.loan,
+			"amount": flt(self.amount),
+			"last_payment_date": last_payment[0][0] if last_payment else None
+		})
+
+
+def on_doctype_update():
+	# Branch collections are read by date range
+	frappe.db.add_index("Loan Payment", ["branch", "payment_date"])
+	frappe.db.add_index("Loan Payment", ["payment_fingerprint"])
+	# Bank reconciliation looks payments up by reference, and by amount within a date window
+	frappe.db.add_index("Loan Payment", ["reference_number"])
+	frappe.db.add_index("Loan Payment", ["amount", "payment_date"])
+
+
+def get_loan_status(loan, outstanding_amount):
+	"""Derive loan status from outstanding amount and unpaid installments past due"""
+	if outstanding_amount <= 0:
+		return "Closed"
+	
+	has_overdue = frappe.db.exists("Loan Repayment Schedule", {
+		"parent": loan,
+		"parenttype": "Loan",
+		"status": ["in", ["Pending", "Partial"]],
+		"due_date": ["<", today()]
+	})
+	
+	return "Overdue" if has_overdue else "Active"
 
 
 @frappe.whitelist()
-def create_payment(loan, amount, payment_date=None, payment_type="Regular Payment"):
+@profiled
+def create_payment(loan, amount, payment_date=None, payment_type="Regular Payment", payment_method=None,
+				   reference_number=None):
 	"""Create a loan payment"""
 	payment = frappe.get_doc({
 		"doctype": "Loan Payment",
 		"loan": loan,
 		"amount": amount,
 		"payment_date": payment_date or frappe.utils.today(),
-		"payment_type": payment_type
+		"payment_type": payment_type,
+		"payment_method": payment_method,
+		"reference_number": reference_number
 	})
 	
 	payment.insert()
@@ -139,17 +297,18 @@ def create_payment(loan, amount, payment_date=None, payment_type="Regular Paymen
 
 
 @frappe.whitelist()
+@profiled
 def get_payment_suggestion(loan):
 	"""Get suggested payment amount for next installment"""
-	loan_doc = frappe.get_doc("Loan", loan)
-	
-	# Find next pending installment
-	for schedule in loan_doc.repayment_schedule:
-		if schedule.status == "Pending":
-			return {
-				"suggested_amount": schedule.installment_amount,
-				"due_date": schedule.due_date,
-				"installment_number": schedule.installment_number
-			}
-	
-	return {"suggested_amount": loan_doc.outstanding_amount}
+	state = get_loan_state(loan)
+	if not state:
+		frappe.throw(f"Loan {loan} not found")
+	
+	if state.next_due:
+		return {
+			"suggested_amount": state.next_due["amount_due"],
+			"due_date": state.next_due["due_date"],
+			"installment_number": state.next_due["installment_number"]
+		}
+	
+	return {"suggested_amount": state.outstanding_amount}
@@ -0,0 +1,249 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import frappe
+import threading
+import time
+import unittest
+from unittest.mock import patch
+from frappe.utils import add_months, flt, today
+from custom_loan.duplicate_payments import find_batch_duplicates, get_payment_fingerprint
+from custom_loan.schedule_archive import archive_loan_schedules
+
+
+def make_test_loan(mobile_number="9876500001", customer="Payment Test Customer"):
+	"""Create a customer and a flat rate loan with a generated schedule"""
+	if not frappe.db.exists("Loan Customer", customer):
+		frappe.get_doc({
+			"doctype": "Loan Customer",
+			"customer_name": customer,
+			"mobile_number": mobile_number,
+			"customer_type": "Individual",
+			"status": "Active"
+		}).insert()
+
+	loan = frappe.get_doc({
+		"doctype": "Loan",
+		"customer": customer,
+		"loan_date": add_months(today(), -2),
+		"loan_type": "Flat Rate",
+		"loan_amount": 12000,
+		"interest_rate": 2,
+		"tenure_months": 12
+	})
+	loan.insert()
+	loan.generate_repayment_schedule()
+	loan.save()
+
+	return loan
+
+
+def delete_committed_loan(loan):
+	"""Remove a committed test loan with its payments, their postings and events, and its customer if now unused"""
+	frappe.db.rollback()
+	customer = frappe.db.get_value("Loan", loan, "customer")
+	payments = frappe.get_all("Loan Payment", filters={"loan": loan}, pluck="name")
+
+	# Submitted payments cannot go through delete_doc
+	if payments:
+		frappe.db.delete("Loan Payment Allocation", {"parent": ["in", payments]})
+		frappe.db.delete("Loan Payment", {"name": ["in", payments]})
+		frappe.db.delete("Loan GL Queue Entry", {"reference_name": ["in", payments]})
+	frappe.delete_doc("Loan", loan, force=True)
+	frappe.db.delete("Loan Change Event", {"reference_name": ["in", payments + [loan]]})
+
+	if customer and not frappe.db.exists("Loan", {"customer": customer}):
+		frappe.delete_doc("Loan Customer", customer, force=True)
+	frappe.db.commit()
+
+
+class TestLoanPayment(unittest.TestCase):
+	def setUp(self):
+		"""Set up test data"""
+		self.loan = make_test_loan()
+
+	def test_cancel_reverses_allocation(self):
+		"""Cancelling a payment restores the installments it touched"""
+		payment = frappe.get_doc({
+			"doctype": "Loan Payment",
+			"loan": self.loan.name,
+			"amount": 2000,
+			"payment_date": today()
+		})
+		payment.insert()
+		payment.submit()
+
+		# 14880 total over 12 months: first installment paid, second partial
+		self.assertEqual(len(payment.allocations), 2)
+		self.assertEqual(payment.allocations[0].allocated_amount, 1240)
+		self.assertEqual(payment.allocations[1].allocated_amount, 760)
+
+		payment.cancel()
+
+		loan = frappe.get_doc("Loan", self.loan.name)
+		self.assertEqual(loan.paid_amount, 0)
+		self.assertEqual(loan.outstanding_amount, loan.total_amount)
+		for schedule in loan.repayment_schedule[:2]:
+			self.assertEqual(schedule.status, "Pending")
+			self.assertEqual(schedule.paid_amount, 0)
+
+	def test_cancel_restores_archived_schedule(self):
+		"""Cancelling the closing payment of an archived loan brings its schedule back"""
+		payment = frappe.get_doc({
+			"doctype": "Loan Payment",
+			"loan": self.loan.name,
+			"amount": 14880,
+			"payment_date": today()
+		})
+		payment.insert()
+		payment.submit()
+		self.assertEqual(frappe.db.get_value("Loan", self.loan.name, "status"), "Closed")
+
+		archive_loan_schedules([self.loan.name])
+		self.assertFalse(frappe.get_doc("Loan", self.loan.name).repayment_schedule)
+
+		payment.cancel()
+
+		loan = frappe.get_doc("Loan", self.loan.name)
+		self.assertNotEqual(loan.status, "Closed")
+		self.assertEqual(len(loan.repayment_schedule), 12)
+		self.assertEqual({schedule.status for schedule in loan.repayment_schedule}, {"Pending"})
+		self.assertFalse(frappe.db.exists("Loan Schedule Archive", self.loan.name))
+
+	def test_concurrent_posting(self):
+		"""Payments posted in parallel against one loan must all be counted"""
+		threads, payments_per_thread, amount = 8, 5, 10
+		site = frappe.local.site
+		loan_name = self.loan.name
+		errors = []
+
+		# Worker connections only see committed data
+		frappe.db.commit()
+
+		def post_payments():
+			frappe.init(site=site)
+			frappe.connect()
+			frappe.set_user("Administrator")
+			try:
+				for i in range(payments_per_thread):
+					payment = frappe.get_doc({
+						"doctype": "Loan Payment",
+						"loan": loan_name,
+						"amount": amount,
+						"payment_date": today(),
+						# Same amount on the same day would otherwise read as a duplicate payment
+						"reference_number": f"CONCURRENT-TEST-{frappe.generate_hash(length=10)}"
+					})
+					payment.insert()
+					payment.submit()
+					frappe.db.commit()
+			except Exception as e:
+				frappe.db.rollback()
+				errors.append(e)
+			finally:
+				frappe.destroy()
+
+		self.addCleanup(delete_committed_loan, loan_name)
+
+		workers = [threading.Thread(target=post_payments) for i in range(threads)]
+		start = time.monotonic()
+		for worker in workers:
+			worker.start()
+		for worker in workers:
+			worker.join()
+		elapsed = time.monotonic() - start
+
+		total_payments = threads * payments_per_thread
+		frappe.logger("custom_loan").info(
+			f"test_concurrent_posting: {total_payments} payments on one loan in {elapsed:.2f}s "
+			f"({total_payments / elapsed:.1f} payments/s)")
+
+		self.assertEqual(errors, [])
+		self.assertEqual(frappe.db.count("Loan Payment", {"loan": loan_name, "docstatus": 1}), total_payments)
+
+		loan = frappe.db.get_value("Loan", loan_name, ["paid_amount", "outstanding_amount", "total_amount"], as_dict=True)
+		self.assertEqual(flt(loan.paid_amount), total_payments * amount)
+		self.assertEqual(flt(loan.outstanding_amount), flt(loan.total_amount) - total_payments * amount)
+
+		schedule_paid = frappe.db.sql("""
+			SELECT SUM(paid_amount) FROM `tabLoan Repayment Schedule` WHERE parent = %s
+		""", (loan_name,))[0][0]
+		self.assertEqual(flt(schedule_paid), total_payments * amount)
+
+	def tearDown(self):
+		"""Clean up test data"""
+		frappe.db.rollback()
+
+
+class TestDuplicatePayments(unittest.TestCase):
+	def setUp(self):
+		self.loan = make_test_loan(mobile_number="9876500048", customer="Duplicate Test Customer")
+
+	def set_duplicate_action(self, action):
+		frappe.db.set_single_value("Loan Settings", "duplicate_payment_action", action)
+		frappe.clear_cache(doctype="Loan Settings")
+
+	def make_payment(self, reference_number="UTR 0001"):
+		return frappe.get_doc({
+			"doctype": "Loan Payment",
+			"loan": self.loan.name,
+			"amount": 1240,
+			"payment_date": today(),
+			"payment_method": "Bank Transfer",
+			"reference_number": reference_number
+		})
+
+	def test_fingerprint_ignores_case_and_whitespace_in_reference(self):
+		fingerprint = get_payment_fingerprint(self.loan.name, 1240, today(), "UTR0001")
+
+		self.assertEqual(get_payment_fingerprint(self.loan.name, "1240.00", today(), " utr 0001\t"), fingerprint)
+		self.assertNotEqual(get_payment_fingerprint(self.loan.name, 1240, today(), "UTR0002"), fingerprint)
+		# Without a reference the payment method stands in
+		self.assertNotEqual(get_payment_fingerprint(self.loan.name, 1240, today(), None, "Cash"),
+			get_payment_fingerprint(self.loan.name, 1240, today(), None, "Bank Transfer"))
+
+	def test_batch_flags_repeats_within_the_batch(self):
+		rows = [
+			{"loan": self.loan.name, "amount": 1240, "payment_date": today(), "reference_number": "UTR 0001"},
+			{"loan": self.loan.name, "amount": 1240, "payment_date": today(), "reference_number": "UTR 0002"},
+			{"loan": self.loan.name, "amount": 1240, "payment_date": today(), "reference_number": "utr0001"},
+			{"loan": self.loan.name, "amount": 1240, "payment_date": today(), "reference_number": "UTR 0001"}
+		]
+
+		# Every repeat points at the first row it repeats
+		self.assertEqual(find_batch_duplicates(rows), [None, None, 0, 0])
+
+	def test_batch_flags_existing_payment(self):
+		payment = self.make_payment()
+		payment.insert()
+
+		rows = [
+			{"loan": self.loan.name, "amount": 1240, "payment_date": today(), "reference_number": "utr0001"},
+			{"loan": self.loan.name, "amount": 1240, "payment_date": today(), "reference_number": "UTR 0002"}
+		]
+		self.assertEqual(find_batch_duplicates(rows), [payment.name, None])
+
+	def test_reject_twin_submitted_in_parallel(self):
+		"""A twin that passed validate unseen is caught under the loan lock in on_submit"""
+		self.set_duplicate_action("Reject")
+		payment = self.make_payment()
+		payment.insert()
+		twin = self.make_payment(reference_number="utr0001")
+		# Checked up front as part of a batch, so its validate does not see the draft above
+		twin.flags.duplicate_checked = True
+
+		def submit_twin_first(loan):
+			# The twin's submission lands while this payment waits for the loan lock
+			twin.insert()
+			frappe.db.set_value("Loan Payment", twin.name, "docstatus", 1, update_modified=False)
+
+		with patch("custom_loan.doctype.loan_payment.loan_payment.lock_loan", side_effect=submit_twin_first):
+			with self.assertRaisesRegex(frappe.ValidationError, "looks like a duplicate"):
+				payment.submit()
+
+		self.assertEqual(payment.duplicate_of, twin.name)
+
+	def tearDown(self):
+		"""Clean up test data"""
+		frappe.db.rollback()
+		frappe.clear_cache(doctype="Loan Settings")
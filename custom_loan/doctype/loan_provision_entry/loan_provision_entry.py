@@ -0,0 +1,15 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoanProvisionEntry(Document):
+	pass
+
+
+def on_doctype_update():
+	frappe.db.add_index("Loan Provision Entry", ["provisioning_date", "loan"])
+	# Runs replaced by a rerun are kept for audit; the live run is read by date and superseded_by
+	frappe.db.add_index("Loan Provision Entry", ["provisioning_date", "superseded_by"])
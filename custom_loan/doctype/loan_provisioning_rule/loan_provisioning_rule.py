@@ -0,0 +1,26 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoanProvisioningRule(Document):
+	def validate(self):
+		self.validate_percent()
+		self.validate_duplicate()
+	
+	def validate_percent(self):
+		"""Validate provision percentage"""
+		if self.provision_percent < 0 or self.provision_percent > 100:
+			frappe.throw("Provision percentage must be between 0 and 100")
+	
+	def validate_duplicate(self):
+		"""Only one rule per DPD bucket and loan type"""
+		existing = frappe.db.get_value("Loan Provisioning Rule",
+									   {"dpd_bucket": self.dpd_bucket,
+										"loan_type": self.loan_type or "",
+										"name": ["!=", self.name]},
+									   "name")
+		if existing:
+			frappe.throw(f"Provisioning rule {existing} already covers this DPD bucket and loan type")
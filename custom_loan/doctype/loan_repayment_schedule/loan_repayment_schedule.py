@@ -1,8 +1,16 @@
 # Copyright (c) 2025, Your Company and contributors
 # For license information, please see license.txt
 
+import frappe
 from frappe.model.document import Document
 
 
 class LoanRepaymentSchedule(Document):
 	pass
+
+
+def on_doctype_update():
+	# Overdue, aging and collection queries all look up unpaid installments of a loan by due date
+	frappe.db.add_index("Loan Repayment Schedule", ["parent", "status", "due_date"])
+	# Bank reconciliation finds installments by amount within a date window
+	frappe.db.add_index("Loan Repayment Schedule", ["installment_amount", "due_date"])
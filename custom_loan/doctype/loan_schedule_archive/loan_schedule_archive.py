@@ -0,0 +1,8 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+from frappe.model.document import Document
+
+
+class LoanScheduleArchive(Document):
+	pass
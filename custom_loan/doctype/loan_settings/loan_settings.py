@@ -0,0 +1,15 @@
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.model.document import Document
+
+
+class LoanSettings(Document):
+	def validate(self):
+		self.validate_gl_posting()
+	
+	def validate_gl_posting(self):
+		"""GL posting needs ERPNext for Journal Entries"""
+		if self.enable_gl_posting and "erpnext" not in frappe.get_installed_apps():
+			frappe.throw("ERPNext must be installed to post loan transactions to the General Ledger")
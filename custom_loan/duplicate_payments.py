@@ -0,0 +1,166 @@
+"""
+Detection of payments posted twice
+
+Every Loan Payment carries a fingerprint of its loan, amount, date and bank
+reference (or payment method when there is no reference). The fingerprint
+column is indexed, so checking one payment is a single index lookup, and a
+batch of payments is checked with one query over all its fingerprints plus
+an in-memory set for repeats inside the batch itself.
+"""
+
+import hashlib
+
+import frappe
+from frappe.utils import cint, flt, getdate
+from custom_loan.permissions import get_branch_conditions
+
+
+def get_payment_fingerprint(loan, amount, payment_date, reference_number=None, payment_method=None):
+    """Hash identifying a collection, the same however the reference was typed"""
+    reference = "".join((reference_number or "").split()).upper() or f"METHOD:{payment_method or ''}"
+    key = f"{loan}|{flt(amount, 2):.2f}|{getdate(payment_date)}|{reference}"
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def get_duplicate_action():
+    return frappe.db.get_single_value("Loan Settings", "duplicate_payment_action", cache=True) or "Warn"
+
+
+def find_duplicate(fingerprint, exclude=None, submitted_only=False):
+    """Name of another live payment with the same fingerprint, if any"""
+    filters = {
+        "payment_fingerprint": fingerprint,
+        "docstatus": 1 if submitted_only else ["<", 2]
+    }
+    if exclude:
+        filters["name"] = ["!=", exclude]
+
+    return frappe.db.get_value("Loan Payment", filters, "name", order_by="creation asc")
+
+
+def get_existing_fingerprints(fingerprints, chunk_size=1000):
+    """Live payments for a set of fingerprints, as {fingerprint: payment}"""
+    fingerprints, existing = list(set(fingerprints)), {}
+    for i in range(0, len(fingerprints), chunk_size):
+        for fingerprint, name in frappe.db.sql("""
+            SELECT payment_fingerprint, name
+            FROM `tabLoan Payment`
+            WHERE payment_fingerprint IN %s
+            AND docstatus < 2
+            ORDER BY creation DESC
+        """, (tuple(fingerprints[i:i + chunk_size]),)):
+            existing[fingerprint] = name
+
+    return existing
+
+
+def find_batch_duplicates(payments):
+    """
+    Flag likely duplicates in a batch of payments before any is posted
+
+    Args:
+        payments (list): dicts with loan, amount, payment_date and reference_number and/or payment_method
+
+    Returns:
+        list: for each payment, None or what it duplicates; an existing payment
+              name or the index of an earlier row of the same batch
+    """
+    fingerprints = [
+        get_payment_fingerprint(p.get("loan"), p.get("amount"), p.get("payment_date"),
+                                p.get("reference_number"), p.get("payment_method"))
+        for p in payments
+    ]
+    existing = get_existing_fingerprints(fingerprints)
+
+    seen, duplicates = {}, []
+    for i, fingerprint in enumerate(fingerprints):
+        if fingerprint in existing:
+            duplicates.append(existing[fingerprint])
+        elif fingerprint in seen:
+            duplicates.append(seen[fingerprint])
+        else:
+            duplicates.append(None)
+            seen[fingerprint] = i
+
+    return duplicates
+
+
+@frappe.whitelist()
+def find_duplicate_payments(from_date=None, to_date=None, branch=None, flag=0):
+    """
+    Historical payments sharing a fingerprint
+
+    Args:
+        from_date (str): Earliest payment date to scan
+        to_date (str): Latest payment date to scan
+        branch (str): Only this branch
+        flag (int): Mark every payment after the first of its group as a possible duplicate
+
+    Returns:
+        list: groups of submitted payments, oldest first in each
+    """
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    filters = frappe._dict(from_date=from_date, to_date=to_date, branch=branch)
+    conditions = get_branch_conditions(filters)
+    if from_date:
+        conditions += " AND payment_date >= %(from_date)s"
+    if to_date:
+        conditions += " AND payment_date <= %(to_date)s"
+
+    rows = frappe.db.sql(f"""
+        SELECT p.payment_fingerprint, p.name, p.loan, p.customer, p.branch, p.amount, p.payment_date,
+            p.payment_method, p.reference_number, p.owner, p.creation
+        FROM `tabLoan Payment` p
+        INNER JOIN (
+            SELECT payment_fingerprint
+            FROM `tabLoan Payment`
+            WHERE docstatus = 1 AND IFNULL(payment_fingerprint, '') != '' {conditions}
+            GROUP BY payment_fingerprint
+            HAVING COUNT(*) > 1
+        ) d ON d.payment_fingerprint = p.payment_fingerprint
+        WHERE p.docstatus = 1
+        ORDER BY p.payment_fingerprint, p.creation
+    """, filters, as_dict=True)
+
+    groups = {}
+    for row in rows:
+        groups.setdefault(row.pop("payment_fingerprint"), []).append(row)
+
+    if cint(flag):
+        for payments in groups.values():
+            for payment in payments[1:]:
+                frappe.db.set_value("Loan Payment", payment.name,
+                                    {"is_possible_duplicate": 1, "duplicate_of": payments[0].name},
+                                    update_modified=False)
+
+    return list(groups.values())
+
+
+def backfill_payment_fingerprints(chunk_size=5000):
+    """
+    Fingerprint payments posted before fingerprints existed
+
+    Run once with `bench execute custom_loan.duplicate_payments.backfill_payment_fingerprints`.
+    """
+    updated = 0
+    while True:
+        payments = frappe.db.sql("""
+            SELECT name, loan, amount, payment_date, reference_number, payment_method
+            FROM `tabLoan Payment`
+            WHERE IFNULL(payment_fingerprint, '') = ''
+            LIMIT %s
+        """, (chunk_size,), as_dict=True)
+        if not payments:
+            break
+
+        for payment in payments:
+            frappe.db.sql("UPDATE `tabLoan Payment` SET payment_fingerprint = %s WHERE name = %s", (
+                get_payment_fingerprint(payment.loan, payment.amount, payment.payment_date,
+                                        payment.reference_number, payment.payment_method),
+                payment.name
+            ))
+        frappe.db.commit()
+        updated += len(payments)
+
+    return {"updated": updated}
@@ -0,0 +1,240 @@
+"""
+Optional General Ledger posting of loan transactions
+
+Submitting a loan or payment only appends rows to Loan GL Queue Entry, one
+cheap insert, so document latency does not depend on accounting. A
+background job later nets the queue into one Journal Entry per posting day
+and branch.
+"""
+
+import frappe
+from frappe.utils import flt, now_datetime
+
+QUEUE_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "posting_date", "entry_type", "amount", "loan", "branch", "reference_doctype", "reference_name"
+]
+
+# Debit and credit side of each entry type, as Loan Settings account fields
+ENTRY_ACCOUNTS = {
+    "Disbursal": ("loan_account", "disbursement_account"),
+    "Principal": ("collection_account", "loan_account"),
+    "Interest": ("collection_account", "interest_income_account"),
+    "Penalty": ("collection_account", "penalty_income_account")
+}
+
+
+def is_gl_posting_enabled():
+    return bool(frappe.db.get_single_value("Loan Settings", "enable_gl_posting", cache=True))
+
+
+def queue_postings(doc, entries):
+    """
+    Append postings for a document to the GL queue
+
+    Args:
+        doc (Document): Loan or Loan Payment the postings come from
+        entries (list): (posting date, entry type, amount) tuples
+    """
+    now, user = now_datetime(), frappe.session.user
+    loan = doc.name if doc.doctype == "Loan" else doc.loan
+
+    values = [
+        (frappe.generate_hash(length=10), now, now, user, user,
+         posting_date, entry_type, amount, loan, doc.get("branch"), doc.doctype, doc.name)
+        for posting_date, entry_type, amount in entries if flt(amount)
+    ]
+
+    if values:
+        frappe.db.bulk_insert("Loan GL Queue Entry", fields=QUEUE_FIELDS, values=values)
+
+
+def queue_loan_disbursal(doc, method=None):
+    """Queue the disbursal of a new loan"""
+    # Loan is not submittable, so the disbursal is queued when the loan is created
+    if is_gl_posting_enabled():
+        queue_postings(doc, [(doc.loan_date, "Disbursal", doc.loan_amount)])
+
+
+def adjust_loan_disbursal(doc, method=None):
+    """
+    Keep the queued disbursal in step with an edited or deleted loan
+
+    A disbursal still waiting in the queue is replaced; one already posted
+    gets an adjusting entry for the difference. A loan whose disbursal is
+    already in the General Ledger cannot be deleted.
+    """
+    if method == "on_update" and (doc.flags.in_insert or not (
+            doc.has_value_changed("loan_amount") or doc.has_value_changed("loan_date"))):
+        return
+
+    queued = frappe.db.sql("""
+        SELECT name, amount, is_posted, journal_entry
+        FROM `tabLoan GL Queue Entry`
+        WHERE reference_doctype = 'Loan' AND reference_name = %s AND entry_type = 'Disbursal'
+        FOR UPDATE
+    """, (doc.name,), as_dict=True)
+    if not queued:
+        # Created while GL posting was off
+        return
+
+    posted = [entry for entry in queued if entry.is_posted]
+    if method == "on_trash" and posted:
+        frappe.throw(f"Loan {doc.name} cannot be deleted, its disbursal is posted in "
+                     f"Journal Entry {posted[0].journal_entry}")
+
+    pending = [entry.name for entry in queued if not entry.is_posted]
+    if pending:
+        frappe.db.delete("Loan GL Queue Entry", {"name": ["in", pending]})
+
+    if method == "on_trash":
+        return
+
+    posted_amount = sum(flt(entry.amount) for entry in posted)
+    difference = flt(flt(doc.loan_amount) - posted_amount, 2)
+    if difference:
+        # Corrections to a posted disbursal go into today's books
+        queue_postings(doc, [(frappe.utils.today() if posted else doc.loan_date, "Disbursal", difference)])
+
+
+def queue_payment_postings(doc, method=None):
+    """Queue the principal, interest and penalty split of a submitted payment"""
+    if is_gl_posting_enabled():
+        queue_postings(doc, [
+            (doc.payment_date, "Principal", doc.principal_paid),
+            (doc.payment_date, "Interest", doc.interest_paid),
+            (doc.payment_date, "Penalty", doc.penalty_paid)
+        ])
+
+
+def reverse_payment_postings(doc, method=None):
+    """Withdraw a cancelled payment from the queue, or queue a reversal if already posted"""
+    pending = frappe.db.delete("Loan GL Queue Entry", {
+        "reference_doctype": doc.doctype,
+        "reference_name": doc.name,
+        "is_posted": 0
+    })
+
+    posted = frappe.get_all("Loan GL Queue Entry",
+                            filters={"reference_doctype": doc.doctype, "reference_name": doc.name,
+                                     "is_posted": 1},
+                            fields=["entry_type", "amount"])
+    if posted:
+        queue_postings(doc, [(frappe.utils.today(), p.entry_type, -flt(p.amount)) for p in posted])
+
+    return pending
+
+
+def flush_gl_queue():
+    """
+    Post queued entries as consolidated Journal Entries; run by the scheduler
+
+    Entries are netted per posting day, branch and entry type, so a branch's
+    activity for a day becomes one Journal Entry however many documents it
+    came from. Each entry is committed on its own so a bad day does not hold
+    back the others.
+    """
+    if not is_gl_posting_enabled():
+        return
+
+    settings = frappe.get_cached_doc("Loan Settings")
+    groups = frappe.db.sql("""
+        SELECT DISTINCT posting_date, IFNULL(branch, '') as branch
+        FROM `tabLoan GL Queue Entry`
+        WHERE is_posted = 0
+        ORDER BY posting_date
+    """, as_dict=True)
+
+    cost_centers = dict(frappe.get_all("Loan Branch", fields=["name", "cost_center"], as_list=True))
+
+    posted = []
+    for group in groups:
+        try:
+            journal_entry = post_queue_group(settings, group.posting_date, group.branch,
+                                             cost_centers.get(group.branch) or settings.cost_center)
+            frappe.db.commit()
+            if journal_entry:
+                posted.append(journal_entry)
+        except Exception:
+            frappe.db.rollback()
+            frappe.log_error(f"Loan GL posting failed for {group.posting_date} {group.branch}", "Loan GL Posting")
+
+    return posted
+
+
+def post_queue_group(settings, posting_date, branch, cost_center):
+    """
+    Post one day's queued entries for a branch
+
+    The entries are locked and read by name, and only those names are marked
+    posted, so an entry queued while the Journal Entry is being made waits
+    for the next flush instead of being marked without its amount.
+    """
+    entries = frappe.db.sql("""
+        SELECT name, entry_type, amount
+        FROM `tabLoan GL Queue Entry`
+        WHERE is_posted = 0 AND posting_date = %(posting_date)s AND IFNULL(branch, '') = %(branch)s
+        FOR UPDATE
+    """, {"posting_date": posting_date, "branch": branch}, as_dict=True)
+    if not entries:
+        return None
+
+    totals = {}
+    for entry in entries:
+        totals[entry.entry_type] = totals.get(entry.entry_type, 0) + flt(entry.amount)
+    rows = [frappe._dict(entry_type=entry_type, amount=amount) for entry_type, amount in totals.items()]
+
+    journal_entry = make_journal_entry(settings, posting_date, rows, cost_center)
+    frappe.db.sql("""
+        UPDATE `tabLoan GL Queue Entry`
+        SET is_posted = 1, journal_entry = %(journal_entry)s
+        WHERE name IN %(names)s
+    """, {"journal_entry": journal_entry, "names": tuple(entry.name for entry in entries)})
+
+    return journal_entry
+
+
+def make_journal_entry(settings, posting_date, rows, cost_center=None):
+    """Create and submit one Journal Entry for a day's netted postings"""
+    cost_center = cost_center or settings.cost_center
+    accounts = []
+
+    for row in rows:
+        amount = flt(row.amount, 2)
+        if not amount:
+            continue
+
+        debit_field, credit_field = ENTRY_ACCOUNTS[row.entry_type]
+        if amount < 0:
+            # Net reversals swap sides
+            debit_field, credit_field, amount = credit_field, debit_field, -amount
+
+        accounts.append({"account": settings.get(debit_field), "debit_in_account_currency": amount,
+                         "cost_center": cost_center, "user_remark": f"Loan {row.entry_type}"})
+        accounts.append({"account": settings.get(credit_field), "credit_in_account_currency": amount,
+                         "cost_center": cost_center, "user_remark": f"Loan {row.entry_type}"})
+
+    if not accounts:
+        return None
+
+    journal_entry = frappe.get_doc({
+        "doctype": "Journal Entry",
+        "voucher_type": "Journal Entry",
+        "company": settings.company,
+        "posting_date": posting_date,
+        "user_remark": f"Loan transactions for {posting_date}",
+        "accounts": accounts
+    })
+    journal_entry.insert(ignore_permissions=True)
+    journal_entry.submit()
+
+    return journal_entry.name
+
+
+@frappe.whitelist()
+def post_gl_queue_now():
+    """Flush the GL queue in the background without waiting for the scheduler"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+    frappe.enqueue("custom_loan.gl_posting.flush_gl_queue", queue="long")
+
+    return {"queued": True}
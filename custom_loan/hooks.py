@@ -13,7 +13,10 @@ app_version = __version__
 
 # include js, css files in header of desk.html
 app_include_css = "/assets/custom_loan/css/custom_loan.css"
-app_include_js = "/assets/custom_loan/js/custom_loan.js"
+app_include_js = [
+	"/assets/custom_loan/js/loan_calculator.js",
+	"/assets/custom_loan/js/custom_loan.js"
+]
 
 # include js, css files in header of web template
 # web_include_css = "/assets/custom_loan/css/custom_loan.css"
@@ -61,6 +64,12 @@ app_include_js = "/assets/custom_loan/js/custom_loan.js"
 #	"filters": "custom_loan.utils.jinja_filters"
 # }
 
+# Boot
+# ----
+
+# Calculator rules for loan_calculator.js
+boot_session = "custom_loan.utils.boot_session"
+
 # Installation
 # ------------
 
@@ -89,26 +98,75 @@ app_include_js = "/assets/custom_loan/js/custom_loan.js"
 # before_app_uninstall = "custom_loan.utils.before_app_uninstall"
 # after_app_uninstall = "custom_loan.utils.after_app_uninstall"
 
+# Permissions
+# -----------
+# Permissions evaluated in scripted ways
+
+permission_query_conditions = {
+	"Loan": "custom_loan.permissions.loan_query",
+	"Loan Customer": "custom_loan.permissions.loan_customer_query",
+	"Loan Application": "custom_loan.permissions.loan_application_query",
+	"Loan Payment": "custom_loan.permissions.loan_payment_query"
+}
+
+# Document Events
+# ---------------
+# Hook on document methods and events
+
+doc_events = {
+	"Loan": {
+		"after_insert": "custom_loan.gl_posting.queue_loan_disbursal",
+		"on_update": [
+			"custom_loan.gl_posting.adjust_loan_disbursal",
+			"custom_loan.loan_state.invalidate_loan_state",
+			"custom_loan.payoff.invalidate_payoff_quotes",
+			"custom_loan.change_feed.record_change"
+		],
+		"on_trash": [
+			"custom_loan.gl_posting.adjust_loan_disbursal",
+			"custom_loan.loan_state.invalidate_loan_state",
+			"custom_loan.payoff.invalidate_payoff_quotes",
+			"custom_loan.change_feed.record_change"
+		]
+	},
+	"Loan Payment": {
+		"on_submit": [
+			"custom_loan.loan_state.invalidate_loan_state",
+			"custom_loan.gl_posting.queue_payment_postings",
+			"custom_loan.payoff.invalidate_payoff_quotes",
+			"custom_loan.change_feed.record_change"
+		],
+		"on_cancel": [
+			"custom_loan.loan_state.invalidate_loan_state",
+			"custom_loan.gl_posting.reverse_payment_postings",
+			"custom_loan.payoff.invalidate_payoff_quotes",
+			"custom_loan.change_feed.record_change"
+		]
+	}
+}
+
 # Auto-update related
 # -------------------
 # Notification for scheduled jobs
-# scheduler_events = {
-#	"all": [
-#		"custom_loan.tasks.all"
-#	],
-#	"daily": [
-#		"custom_loan.tasks.daily"
-#	],
-#	"hourly": [
-#		"custom_loan.tasks.hourly"
-#	],
-#	"weekly": [
-#		"custom_loan.tasks.weekly"
-#	],
-#	"monthly": [
-#		"custom_loan.tasks.monthly"
-#	],
-# }
+scheduler_events = {
+	"cron": {
+		"*/5 * * * *": [
+			"custom_loan.change_feed.push_change_feed"
+		]
+	},
+	"daily": [
+		"custom_loan.doctype.loan_customer.loan_customer.fix_customer_field_drift",
+		"custom_loan.loan_state.warm_loan_state_cache",
+		"custom_loan.gl_posting.flush_gl_queue",
+		"custom_loan.change_feed.compact_change_feed"
+	],
+	"monthly": [
+		"custom_loan.doctype.loan_monthly_snapshot.loan_monthly_snapshot.take_monthly_snapshot",
+		"custom_loan.schedule_archive.archive_closed_loan_schedules",
+		"custom_loan.provisioning.run_provisioning",
+		"custom_loan.interest_accrual.post_monthly_accruals"
+	],
+}
 
 # Testing
 # -------
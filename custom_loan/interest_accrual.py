@@ -0,0 +1,204 @@
+"""
+Daily interest accrual with month-end posting of period aggregates
+
+Each installment's `interest_amount` is earned evenly over the days between
+the previous due date (or the loan date for the first installment) and its
+own due date. Interest paid on an installment is taken from its paid amount,
+interest first, the same order used when allocating a payment. A closed
+loan stops earning interest after its last payment: nothing accrues or
+falls due past that date.
+"""
+
+import time
+
+import frappe
+from frappe.utils import add_days, add_months, flt, get_first_day, get_last_day, getdate, now_datetime, today
+
+ACCRUAL_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "period_start", "period_end", "loan", "loan_type",
+    "accrued_interest", "interest_due", "accrued_unpaid_interest"
+]
+
+
+def get_months(from_date, to_date):
+    """(start, end) of each calendar month touching the range, clipped to it"""
+    months = []
+    month_start = get_first_day(from_date)
+
+    while month_start <= to_date:
+        months.append((max(month_start, from_date), min(get_last_day(month_start), to_date)))
+        month_start = add_months(month_start, 1)
+
+    return months
+
+
+def overlap_days(start, end, period_start, period_end):
+    """Days of the accrual window [start, end) that fall inside [period_start, period_end]"""
+    return max(0, (min(end, add_days(period_end, 1)) - max(start, period_start)).days)
+
+
+def get_accrual_window(loan_date, installment_number, due_date):
+    """(start, length in days) of the window over which an installment's interest is earned"""
+    start = getdate(add_months(loan_date, installment_number - 1))
+    return start, max((due_date - start).days, 1)
+
+
+def get_earned_interest(interest_amount, start, window, upto):
+    """Interest of an installment earned from the window start through upto, inclusive"""
+    if upto < start:
+        return 0
+    return min(flt(interest_amount), flt(interest_amount) / window * (add_days(upto, 1) - start).days)
+
+
+def compute_accruals(from_date, to_date):
+    """
+    Accrued interest per loan and month for a date range, in one batch pass
+
+    Only installments that can still contribute are read: those falling due
+    in or after the range and those not yet fully paid, of loans open at
+    some point in the range. A loan closed since then earned interest up to
+    its last payment and none after.
+
+    Returns:
+        list: dicts with loan, loan_type, period_start, period_end,
+              accrued_interest, interest_due, accrued_unpaid_interest
+    """
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    months = get_months(from_date, to_date)
+
+    installments = frappe.db.sql("""
+        SELECT l.name as loan, l.loan_type, l.loan_date, l.status, l.last_payment_date,
+            s.installment_number, s.due_date, s.interest_amount,
+            LEAST(IFNULL(s.paid_amount, 0), s.interest_amount) as interest_paid
+        FROM `tabLoan` l
+        INNER JOIN `tabLoan Repayment Schedule` s ON s.parent = l.name AND s.parenttype = 'Loan'
+        WHERE l.loan_date <= %(to_date)s
+        AND (l.status IN ('Active', 'Overdue') OR l.last_payment_date >= %(from_date)s)
+        AND (s.due_date >= %(from_date)s OR s.status != 'Paid')
+    """, {"from_date": from_date, "to_date": to_date}, as_dict=True)
+
+    accruals = {}
+    for row in installments:
+        start, window = get_accrual_window(row.loan_date, row.installment_number, row.due_date)
+        end = row.due_date
+        # Paid off before this installment fell due: it earns up to the closing payment and never falls due
+        closed_early = row.status == "Closed" and row.last_payment_date and getdate(row.last_payment_date) < end
+        if closed_early:
+            end = add_days(getdate(row.last_payment_date), 1)
+        daily_interest = flt(row.interest_amount) / window
+
+        for period_start, period_end in months:
+            accrued = daily_interest * overlap_days(start, end, period_start, period_end)
+            due = flt(row.interest_amount) if period_start <= end <= period_end and not closed_early else 0
+            earned = get_earned_interest(row.interest_amount, start, window, min(period_end, add_days(end, -1)))
+            unpaid = max(0, earned - flt(row.interest_paid)) if earned else 0
+
+            if not (accrued or due or unpaid):
+                continue
+
+            key = (row.loan, period_start)
+            if key not in accruals:
+                accruals[key] = frappe._dict(
+                    loan=row.loan, loan_type=row.loan_type,
+                    period_start=period_start, period_end=period_end,
+                    accrued_interest=0, interest_due=0, accrued_unpaid_interest=0
+                )
+
+            accruals[key].accrued_interest += accrued
+            accruals[key].interest_due += due
+            accruals[key].accrued_unpaid_interest += unpaid
+
+    for accrual in accruals.values():
+        for field in ("accrued_interest", "interest_due", "accrued_unpaid_interest"):
+            accrual[field] = flt(accrual[field], 2)
+
+    return list(accruals.values())
+
+
+def post_monthly_accruals(month=None):
+    """
+    Store accrual aggregates for a whole month; run monthly by the scheduler
+
+    Defaults to the previous month. Posting the same month again replaces it,
+    so month-end closing only ever has to read the stored rows.
+    """
+    start = time.monotonic()
+    period_start = get_first_day(month or add_months(today(), -1))
+    period_end = get_last_day(period_start)
+
+    accruals = compute_accruals(period_start, period_end)
+
+    now, user = now_datetime(), frappe.session.user
+    values = [
+        (frappe.generate_hash(length=10), now, now, user, user,
+         a.period_start, a.period_end, a.loan, a.loan_type,
+         a.accrued_interest, a.interest_due, a.accrued_unpaid_interest)
+        for a in accruals
+    ]
+
+    frappe.db.delete("Loan Interest Accrual", {"period_start": period_start})
+    frappe.db.bulk_insert("Loan Interest Accrual", fields=ACCRUAL_FIELDS, values=values)
+
+    return {
+        "period_start": str(period_start),
+        "loans": len(values),
+        "accrued_interest": flt(sum(a.accrued_interest for a in accruals), 2),
+        "elapsed": round(time.monotonic() - start, 2)
+    }
+
+
+@frappe.whitelist()
+def get_accrued_interest(from_date, to_date, loan_type=None):
+    """Month-wise accrual totals read from the posted period aggregates"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    conditions = "AND loan_type = %(loan_type)s" if loan_type else ""
+
+    return frappe.db.sql(f"""
+        SELECT period_start, period_end,
+            COUNT(*) as loans,
+            SUM(accrued_interest) as accrued_interest,
+            SUM(interest_due) as interest_due,
+            SUM(accrued_unpaid_interest) as accrued_unpaid_interest
+        FROM `tabLoan Interest Accrual`
+        WHERE period_start >= %(from_date)s AND period_start <= %(to_date)s
+        {conditions}
+        GROUP BY period_start, period_end
+        ORDER BY period_start
+    """, {
+        "from_date": get_first_day(from_date),
+        "to_date": getdate(to_date),
+        "loan_type": loan_type
+    }, as_dict=True)
+
+
+@frappe.whitelist()
+def compute_interest_accrual(from_date, to_date):
+    """Ad-hoc accrual for any date range, computed without storing anything"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    accruals = compute_accruals(from_date, to_date)
+
+    return {
+        "loans": len({a.loan for a in accruals}),
+        "accrued_interest": flt(sum(a.accrued_interest for a in accruals), 2),
+        "accrued_unpaid_interest": flt(sum(
+            a.accrued_unpaid_interest for a in accruals if a.period_end == getdate(to_date)
+        ), 2),
+        "by_month": get_monthly_totals(accruals)
+    }
+
+
+def get_monthly_totals(accruals):
+    totals = {}
+    for a in accruals:
+        month = totals.setdefault(a.period_start, frappe._dict(
+            period_start=a.period_start, period_end=a.period_end,
+            accrued_interest=0, interest_due=0, accrued_unpaid_interest=0
+        ))
+        month.accrued_interest += a.accrued_interest
+        month.interest_due += a.interest_due
+        month.accrued_unpaid_interest += a.accrued_unpaid_interest
+
+    return [totals[period_start] for period_start in sorted(totals)]
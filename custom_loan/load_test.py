@@ -0,0 +1,290 @@
+"""
+Load test simulating counter and field traffic against a local bench site
+
+Runs a weighted mix of the calls cashiers and field staff make all day, from
+a number of concurrent workers, and reports latency percentiles, error rates
+and lock contention for each concurrency level. Payments are concentrated on
+a few hot loans, as happens at a busy counter, to expose waits on the loan
+row lock taken when a payment is submitted.
+
+Everything the run creates is committed, so only run it on a throwaway copy
+of a site with `allow_tests` set in its site_config:
+
+    bench --site loadtest.local execute custom_loan.load_test.run_load_test \
+        --kwargs "{'concurrency': '5,10,20', 'duration': 60}"
+"""
+
+import json
+import os
+import random
+import threading
+import time
+
+import frappe
+from frappe.utils import cint, flt, now_datetime, today
+from custom_loan.doctype.loan_customer.loan_customer import get_customer_summary
+from custom_loan.doctype.loan_payment.loan_payment import create_payment, get_payment_suggestion
+from custom_loan.report.loan_portfolio_summary.loan_portfolio_summary import execute as portfolio_summary
+
+# Relative weight of each operation in the traffic mix
+OPERATION_MIX = {
+    "create_payment": 40,
+    "get_payment_suggestion": 30,
+    "get_customer_summary": 15,
+    "create_loan": 10,
+    "portfolio_report": 5
+}
+
+LOCK_STATUS_VARIABLES = ("Innodb_row_lock_waits", "Innodb_row_lock_time", "Innodb_deadlocks")
+
+LOAD_TEST_TAG = "LOADTEST"
+
+
+def run_load_test(concurrency="5,10,20", duration=60, hot_loans=5, hot_share=0.5, payment_amount=10,
+                  target_p95_ms=1000, max_error_rate=0.01, user="Administrator", seed=None):
+    """
+    Run the traffic mix at each concurrency level and build a capacity report
+
+    Args:
+        concurrency (str): Comma separated numbers of concurrent workers, one stage each
+        duration (int): Seconds each stage runs
+        hot_loans (int): Number of loans that take a large share of the payments
+        hot_share (float): Share of payments posted against the hot loans
+        payment_amount (float): Amount of every simulated payment
+        target_p95_ms (float): 95th percentile payment latency a stage must stay under
+        max_error_rate (float): Share of failed operations a stage may have
+        user (str): User the workers run as
+        seed (int): Random seed, to replay the same traffic
+
+    Returns:
+        dict: per-stage results and the highest concurrency that met the targets
+    """
+    if not frappe.conf.allow_tests:
+        frappe.throw("Load tests create real data; set allow_tests in site_config on a test site to run them")
+
+    rng = random.Random(seed)
+    pool = get_loan_pool(cint(hot_loans) or 5, rng)
+    options = frappe._dict(
+        hot_share=flt(hot_share),
+        payment_amount=flt(payment_amount) or 10,
+        user=user,
+        tag=f"{LOAD_TEST_TAG}-{now_datetime():%Y%m%d%H%M%S}"
+    )
+
+    stages = []
+    for workers in [cint(c) for c in str(concurrency).split(",") if cint(c) > 0]:
+        stages.append(run_stage(workers, cint(duration) or 60, pool, options, rng))
+
+    target_p95_ms, max_error_rate = flt(target_p95_ms), flt(max_error_rate)
+    sustained = [
+        stage["concurrency"] for stage in stages
+        if stage["error_rate"] <= max_error_rate
+        and (stage["operations"].get("create_payment", {}).get("p95_ms") or 0) <= target_p95_ms
+    ]
+
+    report = {
+        "site": frappe.local.site,
+        "tag": options.tag,
+        "mix": OPERATION_MIX,
+        "hot_loans": pool.hot,
+        "targets": {"payment_p95_ms": target_p95_ms, "max_error_rate": max_error_rate},
+        "max_sustained_concurrency": max(sustained) if sustained else 0,
+        "stages": stages
+    }
+    report["file"] = save_report(report)
+
+    return report
+
+
+def get_loan_pool(hot_loans, rng):
+    """Open loans and customers the workers draw from, with a few picked as hot"""
+    loans = frappe.get_all("Loan",
+                           filters={"status": ["in", ["Active", "Overdue"]], "outstanding_amount": [">", 0]},
+                           fields=["name", "customer"],
+                           limit_page_length=5000)
+    if not loans:
+        frappe.throw("The site needs open loans with an outstanding balance to run a load test")
+
+    return frappe._dict(
+        loans=[loan.name for loan in loans],
+        customers=list({loan.customer for loan in loans}),
+        hot=rng.sample([loan.name for loan in loans], min(hot_loans, len(loans)))
+    )
+
+
+def run_stage(workers, duration, pool, options, rng):
+    """Run the mix from a number of threads, each with its own site connection"""
+    lock_status = get_lock_status()
+    samples, lock = [], threading.Lock()
+    deadline = time.monotonic() + duration
+    site, sites_path = frappe.local.site, frappe.local.sites_path
+
+    threads = [
+        threading.Thread(target=run_worker,
+                         args=(site, sites_path, deadline, pool, options, random.Random(rng.random()), samples, lock))
+        for _ in range(workers)
+    ]
+    start = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - start
+
+    lock_status = {key: get_lock_status()[key] - value for key, value in lock_status.items()}
+    return summarize_stage(workers, elapsed, samples, lock_status)
+
+
+def run_worker(site, sites_path, deadline, pool, options, rng, samples, lock):
+    frappe.init(site=site, sites_path=sites_path)
+    frappe.connect()
+    frappe.set_user(options.user)
+
+    operations, weights = list(OPERATION_MIX), list(OPERATION_MIX.values())
+    results = []
+    try:
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            loan = pick_loan(pool, options, rng) if operation in ("create_payment", "get_payment_suggestion") else None
+
+            start, error = time.monotonic(), None
+            try:
+                run_operation(operation, loan, pool, options, rng)
+                frappe.db.commit()
+            except Exception as e:
+                frappe.db.rollback()
+                frappe.clear_messages()
+                error = classify_error(e)
+
+            results.append((operation, loan, (time.monotonic() - start) * 1000, error))
+    finally:
+        frappe.destroy()
+        with lock:
+            samples.extend(results)
+
+
+def pick_loan(pool, options, rng):
+    if pool.hot and rng.random() < options.hot_share:
+        return rng.choice(pool.hot)
+    return rng.choice(pool.loans)
+
+
+def run_operation(operation, loan, pool, options, rng):
+    if operation == "create_payment":
+        # A reference per payment keeps repeated amounts on hot loans from reading as duplicates
+        name = create_payment(loan, options.payment_amount,
+                              reference_number=f"{options.tag}-{frappe.generate_hash(length=10)}")
+        frappe.get_doc("Loan Payment", name).submit()
+
+    elif operation == "get_payment_suggestion":
+        get_payment_suggestion(loan)
+
+    elif operation == "get_customer_summary":
+        get_customer_summary(rng.choice(pool.customers))
+
+    elif operation == "create_loan":
+        frappe.get_doc({
+            "doctype": "Loan",
+            "customer": rng.choice(pool.customers),
+            "loan_date": today(),
+            "status": "Active",
+            "loan_type": rng.choice(["Flat Rate", "EMI"]),
+            "loan_amount": rng.choice([10000, 25000, 50000, 100000]),
+            "interest_rate": rng.choice([1.5, 2, 12, 18]),
+            "tenure_months": rng.choice([6, 12, 24]),
+            "notes": options.tag
+        }).insert()
+
+    elif operation == "portfolio_report":
+        portfolio_summary(frappe._dict())
+
+
+def classify_error(e):
+    if isinstance(e, frappe.QueryDeadlockError):
+        return "Deadlock"
+    if isinstance(e, frappe.QueryTimeoutError):
+        return "Lock Timeout"
+    return type(e).__name__
+
+
+def get_lock_status():
+    rows = frappe.db.sql("SHOW GLOBAL STATUS WHERE Variable_name IN %s", (LOCK_STATUS_VARIABLES,))
+    status = {variable: 0 for variable in LOCK_STATUS_VARIABLES}
+    status.update({variable: cint(value) for variable, value in rows})
+    return status
+
+
+def percentile(sorted_values, share):
+    if not sorted_values:
+        return None
+    return round(sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))], 1)
+
+
+def get_latency_stats(latencies):
+    latencies = sorted(latencies)
+    return {
+        "p50_ms": percentile(latencies, 0.5),
+        "p95_ms": percentile(latencies, 0.95),
+        "p99_ms": percentile(latencies, 0.99),
+        "max_ms": round(latencies[-1], 1) if latencies else None
+    }
+
+
+def summarize_stage(workers, elapsed, samples, lock_status):
+    operations = {}
+    for operation in OPERATION_MIX:
+        rows = [row for row in samples if row[0] == operation]
+        errors = {}
+        for row in rows:
+            if row[3]:
+                errors[row[3]] = errors.get(row[3], 0) + 1
+
+        operations[operation] = dict(
+            count=len(rows),
+            per_second=round(len(rows) / elapsed, 2) if elapsed else None,
+            error_rate=round(sum(errors.values()) / len(rows), 4) if rows else 0,
+            errors=errors,
+            **get_latency_stats([row[2] for row in rows if not row[3]])
+        )
+
+    # Payment latency per loan shows how long postings queue behind each other on the row lock
+    by_loan = {}
+    for operation, loan, latency, error in samples:
+        if operation == "create_payment":
+            by_loan.setdefault(loan, []).append((latency, error))
+
+    hot_loans = []
+    for loan, rows in by_loan.items():
+        hot_loans.append(dict(
+            loan=loan,
+            payments=len(rows),
+            lock_errors=len([row for row in rows if row[1] in ("Deadlock", "Lock Timeout")]),
+            **get_latency_stats([row[0] for row in rows if not row[1]])
+        ))
+    hot_loans.sort(key=lambda row: (row["lock_errors"], row["p95_ms"] or 0), reverse=True)
+
+    failed = len([row for row in samples if row[3]])
+    return {
+        "concurrency": workers,
+        "elapsed": round(elapsed, 2),
+        "total": len(samples),
+        "per_second": round(len(samples) / elapsed, 2) if elapsed else None,
+        "error_rate": round(failed / len(samples), 4) if samples else 0,
+        "operations": operations,
+        "row_lock_waits": lock_status["Innodb_row_lock_waits"],
+        "row_lock_wait_ms": lock_status["Innodb_row_lock_time"],
+        "deadlocks": lock_status["Innodb_deadlocks"],
+        "hot_loans": hot_loans[:10]
+    }
+
+
+def save_report(report):
+    """Keep the report as JSON under the site's private folder"""
+    folder = frappe.get_site_path("private", "load_tests")
+    os.makedirs(folder, exist_ok=True)
+
+    path = os.path.join(folder, f"{report['tag']}.json")
+    with open(path, "w") as f:
+        json.dump(report, f, indent=1, default=str)
+
+    return path
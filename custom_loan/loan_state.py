@@ -0,0 +1,182 @@
+"""
+Compact per-loan state cached in Redis for the counter screen
+"""
+
+import frappe
+import redis
+from frappe.utils import flt, getdate, today
+from custom_loan.utils import get_penalty_due
+
+LOAN_STATE_KEY = "custom_loan:loan_state"
+METRICS_KEY = "custom_loan:loan_state_metrics"
+
+# Hit/miss counts are kept per worker and pushed to Redis in batches,
+# so a cache hit stays a single round trip
+METRICS_FLUSH_EVERY = 100
+_lookups = {"hits": 0, "misses": 0}
+
+
+def get_loan_state(loan):
+    """
+    Get the cached state of a loan, building it on a miss
+
+    Returns:
+        dict: outstanding_amount, status, next_due, overdue_amount, penalty_due,
+              last_payment and the date the state was computed for
+    """
+    state = frappe.cache().hget(LOAN_STATE_KEY, loan)
+
+    # Overdue figures depend on the date, so yesterday's state counts as a miss
+    if state and state["as_of"] == today():
+        record_lookup("hits")
+        return state
+
+    record_lookup("misses")
+    state = build_loan_states([loan]).get(loan)
+    if state:
+        frappe.cache().hset(LOAN_STATE_KEY, loan, state)
+
+    return state
+
+
+def build_loan_states(loans):
+    """
+    Build state for many loans with three set-based queries
+
+    Args:
+        loans (list): Loan names
+
+    Returns:
+        dict: loan -> state
+    """
+    if not loans:
+        return {}
+
+    as_of = today()
+    params = {"loans": tuple(loans), "date": getdate(as_of)}
+
+    states = {}
+    for loan in frappe.db.sql("""
+        SELECT name, customer, status, total_amount, paid_amount, outstanding_amount
+        FROM `tabLoan`
+        WHERE name IN %(loans)s
+    """, params, as_dict=True):
+        states[loan.name] = frappe._dict(
+            loan=loan.name,
+            customer=loan.customer,
+            status=loan.status,
+            total_amount=flt(loan.total_amount),
+            paid_amount=flt(loan.paid_amount),
+            outstanding_amount=flt(loan.outstanding_amount),
+            next_due=None,
+            overdue_amount=0,
+            penalty_due=0,
+            last_payment=None,
+            as_of=as_of
+        )
+
+    for schedule in frappe.db.sql("""
+        SELECT parent, installment_number, due_date,
+            installment_amount - IFNULL(paid_amount, 0) as amount_due
+        FROM `tabLoan Repayment Schedule`
+        WHERE parent IN %(loans)s AND parenttype = 'Loan' AND status IN ('Pending', 'Partial')
+        ORDER BY parent, idx
+    """, params, as_dict=True):
+        state = states.get(schedule.parent)
+        if not state:
+            continue
+
+        if not state.next_due:
+            state.next_due = {
+                "installment_number": schedule.installment_number,
+                "due_date": schedule.due_date,
+                "amount_due": flt(schedule.amount_due)
+            }
+
+        if schedule.due_date < params["date"]:
+            state.overdue_amount += flt(schedule.amount_due)
+
+    for payment in frappe.db.sql("""
+        SELECT p.loan, p.name, p.amount, p.payment_date
+        FROM `tabLoan Payment` p
+        INNER JOIN `tabLoan` l ON l.name = p.loan AND l.last_payment_date = p.payment_date
+        WHERE p.loan IN %(loans)s AND p.docstatus = 1
+        ORDER BY p.creation DESC
+    """, params, as_dict=True):
+        state = states.get(payment.loan)
+        if state and not state.last_payment:
+            state.last_payment = {"payment": payment.name, "amount": flt(payment.amount),
+                                  "payment_date": payment.payment_date}
+
+    for state in states.values():
+        # Same charge that payment allocation applies at the counter
+        state.penalty_due = get_penalty_due(state.overdue_amount)
+
+    return states
+
+
+def invalidate_loan_state(doc, method=None):
+    """Drop the cached state of the loan a Loan or Loan Payment belongs to"""
+    loan = doc.name if doc.doctype == "Loan" else doc.get("loan")
+    if not loan:
+        return
+
+    frappe.cache().hdel(LOAN_STATE_KEY, loan)
+    # A reader could rebuild from pre-commit data in between, so drop it again once committed
+    frappe.db.after_commit.add(lambda: frappe.cache().hdel(LOAN_STATE_KEY, loan))
+
+
+def warm_loan_state_cache(chunk_size=1000):
+    """Rebuild cached state for all open loans; run daily by the scheduler"""
+    loans = frappe.get_all("Loan", filters={"status": ["in", ["Active", "Overdue"]]}, pluck="name")
+
+    for i in range(0, len(loans), chunk_size):
+        for loan, state in build_loan_states(loans[i:i + chunk_size]).items():
+            frappe.cache().hset(LOAN_STATE_KEY, loan, state)
+
+    return {"warmed": len(loans)}
+
+
+def record_lookup(result):
+    _lookups[result] += 1
+
+    if _lookups["hits"] + _lookups["misses"] >= METRICS_FLUSH_EVERY:
+        flush_lookup_metrics()
+
+
+def flush_lookup_metrics():
+    """Push this worker's hit/miss counts to Redis"""
+    cache = frappe.cache()
+    for result in ("hits", "misses"):
+        if _lookups[result]:
+            cache.hincrby(cache.make_key(METRICS_KEY), result, _lookups[result])
+            _lookups[result] = 0
+
+
+@frappe.whitelist()
+def get_counter_state(loan):
+    """Cached loan state for the counter screen"""
+    # The cache is shared across users, so check the loan itself before reading it
+    frappe.has_permission("Loan", doc=loan, throw=True)
+
+    return get_loan_state(loan)
+
+
+@frappe.whitelist()
+def get_loan_state_metrics():
+    """Cache hit rate across all workers"""
+    flush_lookup_metrics()
+
+    cache = frappe.cache()
+    # The counters are plain integers under a key prefixed once; RedisWrapper.hgetall would prefix it
+    # again and unpickle the values
+    counts = redis.Redis.hgetall(cache, cache.make_key(METRICS_KEY))
+    hits = int(counts.get(b"hits", 0))
+    misses = int(counts.get(b"misses", 0))
+
+    return {
+        "hits": hits,
+        "misses": misses,
+        "hit_rate": round(hits * 100.0 / (hits + misses), 2) if hits + misses else None,
+        "cached_loans": cache.hlen(cache.make_key(LOAN_STATE_KEY))
+    }
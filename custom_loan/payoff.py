@@ -0,0 +1,187 @@
+"""
+Early payoff quotes: what it takes to close a loan on a given date
+
+A quote is worked out from the unpaid tail of the repayment schedule:
+principal still owed, interest earned up to the date but not yet paid,
+the penalty the counter would charge on overdue installments and the
+foreclosure charge from Loan Settings when the loan closes ahead of its
+last due date.
+"""
+
+import json
+
+import frappe
+from frappe.utils import flt, getdate, today
+from custom_loan.interest_accrual import get_accrual_window, get_earned_interest
+from custom_loan.utils import get_penalty_due
+
+PAYOFF_KEY = "custom_loan:payoff"
+
+
+def compute_payoff_quotes(loans, as_of_date):
+    """
+    Payoff figures for many loans with one query over their schedule tails
+
+    Args:
+        loans (list): Loan names
+        as_of_date (date): Date the loan would be closed on
+
+    Returns:
+        dict: loan -> quote
+    """
+    if not loans:
+        return {}
+
+    foreclosure_percent = flt(frappe.db.get_single_value("Loan Settings", "foreclosure_charge_percent", cache=True))
+
+    quotes = {}
+    for row in frappe.db.sql("""
+        SELECT l.name as loan, l.customer, l.loan_date, l.outstanding_amount,
+            s.installment_number, s.due_date, s.installment_amount,
+            s.principal_amount, s.interest_amount, IFNULL(s.paid_amount, 0) as paid_amount
+        FROM `tabLoan` l
+        INNER JOIN `tabLoan Repayment Schedule` s ON s.parent = l.name AND s.parenttype = 'Loan'
+        WHERE l.name IN %(loans)s AND l.status IN ('Active', 'Overdue')
+        AND s.status != 'Paid'
+        ORDER BY l.name, s.idx
+    """, {"loans": tuple(loans)}, as_dict=True):
+        quote = quotes.get(row.loan)
+        if not quote:
+            quote = quotes[row.loan] = frappe._dict(
+                loan=row.loan,
+                customer=row.customer,
+                as_of_date=str(as_of_date),
+                outstanding_amount=flt(row.outstanding_amount),
+                principal_outstanding=0,
+                accrued_interest=0,
+                overdue_amount=0,
+                penalty=0,
+                foreclosure_charge=0,
+                last_due_date=None
+            )
+
+        # Payments go to interest first, as when allocating at the counter
+        interest_paid = min(flt(row.paid_amount), flt(row.interest_amount))
+        principal_paid = flt(row.paid_amount) - interest_paid
+        quote.principal_outstanding += max(0, flt(row.principal_amount) - principal_paid)
+
+        start, window = get_accrual_window(row.loan_date, row.installment_number, row.due_date)
+        earned = get_earned_interest(row.interest_amount, start, window, as_of_date)
+        quote.accrued_interest += max(0, earned - interest_paid)
+
+        if row.due_date < as_of_date:
+            quote.overdue_amount += flt(row.installment_amount) - flt(row.paid_amount)
+
+        quote.last_due_date = row.due_date
+
+    for quote in quotes.values():
+        if as_of_date < quote.last_due_date:
+            quote.foreclosure_charge = quote.principal_outstanding * foreclosure_percent / 100
+
+        # Same charge that payment allocation applies at the counter
+        quote.penalty = get_penalty_due(quote.overdue_amount)
+        quote.last_due_date = str(quote.last_due_date)
+
+        for field in ("principal_outstanding", "accrued_interest", "overdue_amount", "penalty", "foreclosure_charge"):
+            quote[field] = flt(quote[field], 2)
+
+        quote.payoff_amount = flt(quote.principal_outstanding + quote.accrued_interest
+                                  + quote.penalty + quote.foreclosure_charge, 2)
+
+    return quotes
+
+
+def get_cached_quotes(loans, as_of):
+    """Cached quotes for the given date; loans not cached for it are left out"""
+    cache = frappe.cache()
+    cached = {}
+
+    for loan in loans:
+        quote = (cache.hget(PAYOFF_KEY, loan) or {}).get(as_of)
+        if quote:
+            cached[loan] = quote
+
+    return cached
+
+
+def cache_quotes(quotes, as_of):
+    cache = frappe.cache()
+
+    for loan, quote in quotes.items():
+        by_date = cache.hget(PAYOFF_KEY, loan) or {}
+        # Quotes for past days are never asked for again
+        by_date = {date: q for date, q in by_date.items() if date >= today()}
+        by_date[as_of] = quote
+        cache.hset(PAYOFF_KEY, loan, by_date)
+
+
+def get_payoff_quotes(loans, as_of_date=None):
+    """Quotes for many loans, computing only those not cached for the date"""
+    as_of_date = getdate(as_of_date or today())
+    as_of = str(as_of_date)
+
+    quotes = get_cached_quotes(loans, as_of)
+    missing = [loan for loan in loans if loan not in quotes]
+
+    computed = compute_payoff_quotes(missing, as_of_date)
+    cache_quotes(computed, as_of)
+    quotes.update(computed)
+
+    return quotes
+
+
+def invalidate_payoff_quotes(doc, method=None):
+    """Drop cached quotes of the loan a Loan or Loan Payment belongs to"""
+    loan = doc.name if doc.doctype == "Loan" else doc.get("loan")
+    if not loan:
+        return
+
+    frappe.cache().hdel(PAYOFF_KEY, loan)
+    frappe.db.after_commit.add(lambda: frappe.cache().hdel(PAYOFF_KEY, loan))
+
+
+@frappe.whitelist()
+def get_payoff_quote(loan, as_of_date=None):
+    """How much it takes to close a loan on a date, today by default"""
+    frappe.has_permission("Loan", "read", loan, throw=True)
+
+    as_of_date = getdate(as_of_date or today())
+    if as_of_date < getdate(today()):
+        frappe.throw("Payoff quotes cannot be given for a past date")
+
+    quote = get_payoff_quotes([loan], as_of_date).get(loan)
+    if not quote:
+        frappe.throw(f"Loan {loan} has no open installments to pay off")
+
+    return quote
+
+
+@frappe.whitelist()
+def get_customer_payoff_quotes(customers, as_of_date=None):
+    """
+    Payoff quotes for every open loan of a list of customers
+
+    Args:
+        customers (list or str): Loan Customer names, or a JSON list of them
+        as_of_date (str): Closing date, today by default
+
+    Returns:
+        dict: customer -> {loans, payoff_amount}
+    """
+    frappe.has_permission("Loan", "read", throw=True)
+
+    if isinstance(customers, str):
+        customers = json.loads(customers)
+
+    # get_list, so a branch manager only gets quotes for loans of their own branches
+    loans = frappe.get_list("Loan",
+                            filters={"customer": ["in", customers], "status": ["in", ["Active", "Overdue"]]},
+                            pluck="name")
+
+    result = {customer: {"loans": [], "payoff_amount": 0} for customer in customers}
+    for quote in get_payoff_quotes(loans, as_of_date).values():
+        result[quote["customer"]]["loans"].append(quote)
+        result[quote["customer"]]["payoff_amount"] = flt(
+            result[quote["customer"]]["payoff_amount"] + quote["payoff_amount"], 2)
+
+    return result
@@ -0,0 +1,70 @@
+"""
+Branch-level access to loans, customers, applications and payments
+
+Branch managers are restricted with User Permissions on Loan Branch. Users
+without any such restriction, and System Managers, see every branch. The
+conditions below lead with the branch column so list views and reports use
+the branch-leading indexes instead of scanning the whole book.
+"""
+
+import frappe
+
+
+def get_user_branches(user=None):
+    """
+    Branches a user is restricted to
+
+    Returns:
+        list: Loan Branch names, or None when the user may see every branch
+    """
+    user = user or frappe.session.user
+    if user == "Administrator" or "System Manager" in frappe.get_roles(user):
+        return None
+
+    permissions = frappe.permissions.get_user_permissions(user).get("Loan Branch") or []
+    return [permission.get("doc") for permission in permissions] or None
+
+
+def get_branch_query_condition(doctype, user=None):
+    branches = get_user_branches(user)
+    if not branches:
+        return ""
+
+    return f"`tab{doctype}`.`branch` IN ({', '.join(frappe.db.escape(branch) for branch in branches)})"
+
+
+def get_branch_conditions(filters, column="branch"):
+    """
+    SQL conditions limiting a report or API to a branch
+
+    Adds the selected branch and, for branch-restricted users, their own
+    branches. The parameters are set on filters, which must be passed to
+    the query.
+    """
+    conditions = ""
+
+    if filters.get("branch"):
+        conditions += f" AND {column} = %(branch)s"
+
+    branches = get_user_branches()
+    if branches:
+        filters["user_branches"] = tuple(branches)
+        conditions += f" AND {column} IN %(user_branches)s"
+
+    return conditions
+
+
+def loan_query(user=None):
+    return get_branch_query_condition("Loan", user)
+
+
+def loan_customer_query(user=None):
+    return get_branch_query_condition("Loan Customer", user)
+
+
+def loan_application_query(user=None):
+    return get_branch_query_condition("Loan Application", user)
+
+
+def loan_payment_query(user=None):
+    return get_branch_query_condition("Loan Payment", user)
@@ -0,0 +1,154 @@
+"""
+Opt-in, sampled profiling of Custom Loan document events and API methods
+
+Methods wrapped with profiled are run under cProfile for a sample of
+requests, or for every request of the users listed in Loan Settings. Each
+capture is written as a pstats file to a bounded folder under the site's
+private files; the Loan Profiling Hotspots report aggregates them, and a
+single capture can be downloaded for snakeviz or a flamegraph tool.
+
+When profiling is switched off the only cost is one cached settings read per
+request; the decision is kept in frappe.flags for the rest of the request.
+"""
+
+import cProfile
+import os
+import random
+import re
+import time
+from datetime import datetime
+from functools import wraps
+
+import frappe
+from frappe.utils import cint, flt, now_datetime
+
+PROFILE_FOLDER = "loan_profiles"
+PROFILE_SUFFIX = ".prof"
+
+
+def get_profile_folder():
+    return frappe.get_site_path("private", PROFILE_FOLDER)
+
+
+def should_profile():
+    """Whether this request is sampled; decided once per request"""
+    if frappe.flags.custom_loan_profiling is None:
+        frappe.flags.custom_loan_profiling = is_sampled()
+    return frappe.flags.custom_loan_profiling
+
+
+def is_sampled():
+    if not frappe.db.get_single_value("Loan Settings", "enable_profiling", cache=True):
+        return False
+
+    settings = frappe.get_cached_doc("Loan Settings")
+    if frappe.session.user in (settings.profiling_users or "").split():
+        return True
+
+    return random.random() * 100 < flt(settings.profiling_sample_percent)
+
+
+def profiled(fn):
+    """Profile a document event or whitelisted method on sampled requests"""
+    target = f"{fn.__module__}.{fn.__qualname__}"
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        # A nested call is already inside the outer capture
+        if frappe.flags.custom_loan_profiler or not should_profile():
+            return fn(*args, **kwargs)
+
+        profiler = frappe.flags.custom_loan_profiler = cProfile.Profile()
+        start = time.monotonic()
+        try:
+            return profiler.runcall(fn, *args, **kwargs)
+        finally:
+            frappe.flags.custom_loan_profiler = None
+            save_profile(profiler, target, (time.monotonic() - start) * 1000)
+
+    return wrapper
+
+
+def save_profile(profiler, target, duration_ms):
+    """Write a capture and drop the oldest ones beyond the configured limit"""
+    try:
+        folder = get_profile_folder()
+        os.makedirs(folder, exist_ok=True)
+        profiler.dump_stats(os.path.join(folder, make_profile_name(target, duration_ms)))
+
+        keep = cint(frappe.get_cached_doc("Loan Settings").profiling_max_files) or 500
+        for name in list_profiles()[keep:]:
+            os.remove(os.path.join(folder, name))
+    except Exception:
+        # Profiling must never break the request it is watching
+        frappe.log_error("Could not save profile", "Loan Profiling")
+
+
+def make_profile_name(target, duration_ms):
+    return f"{now_datetime():%Y%m%d%H%M%S%f}_{target}_{round(duration_ms)}{PROFILE_SUFFIX}"
+
+
+def parse_profile_name(name):
+    """Capture time, target and duration encoded in a profile file name"""
+    match = re.match(r"^(\d{20})_([\w.]+)_(\d+)" + re.escape(PROFILE_SUFFIX) + "$", name)
+    if not match:
+        return None
+
+    return frappe._dict(
+        name=name,
+        captured_at=datetime.strptime(match[1], "%Y%m%d%H%M%S%f"),
+        target=match[2],
+        duration_ms=cint(match[3])
+    )
+
+
+def list_profiles():
+    """Profile file names, newest first"""
+    folder = get_profile_folder()
+    if not os.path.isdir(folder):
+        return []
+
+    return sorted((name for name in os.listdir(folder) if name.endswith(PROFILE_SUFFIX)), reverse=True)
+
+
+@frappe.whitelist()
+def get_profiles(target=None, limit=100):
+    """Recent captures, optionally for targets containing a string"""
+    frappe.only_for("System Manager")
+
+    profiles = []
+    for name in list_profiles():
+        profile = parse_profile_name(name)
+        if profile and (not target or target in profile.target):
+            profiles.append(profile)
+            if len(profiles) >= cint(limit):
+                break
+
+    return profiles
+
+
+@frappe.whitelist()
+def download_profile(name):
+    """Send one capture as a pstats file"""
+    frappe.only_for("System Manager")
+
+    if not parse_profile_name(name):
+        frappe.throw("Invalid profile name")
+
+    path = os.path.join(get_profile_folder(), name)
+    if not os.path.exists(path):
+        frappe.throw(f"Profile {name} not found")
+
+    with open(path, "rb") as f:
+        frappe.local.response.filename = name
+        frappe.local.response.filecontent = f.read()
+        frappe.local.response.type = "download"
+
+
+@frappe.whitelist()
+def clear_profiles():
+    frappe.only_for("System Manager")
+
+    folder = get_profile_folder()
+    for name in list_profiles():
+        os.remove(os.path.join(folder, name))
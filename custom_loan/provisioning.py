@@ -0,0 +1,133 @@
+"""
+Month-end loan loss provisioning over the whole book
+"""
+
+import time
+
+import frappe
+from frappe.utils import add_days, flt, get_first_day, getdate, now_datetime, today
+from custom_loan.utils import get_dpd_bucket, get_loan_delinquency_sql
+
+PROVISION_ENTRY_FIELDS = [
+    "name", "creation", "modified", "owner", "modified_by",
+    "provisioning_date", "run_id", "superseded_by", "loan", "loan_type", "dpd", "dpd_bucket",
+    "outstanding_principal", "provision_percent", "provision_amount",
+    "previous_provision", "provision_change", "write_off_candidate"
+]
+
+
+def get_provisioning_rules():
+    """
+    Provisioning rules keyed by (DPD bucket, loan type)
+
+    A rule with a blank loan type is stored under (bucket, "") and applies to
+    every loan type that has no rule of its own.
+    """
+    return {
+        (rule.dpd_bucket, rule.loan_type or ""): rule
+        for rule in frappe.get_all("Loan Provisioning Rule",
+                                   fields=["dpd_bucket", "loan_type", "provision_percent", "write_off_candidate"])
+    }
+
+
+def get_previous_provisions(as_of_date):
+    """Provision and loan type per loan from the live run of the latest date before as_of_date"""
+    return {
+        row.loan: row
+        for row in frappe.db.sql("""
+            SELECT loan, loan_type, provision_amount
+            FROM `tabLoan Provision Entry`
+            WHERE IFNULL(superseded_by, '') = ''
+            AND provisioning_date = (
+                SELECT MAX(provisioning_date) FROM `tabLoan Provision Entry`
+                WHERE provisioning_date < %(date)s AND IFNULL(superseded_by, '') = ''
+            )
+        """, {"date": as_of_date}, as_dict=True)
+    }
+
+
+def run_provisioning(as_of_date=None):
+    """
+    Compute provisions for every open loan and write them to the ledger
+
+    The book is pulled once as columns (loan, type, DPD, principal), each
+    derived column is computed in a single pass over the previous ones, and
+    the ledger rows go in with one bulk insert. Every row carries the run id
+    and the rate that was applied.
+
+    Loans provided for in the previous run that are no longer open get a
+    row releasing their provision. Re-running a date keeps the earlier run's
+    rows for audit, marked superseded_by the new run id.
+    """
+    start = time.monotonic()
+    as_of_date = getdate(as_of_date or add_days(get_first_day(today()), -1))
+    run_id = f"PROV-{as_of_date}-{frappe.generate_hash(length=6)}"
+
+    extract = frappe.db.sql(get_loan_delinquency_sql(), {"date": as_of_date}, as_dict=True)
+
+    loans = [row.loan for row in extract]
+    loan_types = [row.loan_type for row in extract]
+    dpds = [int(row.dpd or 0) for row in extract]
+    principals = [flt(row.outstanding_principal) for row in extract]
+
+    rules = get_provisioning_rules()
+    no_rule = frappe._dict(provision_percent=0, write_off_candidate=0)
+    buckets = [get_dpd_bucket(dpd) for dpd in dpds]
+    applied = [
+        rules.get((bucket, loan_type)) or rules.get((bucket, "")) or no_rule
+        for bucket, loan_type in zip(buckets, loan_types)
+    ]
+    percents = [flt(rule.provision_percent) for rule in applied]
+    amounts = [flt(principal * percent / 100, 2) for principal, percent in zip(principals, percents)]
+
+    previous = get_previous_provisions(as_of_date)
+    previous_amounts = [flt(previous[loan].provision_amount) if loan in previous else 0 for loan in loans]
+
+    now, user = now_datetime(), frappe.session.user
+    values = [
+        (frappe.generate_hash(length=10), now, now, user, user,
+         as_of_date, run_id, None, loan, loan_type, dpd, bucket,
+         principal, percent, amount, previous_amount, flt(amount - previous_amount, 2), rule.write_off_candidate)
+        for loan, loan_type, dpd, bucket, principal, percent, amount, previous_amount, rule
+        in zip(loans, loan_types, dpds, buckets, principals, percents, amounts, previous_amounts, applied)
+    ]
+
+    # Loans closed since the last run release their whole provision; their status stands in for the bucket
+    open_loans = set(loans)
+    released = [row for loan, row in previous.items() if loan not in open_loans and flt(row.provision_amount)]
+    statuses = dict(frappe.get_all("Loan", filters={"name": ["in", [row.loan for row in released]]},
+                                   fields=["name", "status"], as_list=True)) if released else {}
+    values += [
+        (frappe.generate_hash(length=10), now, now, user, user,
+         as_of_date, run_id, None, row.loan, row.loan_type, 0, statuses.get(row.loan) or "Closed",
+         0, 0, 0, flt(row.provision_amount), -flt(row.provision_amount), 0)
+        for row in released
+    ]
+
+    frappe.db.sql("""
+        UPDATE `tabLoan Provision Entry`
+        SET superseded_by = %(run_id)s
+        WHERE provisioning_date = %(date)s AND IFNULL(superseded_by, '') = ''
+    """, {"run_id": run_id, "date": as_of_date})
+    frappe.db.bulk_insert("Loan Provision Entry", fields=PROVISION_ENTRY_FIELDS, values=values)
+
+    return {
+        "run_id": run_id,
+        "provisioning_date": str(as_of_date),
+        "loans": len(loans),
+        "released": len(released),
+        "total_provision": flt(sum(amounts), 2),
+        "provision_change": flt(sum(amounts) - sum(flt(row.provision_amount) for row in previous.values()), 2),
+        "write_off_candidates": len([rule for rule in applied if rule.write_off_candidate]),
+        "elapsed": round(time.monotonic() - start, 2)
+    }
+
+
+@frappe.whitelist()
+def run_month_end_provisioning(as_of_date=None):
+    """Queue a provisioning run, by default for the last day of the previous month"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    frappe.enqueue("custom_loan.provisioning.run_provisioning", queue="long", timeout=3600, as_of_date=as_of_date)
+
+    return {"queued": True}
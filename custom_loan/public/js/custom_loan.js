@@ -10,40 +10,199 @@ frappe.ready(function() {
     }
 });
 
-// Loan calculation utilities
-window.loan_calculator = {
-    calculate_flat_interest: function(principal, rate, tenure) {
-        const total_interest = principal * (rate / 100) * tenure;
-        const total_amount = principal + total_interest;
-        const monthly_payment = total_amount / tenure;
-        
-        return {
-            principal: principal,
-            total_interest: total_interest,
-            total_amount: total_amount,
-            monthly_payment: monthly_payment
-        };
-    },
-    
-    calculate_emi: function(principal, rate, tenure) {
-        const monthly_rate = rate / 100;
-        let emi;
-        
-        if (monthly_rate === 0) {
-            emi = principal / tenure;
-        } else {
-            emi = (principal * monthly_rate * Math.pow(1 + monthly_rate, tenure)) / 
-                  (Math.pow(1 + monthly_rate, tenure) - 1);
-        }
-        
-        const total_amount = emi * tenure;
-        const total_interest = total_amount - principal;
-        
+// Instant calculator preview on the Loan and Loan Application forms
+//
+// Figures are worked out in the browser with loan_calculator.js; updates are
+// debounced so typing an amount does not recalculate on every keystroke.
+(function() {
+    const PREVIEW_DELAY = 300;
+
+    const render_schedule_preview = function(frm, result, title) {
+        if (frm.schedule_preview) {
+            frm.schedule_preview.remove();
+        }
+
+        const rows = result.schedule.map(row => `
+            <tr>
+                <td>${row.installment_number}</td>
+                <td>${frappe.datetime.str_to_user(row.due_date)}</td>
+                <td class="text-right">${format_currency(row.installment_amount)}</td>
+                <td class="text-right">${format_currency(row.principal_amount)}</td>
+                <td class="text-right">${format_currency(row.interest_amount)}</td>
+                <td class="text-right">${format_currency(row.remaining_balance)}</td>
+            </tr>`).join("");
+
+        frm.schedule_preview = frm.dashboard.add_section(`
+            <table class="table table-bordered table-condensed small">
+                <thead><tr>
+                    <th>#</th><th>${__("Due Date")}</th><th>${__("Installment")}</th>
+                    <th>${__("Principal")}</th><th>${__("Interest")}</th><th>${__("Balance")}</th>
+                </tr></thead>
+                <tbody>${rows}</tbody>
+            </table>`, title || __("Schedule Preview"));
+    };
+
+    const get_preview = function(terms) {
+        if (!terms.loan_type || !(terms.principal > 0) || !(terms.tenure_months > 0)) {
+            return null;
+        }
+
+        return window.loan_calculator.quote(terms);
+    };
+
+    const preview_loan = frappe.utils.debounce(function(frm) {
+        const result = get_preview({
+            loan_type: frm.doc.loan_type,
+            principal: frm.doc.loan_amount,
+            interest_rate: frm.doc.interest_rate,
+            tenure_months: frm.doc.tenure_months,
+            payment_frequency: frm.doc.payment_frequency,
+            start_date: frm.doc.loan_date || frappe.datetime.get_today()
+        });
+        if (!result) {
+            return;
+        }
+
+        frm.set_value({
+            total_interest: result.total_interest,
+            total_amount: result.total_amount,
+            emi_amount: result.emi_amount
+        });
+
+        // A saved schedule is already on the form; only preview one that does not exist yet
+        if (!(frm.doc.repayment_schedule || []).length) {
+            render_schedule_preview(frm, result);
+        }
+    }, PREVIEW_DELAY);
+
+    const preview_application = frappe.utils.debounce(function(frm) {
+        const result = get_preview({
+            loan_type: frm.doc.loan_type,
+            principal: frm.doc.approved_amount || frm.doc.requested_amount,
+            interest_rate: frm.doc.approved_rate || frm.doc.interest_rate,
+            tenure_months: frm.doc.tenure_months,
+            start_date: frappe.datetime.get_today()
+        });
+        if (!result) {
+            return;
+        }
+
+        frm.dashboard.set_headline(__("Installment {0}, total payable {1}",
+            [format_currency(result.emi_amount), format_currency(result.total_amount)]));
+        render_schedule_preview(frm, result);
+    }, PREVIEW_DELAY);
+
+    const LOAN_PREVIEW_FIELDS = ["loan_type", "loan_amount", "interest_rate", "tenure_months", "payment_frequency", "loan_date"];
+    const APPLICATION_PREVIEW_FIELDS = ["loan_type", "requested_amount", "interest_rate", "approved_amount",
+                                        "approved_rate", "tenure_months"];
+
+    const preview_handlers = function(fields, preview) {
+        const handlers = {};
+        fields.forEach(fieldname => {
+            handlers[fieldname] = preview;
+        });
+        return handlers;
+    };
+
+    frappe.ui.form.on("Loan", preview_handlers(LOAN_PREVIEW_FIELDS, preview_loan));
+
+    // Schedules of closed loans are archived; show one on request, or bring it back to the form
+    frappe.ui.form.on("Loan", {
+        refresh(frm) {
+            if (!(frm.doc.__onload && frm.doc.__onload.has_archived_schedule)) {
+                return;
+            }
+
+            frm.add_custom_button(__("View Archived Schedule"), () => {
+                frappe.call({
+                    method: "custom_loan.schedule_archive.get_archived_schedule",
+                    args: {loan: frm.doc.name}
+                }).then(r => {
+                    render_schedule_preview(frm, {schedule: r.message}, __("Archived Schedule"));
+                });
+            }, __("Schedule"));
+
+            if (frm.perm[0] && frm.perm[0].write) {
+                frm.add_custom_button(__("Restore Schedule"), () => {
+                    frappe.call({
+                        method: "custom_loan.schedule_archive.restore_archived_schedule",
+                        args: {loan: frm.doc.name},
+                        freeze: true
+                    }).then(() => frm.reload_doc());
+                }, __("Schedule"));
+            }
+        }
+    });
+    frappe.ui.form.on("Loan Application", preview_handlers(APPLICATION_PREVIEW_FIELDS, preview_application));
+})();
+
+// Rate revision preview on the Interest Setting form
+//
+// Edit the default rate or slabs without saving, then preview what the change
+// does to pending applications and the unpaid tails of active loans.
+(function() {
+    const get_proposal = function(frm) {
         return {
-            principal: principal,
-            emi: emi,
-            total_amount: total_amount,
-            total_interest: total_interest
+            default_rate: frm.doc.default_rate,
+            amount_slabs: (frm.doc.amount_slabs || []).map(slab => ({
+                min_amount: slab.min_amount,
+                max_amount: slab.max_amount,
+                interest_rate: slab.interest_rate
+            }))
         };
-    }
-};
+    };
+
+    const summary_rows = function(label, summary) {
+        if (!summary) {
+            return "";
+        }
+        return `<tr><th colspan="2">${label}</th></tr>
+            <tr><td>${__("Affected")}</td><td>${summary.count} (${summary.customers} ${__("customers")})</td></tr>
+            <tr><td>${__("Interest income")}</td><td>${format_currency(summary.interest_before)} &rarr;
+                ${format_currency(summary.interest_after)} (${format_currency(summary.interest_change)})</td></tr>
+            <tr><td>${__("Installments up / down")}</td><td>${summary.emi_increased} / ${summary.emi_decreased}</td></tr>
+            <tr><td>${__("Average installment change")}</td><td>${format_currency(summary.average_emi_change)}</td></tr>`;
+    };
+
+    frappe.ui.form.on("Interest Setting", {
+        refresh(frm) {
+            if (frm.is_new()) {
+                return;
+            }
+
+            frm.add_custom_button(__("Preview Rate Revision"), () => {
+                frappe.call({
+                    method: "custom_loan.rate_revision.preview_rate_revision",
+                    args: {setting: frm.doc.name, proposal: get_proposal(frm), include_loans: 1},
+                    freeze: true
+                }).then(r => {
+                    const result = r.message;
+                    frappe.msgprint({
+                        title: __("Rate Revision Impact"),
+                        message: `<table class="table table-bordered">
+                            ${summary_rows(__("Pending Applications"), result.applications)}
+                            ${summary_rows(__("Active Loans"), result.loans)}
+                            </table>
+                            <p>${__("{0} customers affected", [result.affected_customers])}</p>`
+                    });
+                });
+            }, __("Rate Revision"));
+
+            frm.add_custom_button(__("Apply to Applications and Loans"), () => {
+                frappe.confirm(__("Save this setting and re-price pending applications and unpaid installments of active loans?"), () => {
+                    frappe.call({
+                        method: "custom_loan.rate_revision.apply_rate_revision",
+                        args: {setting: frm.doc.name, proposal: get_proposal(frm), include_loans: 1}
+                    }).then(() => {
+                        frappe.show_alert(__("Rate revision queued"));
+                    });
+                });
+            }, __("Rate Revision"));
+        }
+    });
+
+    frappe.realtime.on("custom_loan_rate_revision", result => {
+        frappe.msgprint(__("Rate revision of {0} applied to {1} applications and {2} loans",
+            [result.setting, result.applications, result.loans]));
+    });
+})();
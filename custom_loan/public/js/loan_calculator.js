@@ -0,0 +1,142 @@
+// NAYAG EDGE - Custom Loan Management
+// Loan calculator shared with the server
+//
+// Mirrors calculate_loan_totals and build_repayment_schedule in
+// custom_loan/utils.py. The rules (rate divisor, EMI rate periods, default
+// payment frequency) come from the server through frappe.boot, so the two
+// implementations cannot drift on configuration; test_loan.py runs the same
+// cases through both.
+
+(function(root) {
+    const get_spec = function(spec) {
+        return spec || (root.frappe && root.frappe.boot && root.frappe.boot.custom_loan_calculator);
+    };
+
+    const pad = function(value) {
+        return String(value).padStart(2, "0");
+    };
+
+    // Same as frappe.utils.add_months: the day is clamped to the end of a shorter month
+    const add_months = function(date, months) {
+        const [year, month, day] = String(date).slice(0, 10).split("-").map(Number);
+        const target = new Date(Date.UTC(year, month - 1 + months, 1));
+        const last_day = new Date(Date.UTC(target.getUTCFullYear(), target.getUTCMonth() + 1, 0)).getUTCDate();
+
+        return `${target.getUTCFullYear()}-${pad(target.getUTCMonth() + 1)}-${pad(Math.min(day, last_day))}`;
+    };
+
+    // EMI interest rate per installment, as a fraction
+    const get_period_rate = function(interest_rate, payment_frequency, spec) {
+        return (Number(interest_rate) || 0) / spec.rate_divisor / (spec.emi_rate_periods[payment_frequency] || 1);
+    };
+
+    const calculate_loan_totals = function(loan_type, principal, interest_rate, tenure_months, payment_frequency, spec) {
+        spec = get_spec(spec);
+        principal = Number(principal) || 0;
+        const rate = (Number(interest_rate) || 0) / spec.rate_divisor;
+        const tenure = parseInt(tenure_months) || 0;
+        let total_interest, total_amount, emi_amount;
+
+        if (loan_type === "Flat Rate") {
+            total_interest = principal * rate * tenure;
+            total_amount = principal + total_interest;
+            emi_amount = total_amount / tenure;
+        } else if (loan_type === "EMI") {
+            // Reducing balance
+            const period_rate = get_period_rate(interest_rate, payment_frequency, spec);
+
+            if (period_rate === 0) {
+                emi_amount = principal / tenure;
+            } else {
+                emi_amount = (principal * period_rate * Math.pow(1 + period_rate, tenure)) /
+                             (Math.pow(1 + period_rate, tenure) - 1);
+            }
+
+            total_amount = emi_amount * tenure;
+            total_interest = total_amount - principal;
+        } else {
+            throw new Error("Invalid loan type");
+        }
+
+        return {
+            total_interest: total_interest,
+            total_amount: total_amount,
+            emi_amount: emi_amount
+        };
+    };
+
+    const build_repayment_schedule = function(loan_type, principal, interest_rate, tenure_months, start_date,
+                                              total_amount, emi_amount, payment_frequency, spec) {
+        spec = get_spec(spec);
+        principal = Number(principal) || 0;
+        const tenure = parseInt(tenure_months) || 0;
+        const schedule = [];
+        const period_rate = get_period_rate(interest_rate, payment_frequency, spec);
+        let remaining_principal = principal;
+
+        for (let month = 1; month <= tenure; month++) {
+            let installment_amount, principal_amount, interest_amount;
+
+            if (loan_type === "Flat Rate") {
+                installment_amount = (Number(total_amount) || 0) / tenure;
+                principal_amount = principal / tenure;
+                interest_amount = installment_amount - principal_amount;
+            } else {
+                installment_amount = Number(emi_amount) || 0;
+                interest_amount = remaining_principal * period_rate;
+                principal_amount = installment_amount - interest_amount;
+
+                if (principal_amount > remaining_principal) {
+                    principal_amount = remaining_principal;
+                    installment_amount = principal_amount + interest_amount;
+                }
+            }
+
+            remaining_principal -= principal_amount;
+
+            schedule.push({
+                installment_number: month,
+                due_date: add_months(start_date, month),
+                installment_amount: installment_amount,
+                principal_amount: principal_amount,
+                interest_amount: interest_amount,
+                remaining_balance: Math.max(0, remaining_principal)
+            });
+        }
+
+        return schedule;
+    };
+
+    // Totals and schedule of one loan
+    const quote = function(terms, spec) {
+        spec = get_spec(spec);
+        const payment_frequency = terms.payment_frequency || spec.default_payment_frequency;
+        const totals = calculate_loan_totals(terms.loan_type, terms.principal, terms.interest_rate,
+            terms.tenure_months, payment_frequency, spec);
+
+        totals.schedule = build_repayment_schedule(terms.loan_type, terms.principal, terms.interest_rate,
+            terms.tenure_months, terms.start_date, totals.total_amount, totals.emi_amount, payment_frequency, spec);
+
+        return totals;
+    };
+
+    // Quote many loans at once without calling the server, e.g. for offers prepared offline
+    const batch_quote = function(terms_list, spec) {
+        return terms_list.map(terms => quote(terms, spec));
+    };
+
+    const api = {
+        add_months: add_months,
+        get_period_rate: get_period_rate,
+        calculate_loan_totals: calculate_loan_totals,
+        build_repayment_schedule: build_repayment_schedule,
+        quote: quote,
+        batch_quote: batch_quote
+    };
+
+    if (typeof module !== "undefined" && module.exports) {
+        module.exports = api;
+    } else {
+        root.loan_calculator = Object.assign(root.loan_calculator || {}, api);
+    }
+})(typeof window !== "undefined" ? window : globalThis);
@@ -0,0 +1,314 @@
+"""
+What-if pricing and bulk application of Interest Setting rate revisions
+
+A proposed change to an Interest Setting (its default rate and amount slabs)
+is previewed against everything priced from it: pending applications, and
+optionally the unpaid tails of active loans disbursed from its applications.
+Each set is read in one query and re-priced in a single pass with the same
+calculator the Loan form uses, so the preview matches what apply writes.
+"""
+
+import json
+
+import frappe
+from frappe.utils import cint, flt, getdate, today
+from custom_loan.change_feed import get_payload, insert_change, is_change_feed_enabled
+from custom_loan.loan_state import invalidate_loan_state
+from custom_loan.payoff import invalidate_payoff_quotes
+from custom_loan.utils import build_repayment_schedule, calculate_loan_totals, lock_loan
+
+PENDING_APPLICATION_STATUSES = ("Draft", "Under Review")
+
+# Rows with the largest change in installment returned with a preview
+TOP_CHANGES = 20
+
+
+def get_proposed_setting(setting, proposal):
+    """
+    The Interest Setting as it would be after the proposed change, unsaved
+
+    Args:
+        setting (str): Interest Setting name
+        proposal (dict): New default_rate and/or amount_slabs; anything left out keeps its current value
+    """
+    if isinstance(proposal, str):
+        proposal = json.loads(proposal)
+
+    doc = frappe.get_doc("Interest Setting", setting)
+    doc.update({key: proposal[key] for key in ("default_rate", "amount_slabs") if key in proposal})
+    doc.validate_rates()
+
+    return doc
+
+
+def get_rates(setting_doc, amounts):
+    """Applicable rate per distinct amount, so each slab lookup runs once"""
+    return {amount: setting_doc.get_applicable_rate(amount) for amount in set(amounts)}
+
+
+def get_pending_applications(setting):
+    return frappe.db.sql("""
+        SELECT name, customer, loan_type, tenure_months, interest_rate,
+            IF(IFNULL(approved_amount, 0) > 0, approved_amount, requested_amount) as amount
+        FROM `tabLoan Application`
+        WHERE interest_setting = %(setting)s
+        AND status IN %(statuses)s
+    """, {"setting": setting, "statuses": PENDING_APPLICATION_STATUSES}, as_dict=True)
+
+
+def reprice_applications(applications, setting_doc, payment_frequency):
+    rates = get_rates(setting_doc, [flt(app.amount) for app in applications])
+
+    rows = []
+    for app in applications:
+        new_rate = rates[flt(app.amount)]
+        if flt(new_rate) == flt(app.interest_rate):
+            continue
+
+        before = calculate_loan_totals(app.loan_type, app.amount, app.interest_rate,
+                                       app.tenure_months, payment_frequency)
+        after = calculate_loan_totals(app.loan_type, app.amount, new_rate, app.tenure_months, payment_frequency)
+        rows.append(frappe._dict(
+            name=app.name,
+            customer=app.customer,
+            old_rate=flt(app.interest_rate),
+            new_rate=flt(new_rate),
+            interest_before=before["total_interest"],
+            interest_after=after["total_interest"],
+            emi_before=before["emi_amount"],
+            emi_after=after["emi_amount"]
+        ))
+
+    return rows
+
+
+def get_loan_tails(setting, effective_date, loans=None):
+    """
+    Open loans priced from the setting, with their unpaid installments due from the effective date
+
+    An installment only belongs to the tail if nothing at or after it has been
+    paid, so part-paid installments and everything before them keep their terms.
+    """
+    loan_condition = "AND l.name IN %(loans)s" if loans else ""
+    schedule = frappe.db.sql(f"""
+        SELECT l.name as loan, l.customer, l.loan_type, l.loan_amount, l.payment_frequency,
+            IF(IFNULL(l.revised_from_installment, 0) > 0, l.revised_rate, l.interest_rate) as interest_rate,
+            s.name as row_name, s.installment_number, s.due_date, s.status, s.paid_amount,
+            s.installment_amount, s.principal_amount, s.interest_amount
+        FROM `tabLoan` l
+        INNER JOIN `tabLoan Application` a ON a.name = l.loan_application
+        INNER JOIN `tabLoan Repayment Schedule` s ON s.parent = l.name AND s.parenttype = 'Loan'
+        WHERE a.interest_setting = %(setting)s
+        AND l.status IN ('Active', 'Overdue')
+        {loan_condition}
+        ORDER BY l.name, s.installment_number DESC
+    """, {"setting": setting, "loans": tuple(loans or ())}, as_dict=True)
+
+    tails = {}
+    for row in schedule:
+        tail = tails.setdefault(row.loan, frappe._dict(
+            loan=row.loan, customer=row.customer, loan_type=row.loan_type, interest_rate=row.interest_rate,
+            payment_frequency=row.payment_frequency, loan_amount=flt(row.loan_amount), rows=[], closed=False
+        ))
+        # Walking back from the last installment, the tail ends at the first one touched by a payment
+        if tail.closed or row.status not in ("Pending", "Overdue") or flt(row.paid_amount) \
+                or getdate(row.due_date) < getdate(effective_date):
+            tail.closed = True
+            continue
+        tail.rows.insert(0, row)
+
+    return [tail for tail in tails.values() if tail.rows]
+
+
+def reprice_tails(tails, setting_doc):
+    # Loans keep the slab of their original amount
+    rates = get_rates(setting_doc, [tail.loan_amount for tail in tails])
+
+    rows = []
+    for tail in tails:
+        new_rate = rates[tail.loan_amount]
+        if flt(new_rate) == flt(tail.interest_rate):
+            continue
+
+        # The tail is priced as a new loan over the remaining principal and installments
+        principal = sum(flt(row.principal_amount) for row in tail.rows)
+        installments = len(tail.rows)
+        totals = calculate_loan_totals(tail.loan_type, principal, new_rate, installments, tail.payment_frequency)
+        schedule = build_repayment_schedule(tail.loan_type, principal, new_rate, installments,
+                                            tail.rows[0].due_date, totals["total_amount"], totals["emi_amount"],
+                                            tail.payment_frequency)
+
+        rows.append(frappe._dict(
+            name=tail.loan,
+            customer=tail.customer,
+            old_rate=flt(tail.interest_rate),
+            new_rate=flt(new_rate),
+            installments=installments,
+            interest_before=sum(flt(row.interest_amount) for row in tail.rows),
+            interest_after=sum(row["interest_amount"] for row in schedule),
+            emi_before=flt(tail.rows[0].installment_amount),
+            emi_after=totals["emi_amount"],
+            schedule=[dict(new_row, name=old_row.row_name, installment_number=old_row.installment_number,
+                           due_date=old_row.due_date)
+                      for old_row, new_row in zip(tail.rows, schedule)]
+        ))
+
+    return rows
+
+
+def summarize(rows):
+    interest_before = sum(row.interest_before for row in rows)
+    interest_after = sum(row.interest_after for row in rows)
+    emi_changes = [row.emi_after - row.emi_before for row in rows]
+
+    return {
+        "count": len(rows),
+        "customers": len({row.customer for row in rows}),
+        "interest_before": flt(interest_before, 2),
+        "interest_after": flt(interest_after, 2),
+        "interest_change": flt(interest_after - interest_before, 2),
+        "emi_increased": len([change for change in emi_changes if change > 0]),
+        "emi_decreased": len([change for change in emi_changes if change < 0]),
+        "average_emi_change": flt(sum(emi_changes) / len(emi_changes), 2) if emi_changes else 0,
+        "largest_changes": [
+            {key: row[key] for key in ("name", "customer", "old_rate", "new_rate", "emi_before", "emi_after")}
+            for row in sorted(rows, key=lambda row: abs(row.emi_after - row.emi_before), reverse=True)[:TOP_CHANGES]
+        ]
+    }
+
+
+@frappe.whitelist()
+def preview_rate_revision(setting, proposal, include_loans=0, effective_date=None):
+    """
+    Impact of a proposed Interest Setting change, without saving anything
+
+    Args:
+        setting (str): Interest Setting name
+        proposal (dict): New default_rate and/or amount_slabs
+        include_loans (int): Also re-price the unpaid tails of active loans
+        effective_date (str): First due date a loan re-pricing applies to, today by default
+
+    Returns:
+        dict: aggregate diff for applications and loans, and the affected customer count
+    """
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    setting_doc = get_proposed_setting(setting, proposal)
+    payment_frequency = frappe.get_meta("Loan").get_field("payment_frequency").default
+
+    applications = reprice_applications(get_pending_applications(setting), setting_doc, payment_frequency)
+    loans = reprice_tails(get_loan_tails(setting, effective_date or today()), setting_doc) \
+        if cint(include_loans) else []
+
+    return {
+        "setting": setting,
+        "applications": summarize(applications),
+        "loans": summarize(loans) if cint(include_loans) else None,
+        "affected_customers": len({row.customer for row in applications + loans})
+    }
+
+
+@frappe.whitelist()
+def apply_rate_revision(setting, proposal, include_loans=0, effective_date=None, chunk_size=200):
+    """Save the proposed change and queue re-pricing of everything it affects"""
+    frappe.only_for("System Manager")
+
+    # Validate now so a bad proposal fails in the request, not in the job
+    get_proposed_setting(setting, proposal)
+
+    frappe.enqueue(
+        "custom_loan.rate_revision.run_rate_revision",
+        queue="long",
+        timeout=7200,
+        setting=setting,
+        proposal=proposal,
+        include_loans=cint(include_loans),
+        effective_date=effective_date or today(),
+        chunk_size=cint(chunk_size) or 200,
+        notify_user=frappe.session.user
+    )
+
+    return {"queued": True}
+
+
+def run_rate_revision(setting, proposal, include_loans=0, effective_date=None, chunk_size=200, notify_user=None):
+    """
+    Save the setting change, then re-price applications and loan tails chunk by chunk
+
+    Every chunk is re-read and committed on its own, so payments posted while
+    the job runs are respected and a rerun only touches what is still priced
+    at the old rate.
+    """
+    effective_date = effective_date or today()
+
+    setting_doc = get_proposed_setting(setting, proposal)
+    setting_doc.save()
+    frappe.db.commit()
+
+    payment_frequency = frappe.get_meta("Loan").get_field("payment_frequency").default
+    applications = reprice_applications(get_pending_applications(setting), setting_doc, payment_frequency)
+    for i in range(0, len(applications), chunk_size):
+        for row in applications[i:i + chunk_size]:
+            frappe.db.set_value("Loan Application", row.name, "interest_rate", row.new_rate)
+        frappe.db.commit()
+
+    repriced_loans = 0
+    if include_loans:
+        loans = [tail.loan for tail in get_loan_tails(setting, effective_date)]
+        for i in range(0, len(loans), chunk_size):
+            chunk = loans[i:i + chunk_size]
+            for loan in chunk:
+                lock_loan(loan)
+            # Re-read the tails under the lock, after any payment that got in first
+            for row in reprice_tails(get_loan_tails(setting, effective_date, chunk), setting_doc):
+                apply_tail(row)
+                repriced_loans += 1
+            frappe.db.commit()
+
+    result = {
+        "setting": setting,
+        "applications": len(applications),
+        "loans": repriced_loans
+    }
+
+    if notify_user:
+        frappe.publish_realtime("custom_loan_rate_revision", result, user=notify_user)
+
+    return result
+
+
+def apply_tail(row):
+    """
+    Write a re-priced tail and move the loan totals by the change in interest
+
+    interest_rate keeps the rate the loan was disbursed at; the new rate and
+    the first installment it applies to are kept in revised_rate and
+    revised_from_installment, and Loan.calculate_loan_amounts takes the totals
+    from the schedule from then on.
+    """
+    for schedule_row in row.schedule:
+        frappe.db.set_value("Loan Repayment Schedule", schedule_row["name"], {
+            "installment_amount": schedule_row["installment_amount"],
+            "principal_amount": schedule_row["principal_amount"],
+            "interest_amount": schedule_row["interest_amount"],
+            "remaining_balance": schedule_row["remaining_balance"]
+        }, update_modified=False)
+
+    change = flt(row.interest_after - row.interest_before)
+    frappe.db.sql("""
+        UPDATE `tabLoan`
+        SET revised_rate = %(rate)s, revised_from_installment = %(installment)s, emi_amount = %(emi)s,
+            total_interest = total_interest + %(change)s,
+            total_amount = total_amount + %(change)s,
+            outstanding_amount = outstanding_amount + %(change)s,
+            modified = NOW()
+        WHERE name = %(loan)s
+    """, {"rate": row.new_rate, "installment": row.schedule[0]["installment_number"], "emi": row.emi_after,
+          "change": change, "loan": row.name})
+
+    loan = frappe._dict(doctype="Loan", name=row.name)
+    invalidate_loan_state(loan)
+    invalidate_payoff_quotes(loan)
+
+    if is_change_feed_enabled():
+        insert_change("Update", "Loan", row.name, row.name, get_payload(frappe.get_doc("Loan", row.name)))
@@ -0,0 +1,249 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import csv
+import io
+import time
+from itertools import groupby
+
+import frappe
+from frappe.utils import flt, getdate, today
+from custom_loan.permissions import get_branch_conditions, get_user_branches
+from custom_loan.utils import get_penalty_due
+
+
+def execute(filters=None):
+    columns, data = [], []
+    filters = frappe._dict(filters or {})
+
+    columns = get_columns()
+    data = get_data(filters)
+
+    return columns, data
+
+
+def get_columns():
+    return [
+        {
+            "label": "Pin Code",
+            "fieldname": "pin_code",
+            "fieldtype": "Data",
+            "width": 90
+        },
+        {
+            "label": "City",
+            "fieldname": "city",
+            "fieldtype": "Data",
+            "width": 110
+        },
+        {
+            "label": "Address",
+            "fieldname": "address",
+            "fieldtype": "Data",
+            "width": 200
+        },
+        {
+            "label": "Customer",
+            "fieldname": "customer",
+            "fieldtype": "Link",
+            "options": "Loan Customer",
+            "width": 150
+        },
+        {
+            "label": "Mobile",
+            "fieldname": "mobile_number",
+            "fieldtype": "Data",
+            "width": 110
+        },
+        {
+            "label": "Loans",
+            "fieldname": "loans",
+            "fieldtype": "Int",
+            "width": 60
+        },
+        {
+            "label": "Due Today",
+            "fieldname": "due_today",
+            "fieldtype": "Currency",
+            "width": 110
+        },
+        {
+            "label": "Overdue",
+            "fieldname": "overdue_amount",
+            "fieldtype": "Currency",
+            "width": 110
+        },
+        {
+            "label": "Overdue Inst.",
+            "fieldname": "overdue_installments",
+            "fieldtype": "Int",
+            "width": 90
+        },
+        {
+            "label": "Penalty",
+            "fieldname": "penalty",
+            "fieldtype": "Currency",
+            "width": 100
+        },
+        {
+            "label": "To Collect",
+            "fieldname": "total_due",
+            "fieldtype": "Currency",
+            "width": 120
+        }
+    ]
+
+
+def get_data(filters):
+    """
+    Collection figures per customer for the route sheet
+
+    Due-today and overdue amounts across all of a customer's loans come out
+    of a single grouped query, already ordered by locality so that rows can
+    be handed to an agent as they are. The penalty is the counter's.
+    """
+    conditions = get_conditions(filters)
+
+    data = frappe.db.sql(f"""
+        SELECT
+            c.pin_code,
+            c.city,
+            CONCAT_WS(', ', NULLIF(c.address_line_1, ''), NULLIF(c.address_line_2, '')) as address,
+            c.name as customer,
+            c.mobile_number,
+            COUNT(DISTINCT l.name) as loans,
+            SUM(CASE WHEN s.due_date = %(date)s
+                THEN s.installment_amount - IFNULL(s.paid_amount, 0) ELSE 0 END) as due_today,
+            SUM(CASE WHEN s.due_date < %(date)s
+                THEN s.installment_amount - IFNULL(s.paid_amount, 0) ELSE 0 END) as overdue_amount,
+            SUM(CASE WHEN s.due_date < %(date)s THEN 1 ELSE 0 END) as overdue_installments
+        FROM `tabLoan Customer` c
+        INNER JOIN `tabLoan` l ON l.customer = c.name
+        INNER JOIN `tabLoan Repayment Schedule` s ON s.parent = l.name AND s.parenttype = 'Loan'
+        WHERE l.status IN ('Active', 'Overdue')
+        AND s.status IN ('Pending', 'Partial')
+        AND s.due_date <= %(date)s
+        {conditions}
+        GROUP BY c.name, c.pin_code, c.city, c.address_line_1, c.address_line_2, c.mobile_number
+        ORDER BY c.pin_code, c.city, c.address_line_1, c.name
+    """, dict(
+        filters,
+        date=getdate(filters.get("date") or today())
+    ), as_dict=1)
+
+    for row in data:
+        # What the counter will ask for, so the agent quotes the same figure
+        row.penalty = get_penalty_due(row.overdue_amount)
+        row.total_due = flt(row.due_today) + flt(row.overdue_amount) + row.penalty
+
+    return data
+
+
+def get_conditions(filters):
+    conditions = ""
+
+    if filters.get("city"):
+        conditions += " AND c.city = %(city)s"
+
+    if filters.get("pin_code"):
+        conditions += " AND c.pin_code = %(pin_code)s"
+
+    conditions += get_branch_conditions(filters, "l.branch")
+
+    # Background jobs carry the branches of the user who queued them
+    if filters.get("allowed_branches"):
+        filters["allowed_branches"] = tuple(filters.allowed_branches)
+        conditions += " AND l.branch IN %(allowed_branches)s"
+
+    return conditions
+
+
+@frappe.whitelist()
+def generate_route_sheets(date=None, city=None, branch=None):
+    """Queue route sheet generation for every locality the user's branches cover"""
+    frappe.has_permission("Loan", "read", throw=True)
+
+    frappe.enqueue(
+        "custom_loan.report.collection_route_sheet.collection_route_sheet.make_route_sheets",
+        queue="long",
+        date=date or today(),
+        city=city,
+        branch=branch,
+        allowed_branches=get_user_branches()
+    )
+
+    return {"queued": True}
+
+
+def make_route_sheets(date, city=None, branch=None, allowed_branches=None):
+    """
+    Build a CSV and PDF route sheet per pin code in one pass
+
+    The whole book, or the part of it in allowed_branches, is read with the
+    same query as the report and split by locality afterwards, so the number
+    of localities does not add queries.
+    """
+    from frappe.utils.pdf import get_pdf
+
+    start = time.monotonic()
+    rows = get_data(frappe._dict(date=date, city=city, branch=branch, allowed_branches=allowed_branches))
+    columns = get_columns()
+    files = []
+
+    for pin_code, customers in groupby(rows, key=lambda row: row.pin_code or ""):
+        customers = list(customers)
+        sheet_name = f"route-sheet-{date}-{branch + '-' if branch else ''}{pin_code or 'no-pin'}"
+
+        files.append(save_file(f"{sheet_name}.csv", get_csv(columns, customers)))
+        files.append(save_file(f"{sheet_name}.pdf", get_pdf(get_html(date, pin_code, columns, customers))))
+
+    return {
+        "date": str(date),
+        "customers": len(rows),
+        "sheets": len(files) // 2,
+        "files": files,
+        "elapsed": round(time.monotonic() - start, 2)
+    }
+
+
+def get_csv(columns, rows):
+    """Render route sheet rows as CSV"""
+    out = io.StringIO()
+    writer = csv.writer(out)
+    writer.writerow([column["label"] for column in columns])
+    for row in rows:
+        writer.writerow([row.get(column["fieldname"]) for column in columns])
+
+    return out.getvalue()
+
+
+def get_html(date, pin_code, columns, rows):
+    """Render route sheet rows as a compact printable table"""
+    return frappe.render_template("""
+        <h3>Collection Route Sheet - {{ pin_code or "No Pin Code" }} - {{ frappe.format(date, "Date") }}</h3>
+        <table class="table table-bordered table-condensed" style="font-size: 9px;">
+            <thead><tr>{% for column in columns %}<th>{{ column.label }}</th>{% endfor %}</tr></thead>
+            <tbody>
+            {% for row in rows %}
+                <tr>{% for column in columns %}
+                    <td>{{ frappe.format(row[column.fieldname], column) if row[column.fieldname] is not none else "" }}</td>
+                {% endfor %}</tr>
+            {% endfor %}
+            </tbody>
+        </table>
+    """, {"date": date, "pin_code": pin_code, "columns": columns, "rows": rows})
+
+
+def save_file(file_name, content):
+    """Store a generated sheet as a private file and return its URL"""
+    file_doc = frappe.get_doc({
+        "doctype": "File",
+        "file_name": file_name,
+        "content": content,
+        "is_private": 1
+    })
+    file_doc.insert(ignore_permissions=True)
+
+    return file_doc.file_url
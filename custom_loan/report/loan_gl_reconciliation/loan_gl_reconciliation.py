@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import flt, getdate, today
+
+
+def execute(filters=None):
+    columns, data = [], []
+    filters = frappe._dict(filters or {})
+
+    columns = get_columns()
+    data = get_data(filters)
+
+    return columns, data
+
+
+def get_columns():
+    return [
+        {
+            "label": "Account",
+            "fieldname": "account",
+            "fieldtype": "Link",
+            "options": "Account",
+            "width": 220
+        },
+        {
+            "label": "Loan Book",
+            "fieldname": "book_balance",
+            "fieldtype": "Currency",
+            "width": 140
+        },
+        {
+            "label": "Queued, Not Posted",
+            "fieldname": "unposted_amount",
+            "fieldtype": "Currency",
+            "width": 140
+        },
+        {
+            "label": "General Ledger",
+            "fieldname": "gl_balance",
+            "fieldtype": "Currency",
+            "width": 140
+        },
+        {
+            "label": "Difference",
+            "fieldname": "difference",
+            "fieldtype": "Currency",
+            "width": 120
+        }
+    ]
+
+
+def get_data(filters):
+    """
+    Compare loan book balances with the General Ledger, one row per account
+
+    Amounts still waiting in the GL queue explain a timing difference; any
+    remaining difference needs to be looked into.
+    """
+    settings = frappe.get_cached_doc("Loan Settings")
+    if not settings.enable_gl_posting:
+        frappe.throw("GL posting is not enabled in Loan Settings")
+
+    params = {"date": getdate(filters.get("date") or today())}
+
+    book = frappe.db.sql("""
+        SELECT
+            (SELECT IFNULL(SUM(loan_amount), 0) FROM `tabLoan` WHERE loan_date <= %(date)s) as disbursed,
+            IFNULL(SUM(principal_paid), 0) as principal,
+            IFNULL(SUM(interest_paid), 0) as interest,
+            IFNULL(SUM(penalty_paid), 0) as penalty
+        FROM `tabLoan Payment`
+        WHERE docstatus = 1 AND payment_date <= %(date)s
+    """, params, as_dict=True)[0]
+
+    unposted = dict(frappe.db.sql("""
+        SELECT entry_type, SUM(amount)
+        FROM `tabLoan GL Queue Entry`
+        WHERE is_posted = 0 AND posting_date <= %(date)s
+        GROUP BY entry_type
+    """, params))
+
+    accounts = [
+        (settings.loan_account,
+         flt(book.disbursed) - flt(book.principal),
+         flt(unposted.get("Disbursal")) - flt(unposted.get("Principal")), 1),
+        (settings.interest_income_account, flt(book.interest), flt(unposted.get("Interest")), -1),
+        (settings.penalty_income_account, flt(book.penalty), flt(unposted.get("Penalty")), -1)
+    ]
+
+    gl_balances = dict(frappe.db.sql("""
+        SELECT account, SUM(debit) - SUM(credit)
+        FROM `tabGL Entry`
+        WHERE account IN %(accounts)s AND company = %(company)s
+        AND posting_date <= %(date)s AND is_cancelled = 0
+        GROUP BY account
+    """, dict(params, accounts=tuple(a[0] for a in accounts), company=settings.company)))
+
+    data = []
+    for account, book_balance, unposted_amount, sign in accounts:
+        # Income accounts carry a credit balance
+        gl_balance = flt(gl_balances.get(account)) * sign
+        data.append({
+            "account": account,
+            "book_balance": flt(book_balance, 2),
+            "unposted_amount": flt(unposted_amount, 2),
+            "gl_balance": flt(gl_balance, 2),
+            "difference": flt(book_balance - unposted_amount - gl_balance, 2)
+        })
+
+    return data
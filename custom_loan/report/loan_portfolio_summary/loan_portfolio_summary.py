@@ -3,8 +3,11 @@
 
 import frappe
 from frappe.utils import flt, cint
+from custom_loan.permissions import get_branch_conditions
+from custom_loan.db_routing import use_replica
 
 
+@use_replica
 def execute(filters=None):
     columns, data = [], []
     
@@ -29,6 +32,13 @@ def get_columns():
             "fieldtype": "Data",
             "width": 150
         },
+        {
+            "label": "Branch",
+            "fieldname": "branch",
+            "fieldtype": "Link",
+            "options": "Loan Branch",
+            "width": 120
+        },
         {
             "label": "Mobile",
             "fieldname": "mobile_number",
@@ -99,6 +109,7 @@ def get_data(filters):
         SELECT 
             name as loan_id,
             customer_name,
+            branch,
             mobile_number,
             loan_type,
             loan_date,
@@ -134,5 +145,7 @@ def get_conditions(filters):
     
     if filters.get("to_date"):
         conditions += " AND loan_date <= %(to_date)s"
+
+    conditions += get_branch_conditions(filters)
     
     return conditions
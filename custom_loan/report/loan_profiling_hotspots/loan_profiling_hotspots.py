@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import os
+import pstats
+
+import frappe
+from frappe.utils import cint, getdate
+from custom_loan.profiling import get_profile_folder, list_profiles, parse_profile_name
+
+SORT_FIELDS = {
+    "Own Time": "own_time",
+    "Cumulative Time": "cumulative_time",
+    "Calls": "calls"
+}
+
+
+def execute(filters=None):
+    columns, data = [], []
+    filters = frappe._dict(filters or {})
+
+    columns = get_columns()
+    data = get_data(filters)
+
+    return columns, data
+
+
+def get_columns():
+    return [
+        {
+            "label": "Function",
+            "fieldname": "function",
+            "fieldtype": "Data",
+            "width": 220
+        },
+        {
+            "label": "Location",
+            "fieldname": "location",
+            "fieldtype": "Data",
+            "width": 320
+        },
+        {
+            "label": "Calls",
+            "fieldname": "calls",
+            "fieldtype": "Int",
+            "width": 90
+        },
+        {
+            "label": "Own Time (ms)",
+            "fieldname": "own_time",
+            "fieldtype": "Float",
+            "precision": 1,
+            "width": 120
+        },
+        {
+            "label": "Cumulative Time (ms)",
+            "fieldname": "cumulative_time",
+            "fieldtype": "Float",
+            "precision": 1,
+            "width": 150
+        },
+        {
+            "label": "Share of Own Time",
+            "fieldname": "own_share",
+            "fieldtype": "Percent",
+            "width": 130
+        },
+        {
+            "label": "Profiles",
+            "fieldname": "profiles",
+            "fieldtype": "Int",
+            "width": 90
+        }
+    ]
+
+
+def get_data(filters):
+    """Hottest functions over all captures matching the filters"""
+    folder = get_profile_folder()
+    functions, total_time = {}, 0
+
+    for name in list_profiles():
+        profile = parse_profile_name(name)
+        if not profile or (filters.target and filters.target not in profile.target):
+            continue
+        # Newest first, so everything after this one is older still
+        if filters.from_date and getdate(profile.captured_at) < getdate(filters.from_date):
+            break
+
+        try:
+            stats = pstats.Stats(os.path.join(folder, name))
+        except Exception:
+            # Pruned by another worker while reading
+            continue
+
+        total_time += stats.total_tt
+        for (filename, line, function), (_, calls, own_time, cumulative_time, _) in stats.stats.items():
+            row = functions.setdefault((filename, line, function), frappe._dict(
+                function=function,
+                location=f"{shorten_path(filename)}:{line}" if line else shorten_path(filename),
+                calls=0, own_time=0, cumulative_time=0, profiles=0
+            ))
+            row.calls += calls
+            row.own_time += own_time * 1000
+            row.cumulative_time += cumulative_time * 1000
+            row.profiles += 1
+
+    sort_field = SORT_FIELDS.get(filters.sort_by) or "own_time"
+    data = sorted(functions.values(), key=lambda row: row[sort_field], reverse=True)[:cint(filters.limit) or 50]
+    for row in data:
+        row.own_share = row.own_time / (total_time * 1000) * 100 if total_time else 0
+
+    return data
+
+
+def shorten_path(filename):
+    """Path from the apps folder, so bench locations read the same on every server"""
+    marker = os.sep + "apps" + os.sep
+    return filename.split(marker, 1)[1] if marker in filename else filename
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+# Copyright (c) 2025, Your Company and contributors
+# For license information, please see license.txt
+
+import frappe
+from frappe.utils import flt, get_first_day
+from custom_loan.permissions import get_branch_conditions
+from custom_loan.db_routing import use_replica
+from custom_loan.utils import DPD_BUCKETS
+
+EXIT_STATES = ["Closed", "Written Off"]
+
+
+@use_replica
+def execute(filters=None):
+    columns, data = [], []
+    filters = frappe._dict(filters or {})
+
+    columns = get_columns()
+    data = get_data(filters)
+
+    return columns, data
+
+
+def get_states():
+    return [label for label, from_day, to_day in DPD_BUCKETS] + EXIT_STATES
+
+
+def get_columns():
+    columns = [
+        {
+            "label": "From Bucket",
+            "fieldname": "from_bucket",
+            "fieldtype": "Data",
+            "width": 110
+        },
+        {
+            "label": "Loans",
+            "fieldname": "loans",
+            "fieldtype": "Int",
+            "width": 80
+        }
+    ]
+
+    for state in get_states():
+        columns.append({
+            "label": f"To {state}",
+            "fieldname": frappe.scrub(state),
+            "fieldtype": "Percent",
+            "width": 100
+        })
+
+    return columns
+
+
+def get_data(filters):
+    """
+    Month-over-month bucket transitions as a roll-rate matrix
+
+    Each snapshot row is paired with the same loan's row one month later and
+    the pairs are counted per (from bucket, to bucket) in the database; only
+    the small matrix is pivoted here.
+    """
+    conditions = get_conditions(filters)
+
+    transitions = frappe.db.sql(f"""
+        SELECT a.dpd_bucket as from_bucket, b.dpd_bucket as to_bucket, COUNT(*) as loans
+        FROM `tabLoan Monthly Snapshot` a
+        INNER JOIN `tabLoan Monthly Snapshot` b
+            ON b.loan = a.loan AND b.snapshot_month = DATE_ADD(a.snapshot_month, INTERVAL 1 MONTH)
+        WHERE a.snapshot_month >= %(from_month)s
+        AND a.snapshot_month < %(to_month)s
+        AND a.dpd_bucket NOT IN ('Closed', 'Written Off')
+        {conditions}
+        GROUP BY a.dpd_bucket, b.dpd_bucket
+    """, dict(
+        filters,
+        from_month=get_first_day(filters.from_month),
+        to_month=get_first_day(filters.to_month)
+    ), as_dict=1)
+
+    matrix = {}
+    for row in transitions:
+        matrix.setdefault(row.from_bucket, {})[row.to_bucket] = row.loans
+
+    data = []
+    for from_bucket in [label for label, from_day, to_day in DPD_BUCKETS]:
+        counts = matrix.get(from_bucket, {})
+        loans = sum(counts.values())
+        row = frappe._dict(from_bucket=from_bucket, loans=loans)
+
+        for state in get_states():
+            row[frappe.scrub(state)] = flt(counts.get(state, 0) * 100.0 / loans, 2) if loans else 0
+
+        data.append(row)
+
+    return data
+
+
+def get_conditions(filters):
+    conditions = ""
+
+    if filters.get("loan_type"):
+        conditions += " AND a.loan_type = %(loan_type)s"
+
+    conditions += get_branch_conditions(filters, "a.branch")
+
+    return conditions
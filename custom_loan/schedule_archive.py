@@ -0,0 +1,209 @@
+"""
+Archival of repayment schedules for closed loans
+
+Closed and written off loans keep every installment row forever, which bloats
+`tabLoan Repayment Schedule` for all the queries that join on it. Archiving
+packs a loan's schedule into one compressed, column-oriented blob on
+Loan Schedule Archive and deletes the child rows. The rows are decoded only
+when someone asks for them.
+"""
+
+import base64
+import json
+import time
+import zlib
+
+import frappe
+from frappe.utils import add_months, cint, get_first_day, getdate, now_datetime, today
+from custom_loan.utils import get_overdue_loans
+
+ARCHIVABLE_STATUSES = ("Closed", "Written Off")
+
+SCHEDULE_COLUMNS = [
+    "installment_number", "due_date", "installment_amount", "principal_amount",
+    "interest_amount", "remaining_balance", "status", "paid_date", "paid_amount"
+]
+DATE_COLUMNS = ("due_date", "paid_date")
+
+
+def pack_schedule(rows):
+    """
+    Pack schedule rows column by column and compress them
+
+    Storing columns instead of rows keeps repeated values (status, installment
+    amount) next to each other, which is what zlib compresses best.
+
+    Returns:
+        tuple: (packed text, raw size in bytes)
+    """
+    columns = {
+        column: [str(row[column]) if column in DATE_COLUMNS and row[column] else row[column] for row in rows]
+        for column in SCHEDULE_COLUMNS
+    }
+    raw = json.dumps(columns, separators=(",", ":"), default=float).encode()
+
+    return base64.b64encode(zlib.compress(raw, 9)).decode(), len(raw)
+
+
+def unpack_schedule(packed):
+    """Decode a packed schedule back into a list of row dicts"""
+    columns = json.loads(zlib.decompress(base64.b64decode(packed)))
+    count = len(columns["installment_number"])
+
+    rows = []
+    for i in range(count):
+        row = frappe._dict({column: columns[column][i] for column in SCHEDULE_COLUMNS})
+        for column in DATE_COLUMNS:
+            row[column] = getdate(row[column]) if row[column] else None
+        rows.append(row)
+
+    return rows
+
+
+def archive_loan_schedules(loans):
+    """Archive the schedules of the given loans inside the current transaction"""
+    if not loans:
+        return 0
+
+    schedules = {}
+    for row in frappe.db.sql(f"""
+        SELECT parent, {", ".join(SCHEDULE_COLUMNS)}
+        FROM `tabLoan Repayment Schedule`
+        WHERE parent IN %(loans)s AND parenttype = 'Loan'
+        ORDER BY parent, idx
+    """, {"loans": tuple(loans)}, as_dict=True):
+        schedules.setdefault(row.parent, []).append(row)
+
+    statuses = dict(frappe.get_all("Loan", filters={"name": ["in", list(schedules)]},
+                                   fields=["name", "status"], as_list=True))
+
+    now, user = now_datetime(), frappe.session.user
+    values = []
+    for loan, rows in schedules.items():
+        packed, raw_size = pack_schedule(rows)
+        values.append((loan, now, now, user, user, loan, statuses.get(loan), now,
+                       len(rows), raw_size, len(packed), packed))
+
+    frappe.db.bulk_insert("Loan Schedule Archive",
+                          fields=["name", "creation", "modified", "owner", "modified_by", "loan",
+                                  "loan_status", "archived_on", "installments", "raw_size",
+                                  "packed_size", "packed_schedule"],
+                          values=values)
+    frappe.db.sql("""
+        DELETE FROM `tabLoan Repayment Schedule`
+        WHERE parent IN %(loans)s AND parenttype = 'Loan'
+    """, {"loans": tuple(schedules)})
+
+    return len(values)
+
+
+def archive_closed_loan_schedules(chunk_size=500):
+    """
+    Migrate schedules of all closed and written off loans into the archive
+
+    Commits after every chunk so a long run can be stopped and resumed. Table
+    sizes and the time of the overdue query are measured before and after.
+    """
+    chunk_size = cint(chunk_size) or 500
+    before = get_schedule_storage_stats()
+    overdue_query_before = time_overdue_query()
+    start = time.monotonic()
+
+    # Loans closed last month or later are left for the month-end interest accrual
+    loans = frappe.db.sql_list("""
+        SELECT l.name
+        FROM `tabLoan` l
+        WHERE l.status IN %(statuses)s
+        AND IFNULL(l.last_payment_date, l.loan_date) < %(accrual_start)s
+        AND EXISTS (
+            SELECT 1 FROM `tabLoan Repayment Schedule` s
+            WHERE s.parent = l.name AND s.parenttype = 'Loan'
+        )
+    """, {"statuses": ARCHIVABLE_STATUSES, "accrual_start": get_first_day(add_months(today(), -1))})
+
+    archived = 0
+    for i in range(0, len(loans), chunk_size):
+        archived += archive_loan_schedules(loans[i:i + chunk_size])
+        frappe.db.commit()
+
+    return {
+        "archived_loans": archived,
+        "elapsed": round(time.monotonic() - start, 2),
+        "storage_before": before,
+        "storage_after": get_schedule_storage_stats(),
+        "overdue_query_seconds_before": overdue_query_before,
+        "overdue_query_seconds_after": time_overdue_query()
+    }
+
+
+def time_overdue_query():
+    start = time.monotonic()
+    get_overdue_loans()
+    return round(time.monotonic() - start, 4)
+
+
+@frappe.whitelist()
+def get_schedule_storage_stats():
+    """Row counts and on-disk size of the live and archived schedule tables"""
+    frappe.only_for("System Manager")
+
+    return frappe.db.sql("""
+        SELECT table_name as `table`, table_rows as `rows`,
+            data_length as data_bytes, index_length as index_bytes
+        FROM information_schema.tables
+        WHERE table_schema = DATABASE()
+        AND table_name IN ('tabLoan Repayment Schedule', 'tabLoan Schedule Archive')
+    """, as_dict=True)
+
+
+def get_loan_schedule(loan):
+    """Repayment schedule of a loan, from the live table or the archive"""
+    rows = frappe.get_all("Loan Repayment Schedule",
+                          filters={"parent": loan, "parenttype": "Loan"},
+                          fields=SCHEDULE_COLUMNS,
+                          order_by="idx asc")
+    if rows:
+        return rows
+
+    packed = frappe.db.get_value("Loan Schedule Archive", loan, "packed_schedule")
+    return unpack_schedule(packed) if packed else []
+
+
+@frappe.whitelist()
+def get_archived_schedule(loan):
+    """Decode an archived schedule on demand for the Loan form"""
+    frappe.has_permission("Loan", "read", loan, throw=True)
+
+    packed = frappe.db.get_value("Loan Schedule Archive", loan, "packed_schedule")
+    return unpack_schedule(packed) if packed else []
+
+
+@frappe.whitelist()
+def restore_archived_schedule(loan):
+    """Move an archived schedule back into the live table from the Loan form"""
+    frappe.has_permission("Loan", "write", loan, throw=True)
+
+    if frappe.db.exists("Loan Repayment Schedule", {"parent": loan, "parenttype": "Loan"}):
+        frappe.throw(f"Loan {loan} already has a live repayment schedule")
+
+    return restore_schedule(loan)
+
+
+def restore_schedule(loan):
+    """
+    Move an archived schedule back into the live table, e.g. when a loan is reopened
+
+    Returns:
+        int: number of installments restored, 0 when the loan has no archive
+    """
+    packed = frappe.db.get_value("Loan Schedule Archive", loan, "packed_schedule")
+    if not packed:
+        return 0
+
+    loan_doc = frappe.get_doc("Loan", loan)
+    for row in unpack_schedule(packed):
+        loan_doc.append("repayment_schedule", row).db_insert()
+
+    frappe.delete_doc("Loan Schedule Archive", loan, ignore_permissions=True)
+
+    return len(loan_doc.repayment_schedule)
@@ -0,0 +1,276 @@
+"""
+Loan account statements per loan or customer for a date range
+
+A statement runs from the opening balance through every disbursal, with
+the interest charged on it, and every payment in the period, with the
+principal/interest/penalty split of each payment, to the closing balance,
+and lists the schedule with its status.
+"""
+
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import frappe
+import pdfkit
+from frappe.utils import add_months, cint, flt, get_first_day, get_last_day, getdate, today
+from custom_loan.schedule_archive import SCHEDULE_COLUMNS, get_loan_schedule
+
+STATEMENT_TEMPLATE = "custom_loan/templates/loan_statement.html"
+PDF_OPTIONS = {
+    "page-size": "A4",
+    "encoding": "UTF-8",
+    "margin-top": "15mm",
+    "margin-bottom": "15mm",
+    "margin-left": "10mm",
+    "margin-right": "10mm",
+    "quiet": ""
+}
+
+
+def build_statements(loans, from_date, to_date):
+    """
+    Statements for many loans with one query per kind of row
+
+    Args:
+        loans (list): Loan names
+        from_date (date): First day of the period
+        to_date (date): Last day of the period
+
+    Returns:
+        list: one statement dict per loan, in the order given
+    """
+    if not loans:
+        return []
+
+    params = {"loans": tuple(loans), "from_date": from_date, "to_date": to_date}
+
+    statements = {}
+    for loan in frappe.db.sql("""
+        SELECT l.name, l.customer, l.customer_name, l.loan_type, l.status, l.loan_date,
+            l.loan_amount, l.total_amount,
+            IFNULL(SUM(CASE WHEN p.payment_date < %(from_date)s THEN p.amount END), 0) as paid_before
+        FROM `tabLoan` l
+        LEFT JOIN `tabLoan Payment` p ON p.loan = l.name AND p.docstatus = 1
+        WHERE l.name IN %(loans)s AND l.loan_date <= %(to_date)s
+        GROUP BY l.name
+    """, params, as_dict=True):
+        disbursed_before = loan.loan_date < from_date
+        opening_balance = flt(loan.total_amount) - flt(loan.paid_before) if disbursed_before else 0
+
+        statement = statements[loan.name] = frappe._dict(
+            loan=loan.name,
+            customer=loan.customer,
+            customer_name=loan.customer_name,
+            loan_type=loan.loan_type,
+            status=loan.status,
+            opening_balance=flt(opening_balance, 2),
+            closing_balance=flt(opening_balance, 2),
+            entries=[],
+            schedule=[]
+        )
+
+        if not disbursed_before:
+            add_entry(statement, loan.loan_date, "Loan Disbursed", flt(loan.loan_amount))
+            # The balance is what the customer owes, so the loan's interest is charged with the disbursal
+            if flt(loan.total_amount) > flt(loan.loan_amount):
+                add_entry(statement, loan.loan_date, "Interest Charged",
+                          flt(loan.total_amount) - flt(loan.loan_amount))
+
+    if not statements:
+        return []
+
+    params["loans"] = tuple(statements)
+    for payment in frappe.db.sql("""
+        SELECT loan, name, payment_date, amount, payment_type,
+            principal_paid, interest_paid, penalty_paid
+        FROM `tabLoan Payment`
+        WHERE loan IN %(loans)s AND docstatus = 1
+        AND payment_date BETWEEN %(from_date)s AND %(to_date)s
+        ORDER BY loan, payment_date, creation
+    """, params, as_dict=True):
+        add_entry(statements[payment.loan], payment.payment_date,
+                  f"{payment.payment_type or 'Payment'} {payment.name}", -flt(payment.amount),
+                  principal=flt(payment.principal_paid), interest=flt(payment.interest_paid),
+                  penalty=flt(payment.penalty_paid))
+
+    for row in frappe.db.sql(f"""
+        SELECT parent, {", ".join(SCHEDULE_COLUMNS)}
+        FROM `tabLoan Repayment Schedule`
+        WHERE parent IN %(loans)s AND parenttype = 'Loan'
+        ORDER BY parent, idx
+    """, params, as_dict=True):
+        statements[row.parent].schedule.append(row)
+
+    for statement in statements.values():
+        # Schedules of closed loans may have been moved to the archive
+        if not statement.schedule:
+            statement.schedule = get_loan_schedule(statement.loan)
+
+    return [statements[loan] for loan in loans if loan in statements]
+
+
+def add_entry(statement, date, particulars, amount, principal=0, interest=0, penalty=0):
+    """Append a line and carry the running balance"""
+    statement.closing_balance = flt(statement.closing_balance + amount, 2)
+    statement.entries.append(frappe._dict(
+        date=date,
+        particulars=particulars,
+        principal=principal,
+        interest=interest,
+        penalty=penalty,
+        amount=abs(amount),
+        balance=statement.closing_balance
+    ))
+
+
+def get_statement_loans(loan=None, customer=None):
+    if loan:
+        return [loan]
+
+    return frappe.get_all("Loan", filters={"customer": customer}, order_by="loan_date asc", pluck="name")
+
+
+def get_statement_html(customer, customer_name, statements, from_date, to_date):
+    return frappe.render_template(STATEMENT_TEMPLATE, {
+        "customer": customer,
+        "customer_name": customer_name,
+        "statements": statements,
+        "from_date": from_date,
+        "to_date": to_date
+    })
+
+
+def render_pdf(html):
+    """Convert statement HTML to PDF; runs in a worker process without a site connection"""
+    return pdfkit.from_string(html, False, options=PDF_OPTIONS)
+
+
+@frappe.whitelist()
+def get_statement(from_date, to_date, loan=None, customer=None):
+    """
+    Statement data for one loan or all loans of a customer
+
+    Args:
+        from_date (str): First day of the period
+        to_date (str): Last day of the period
+        loan (str): Loan name
+        customer (str): Loan Customer name, used when no loan is given
+
+    Returns:
+        list: one statement per loan
+    """
+    if not (loan or customer):
+        frappe.throw("Select a loan or a customer for the statement")
+
+    if loan:
+        frappe.has_permission("Loan", "read", loan, throw=True)
+    else:
+        frappe.has_permission("Loan Customer", "read", customer, throw=True)
+
+    return build_statements(get_statement_loans(loan, customer), getdate(from_date), getdate(to_date))
+
+
+@frappe.whitelist()
+def download_statement(from_date, to_date, loan=None, customer=None):
+    """Download a statement as PDF"""
+    from_date, to_date = getdate(from_date), getdate(to_date)
+    statements = get_statement(from_date, to_date, loan=loan, customer=customer)
+    if not statements:
+        frappe.throw("No loans found for the statement")
+
+    html = get_statement_html(statements[0].customer, statements[0].customer_name, statements, from_date, to_date)
+
+    frappe.local.response.filename = f"statement-{loan or customer}-{from_date}-{to_date}.pdf"
+    frappe.local.response.filecontent = render_pdf(html)
+    frappe.local.response.type = "pdf"
+
+
+@frappe.whitelist()
+def generate_month_end_statements(month=None, branch=None):
+    """Queue statements of the previous month for every customer with an open or recently paid loan"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    frappe.enqueue("custom_loan.statement.make_month_end_statements", queue="long", timeout=14400,
+                   month=month, branch=branch, notify_user=frappe.session.user)
+
+    return {"queued": True}
+
+
+def make_month_end_statements(month=None, chunk_size=200, workers=None, notify_user=None, branch=None):
+    """
+    Render a PDF statement per customer with an open loan
+
+    Loans paid since the start of the month are included too, so a loan
+    closed during the month gets its final statement.
+
+    Customers are read in keyset-paginated chunks and each chunk's
+    statements are built with a handful of queries, rendered to HTML here
+    and converted to PDF by a process pool. Only one chunk is held in
+    memory at a time, whatever the size of the book.
+    """
+    start = time.monotonic()
+    from_date = get_first_day(month or add_months(today(), -1))
+    to_date = get_last_day(from_date)
+    chunk_size = cint(chunk_size) or 200
+    branch_condition = "AND branch = %(branch)s" if branch else ""
+
+    generated, last_customer = 0, ""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        while True:
+            customers = frappe.db.sql_list(f"""
+                SELECT DISTINCT customer
+                FROM `tabLoan`
+                WHERE (status IN ('Active', 'Overdue') OR last_payment_date >= %(from_date)s)
+                AND customer > %(after)s
+                {branch_condition}
+                ORDER BY customer
+                LIMIT %(limit)s
+            """, {"from_date": from_date, "after": last_customer, "limit": chunk_size, "branch": branch})
+            if not customers:
+                break
+
+            generated += make_statement_chunk(pool, customers, from_date, to_date)
+            last_customer = customers[-1]
+            frappe.db.commit()
+
+    result = {
+        "from_date": str(from_date),
+        "to_date": str(to_date),
+        "statements": generated,
+        "elapsed": round(time.monotonic() - start, 2)
+    }
+
+    if notify_user:
+        frappe.publish_realtime("custom_loan_statements", result, user=notify_user)
+
+    return result
+
+
+def make_statement_chunk(pool, customers, from_date, to_date):
+    """Build, render and store the statements of one chunk of customers"""
+    loans = frappe.get_all("Loan", filters={"customer": ["in", customers]},
+                           order_by="customer asc, loan_date asc", pluck="name")
+
+    by_customer = {}
+    for statement in build_statements(loans, from_date, to_date):
+        by_customer.setdefault(statement.customer, []).append(statement)
+
+    documents = [
+        (customer, get_statement_html(customer, statements[0].customer_name, statements, from_date, to_date))
+        for customer, statements in by_customer.items()
+    ]
+
+    pdfs = pool.map(render_pdf, [html for customer, html in documents])
+    for (customer, html), pdf in zip(documents, pdfs):
+        frappe.get_doc({
+            "doctype": "File",
+            "file_name": f"statement-{customer}-{from_date:%Y-%m}.pdf",
+            "content": pdf,
+            "attached_to_doctype": "Loan Customer",
+            "attached_to_name": customer,
+            "is_private": 1
+        }).insert(ignore_permissions=True)
+
+    return len(documents)
@@ -0,0 +1,32 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from custom_loan.api_payload import PAYLOAD_METRICS_KEY, encode_payload, get_payload_metrics
+
+TEST_METHOD = "custom_loan.test_api_payload.payload"
+
+
+class TestPayloadMetrics(unittest.TestCase):
+    def setUp(self):
+        cache = frappe.cache()
+        cache.delete(cache.make_key(PAYLOAD_METRICS_KEY))
+
+    def test_sizes_are_read_back(self):
+        """Every encoded response is counted with its size before and after encoding"""
+        payload = {"loans": [{"name": f"LOAN-{i:05d}", "status": "Active"} for i in range(200)]}
+
+        encode_payload(TEST_METHOD, payload)
+        encoded = encode_payload(TEST_METHOD, payload, "gzip")
+
+        metrics = get_payload_metrics()[TEST_METHOD]
+        self.assertEqual(metrics["calls"], 2)
+        self.assertEqual(metrics["average_raw_bytes"], encoded["raw_bytes"])
+        self.assertEqual(metrics["average_sent_bytes"], round((encoded["raw_bytes"] + len(encoded["data"])) / 2))
+        self.assertGreater(metrics["saved_percent"], 0)
+
+    def tearDown(self):
+        cache = frappe.cache()
+        cache.delete(cache.make_key(PAYLOAD_METRICS_KEY))
@@ -0,0 +1,177 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import os
+import tempfile
+import unittest
+from datetime import date
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import flt, getdate, today
+from custom_loan.bank_reconciliation import get_line_key, read_statement, reconcile_chunk
+from custom_loan.doctype.loan_payment.test_loan_payment import make_test_loan
+
+CSV_STATEMENT = """Txn Date,Narration,Ref No,Withdrawal,Credit
+05/03/2026,UPI/9876500049/RAVI KUMAR,UTR001,,"1,240.00"
+05/03/2026,ATM WITHDRAWAL,ATM77,500.00,
+06/03/2026,NEFT-PAYMENT TEST CUSTOMER,,,777
+"""
+
+MT940_STATEMENT = """:20:STMT
+:25:12345678
+:28C:1/1
+:60F:C260305INR10000,00
+:61:2603050305C1240,00NTRFUTR001//BANK1
+:86:UPI/9876500049/RAVI KUMAR
+:61:2603060306D500,00NTRFNONREF//BANK2
+:86:ATM WITHDRAWAL
+:61:2603060306C777,00NTRFNONREF//BANK3
+:86:NEFT-PAYMENT TEST
+ CUSTOMER
+:62F:C260306INR11517,00
+"""
+
+
+def make_line(amount, description="", bank_reference="", counterparty="", transaction_date=None, occurrence=1):
+    return {
+        "transaction_date": getdate(transaction_date or today()),
+        "amount": amount,
+        "bank_reference": bank_reference,
+        "description": description,
+        "counterparty": counterparty,
+        "occurrence": occurrence
+    }
+
+
+class TestStatementReaders(unittest.TestCase):
+    def read(self, content, suffix):
+        with tempfile.NamedTemporaryFile("w", suffix=suffix, delete=False) as f:
+            f.write(content)
+        try:
+            return list(read_statement(f.name))
+        finally:
+            os.remove(f.name)
+
+    def test_csv_credit_lines(self):
+        lines = self.read(CSV_STATEMENT, ".csv")
+
+        self.assertEqual([(line["transaction_date"], line["amount"]) for line in lines],
+                         [(date(2026, 3, 5), 1240), (date(2026, 3, 6), 777)])
+        self.assertEqual(lines[0]["bank_reference"], "UTR001")
+        self.assertEqual(lines[0]["description"], "UPI/9876500049/RAVI KUMAR")
+
+    def test_mt940_credit_lines(self):
+        lines = self.read(MT940_STATEMENT, ".sta")
+
+        self.assertEqual([(line["transaction_date"], line["amount"]) for line in lines],
+                         [(date(2026, 3, 5), 1240), (date(2026, 3, 6), 777)])
+        self.assertEqual(lines[0]["bank_reference"], "UTR001")
+        # NONREF falls back to the bank's own reference; narrations continue over lines
+        self.assertEqual(lines[1]["bank_reference"], "BANK3")
+        self.assertEqual(lines[1]["description"], "NEFT-PAYMENT TEST CUSTOMER")
+
+
+class TestBankReconciliation(unittest.TestCase):
+    def setUp(self):
+        """A loan whose customer typed their mobile number with the country code"""
+        self.loan = make_test_loan(mobile_number="+91 98765-00049", customer="Reconciliation Test Customer")
+        self.options = frappe._dict(statement="Reconciliation Test", window=3, threshold=0.9, auto_post=1)
+
+        # Chunks commit as they go; keep everything inside the test transaction
+        self.commit = patch.object(frappe.db, "commit")
+        self.commit.start()
+
+    def make_payment(self, amount, reference_number=None):
+        payment = frappe.get_doc({
+            "doctype": "Loan Payment",
+            "loan": self.loan.name,
+            "amount": amount,
+            "payment_date": today(),
+            "reference_number": reference_number
+        })
+        payment.insert()
+        payment.submit()
+        return payment
+
+    def reconcile(self, *lines):
+        return reconcile_chunk(list(lines), self.options)
+
+    def test_stored_mobile_is_normalized(self):
+        self.assertEqual(frappe.db.get_value("Loan Customer", self.loan.customer, "mobile_number"), "9876500049")
+        self.assertEqual(frappe.db.get_value("Loan", self.loan.name, "mobile_number"), "9876500049")
+
+    def test_match_by_reference(self):
+        payment = self.make_payment(600, "UTR-REF-1")
+        (line,) = self.reconcile(make_line(600, "NEFT FROM SOMEONE ELSE", "UTR-REF-1"))
+
+        self.assertEqual((line["status"], line["match_rule"], line["loan_payment"]),
+                         ("Matched", "Reference", payment.name))
+        self.assertEqual(frappe.db.get_value("Loan Payment", payment.name, "is_reconciled"), 1)
+
+    def test_match_by_amount_and_date(self):
+        """A lone counter payment of the amount in the window is confirmed by an anonymous line"""
+        payment = self.make_payment(777)
+        (line,) = self.reconcile(make_line(777, "CASH DEPOSIT"))
+
+        self.assertEqual((line["status"], line["match_rule"], line["loan_payment"]),
+                         ("Matched", "Amount and Date", payment.name))
+
+    def test_mobile_number_posts_collection(self):
+        """The customer's mobile in a UPI narration, with or without 91, finds the loan"""
+        lines = self.reconcile(make_line(500, "UPI/9876500049/RAVI"), make_line(300, "UPI/919876500049/RAVI"))
+
+        for line in lines:
+            self.assertEqual((line["status"], line["match_rule"], line["loan"]),
+                             ("Posted", "Mobile Number", self.loan.name))
+            payment = frappe.db.get_value("Loan Payment", line["loan_payment"], ["loan", "amount", "is_reconciled"],
+                                          as_dict=True)
+            self.assertEqual((payment.loan, flt(payment.amount), payment.is_reconciled),
+                             (self.loan.name, line["amount"], 1))
+
+    def test_unknown_mobile_is_left_unmatched(self):
+        (line,) = self.reconcile(make_line(513, "UPI/9000000000/SOMEONE"))
+
+        self.assertEqual(line["status"], "Unmatched")
+        self.assertIsNone(line["loan_payment"])
+
+    def test_identical_credits_are_both_posted(self):
+        """Two same-day UPI credits with the same narration are two collections"""
+        first = make_line(250, "UPI/9876500049/RAVI", counterparty="RAVI")
+        second = make_line(250, "UPI/9876500049/RAVI", counterparty="RAVI", occurrence=2)
+        self.assertEqual(get_line_key(first), get_line_key(second))
+
+        lines = self.reconcile(first, second)
+
+        self.assertEqual([line["status"] for line in lines], ["Posted", "Posted"])
+        self.assertNotEqual(lines[0]["loan_payment"], lines[1]["loan_payment"])
+        self.assertEqual(frappe.db.count("Loan Payment", {"loan": self.loan.name, "amount": 250, "docstatus": 1}), 2)
+
+    def test_reimport_and_duplicate_are_skipped(self):
+        (posted,) = self.reconcile(make_line(400, "UPI/9876500049/RAVI", "UPI-400"))
+        self.assertEqual(posted["status"], "Posted")
+
+        # The same statement again
+        (again,) = self.reconcile(make_line(400, "UPI/9876500049/RAVI", "UPI-400"))
+        self.assertEqual((again["status"], again["match_rule"]), ("Duplicate", "Already Imported"))
+
+        # Another statement reporting the same collection with a different narration
+        (overlap,) = self.reconcile(make_line(400, "UPI CR 9876500049", "UPI-400"))
+        self.assertEqual((overlap["status"], overlap["loan_payment"]), ("Duplicate", posted["loan_payment"]))
+
+        self.assertEqual(frappe.db.count("Loan Payment", {"loan": self.loan.name, "amount": 400, "docstatus": 1}), 1)
+
+    def test_failed_posting_goes_to_review(self):
+        """A payment the loan refuses is rolled back to its savepoint without losing the others"""
+        too_much, fits = self.reconcile(make_line(100000, "UPI/9876500049/RAVI"),
+                                        make_line(350, "UPI/9876500049/RAVI"))
+
+        self.assertEqual((too_much["status"], too_much["loan_payment"]), ("Review", None))
+        self.assertEqual(fits["status"], "Posted")
+        self.assertFalse(frappe.db.exists("Loan Payment", {"loan": self.loan.name, "amount": 100000}))
+        self.assertEqual(flt(frappe.db.get_value("Loan", self.loan.name, "paid_amount")), 350)
+
+    def tearDown(self):
+        """Clean up test data"""
+        self.commit.stop()
+        frappe.db.rollback()
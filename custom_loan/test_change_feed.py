@@ -0,0 +1,85 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import threading
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import add_to_date, now_datetime
+from custom_loan.change_feed import insert_change, read_changes
+
+TEST_REFERENCE = "CHANGE-FEED-TEST"
+
+
+def get_last_seq():
+    return frappe.db.sql("SELECT IFNULL(MAX(name), 0) FROM `tabLoan Change Event`")[0][0]
+
+
+class TestChangeFeed(unittest.TestCase):
+    def test_reader_waits_for_out_of_order_commit(self):
+        """An event committed before an older, still open one is not read past it"""
+        site, cursor = frappe.local.site, get_last_seq()
+        inserted, release, errors = threading.Event(), threading.Event(), []
+
+        def hold_event():
+            frappe.init(site=site)
+            frappe.connect()
+            frappe.set_user("Administrator")
+            try:
+                insert_change("Update", "Loan", TEST_REFERENCE, None, {"writer": "slow"})
+                inserted.set()
+                release.wait(30)
+                frappe.db.commit()
+            except Exception as e:
+                frappe.db.rollback()
+                errors.append(e)
+            finally:
+                inserted.set()
+                frappe.destroy()
+
+        # Workers only see committed data, and the test's own rows are committed below
+        frappe.db.commit()
+        worker = threading.Thread(target=hold_event)
+        try:
+            worker.start()
+            inserted.wait(30)
+            insert_change("Update", "Loan", TEST_REFERENCE, None, {"writer": "fast"})
+            frappe.db.commit()
+
+            # However old the later event looks, the open transaction still holds the gap
+            with patch("custom_loan.change_feed.GAP_SETTLE_SECONDS", 0):
+                self.assertEqual(read_changes(cursor, 10), [])
+
+            release.set()
+            worker.join()
+            self.assertEqual(errors, [])
+
+            frappe.db.commit()
+            changes = read_changes(cursor, 10)
+            self.assertEqual([change.payload["writer"] for change in changes], ["slow", "fast"])
+            self.assertEqual([change.seq for change in changes], [cursor + 1, cursor + 2])
+        finally:
+            release.set()
+            worker.join()
+            frappe.db.delete("Loan Change Event", {"reference_name": TEST_REFERENCE})
+            frappe.db.commit()
+
+    def test_reader_skips_rolled_back_gap(self):
+        """A sequence number given up by a rollback does not stall readers for good"""
+        cursor = get_last_seq()
+        try:
+            insert_change("Update", "Loan", TEST_REFERENCE, None, {"writer": "rolled back"})
+            frappe.db.rollback()
+
+            insert_change("Update", "Loan", TEST_REFERENCE, None, {"writer": "committed"})
+            frappe.db.sql("UPDATE `tabLoan Change Event` SET creation = %s WHERE reference_name = %s",
+                          (add_to_date(now_datetime(), hours=-1), TEST_REFERENCE))
+            frappe.db.commit()
+
+            changes = read_changes(cursor, 10)
+            self.assertEqual([change.payload["writer"] for change in changes], ["committed"])
+            self.assertEqual(changes[0].seq, cursor + 2)
+        finally:
+            frappe.db.delete("Loan Change Event", {"reference_name": TEST_REFERENCE})
+            frappe.db.commit()
@@ -0,0 +1,115 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import add_months, flt
+from custom_loan.report.collection_route_sheet.collection_route_sheet import get_data, make_route_sheets
+
+CITY = "Route Sheet Test City"
+DATE = "2026-03-15"
+
+
+class TestCollectionRouteSheet(unittest.TestCase):
+    def setUp(self):
+        """
+        Two customers in separate pin codes, with loans from two months before DATE
+
+        Each loan's first installment of 1240 is overdue on DATE and its
+        second falls due that day.
+        """
+        self.make_customer("Route Sheet Customer A", "9876500281", "999991")
+        self.make_customer("Route Sheet Customer B", "9876500282", "999992")
+
+        self.make_loan("Route Sheet Customer A")
+        self.make_loan("Route Sheet Customer A")
+        loan = self.make_loan("Route Sheet Customer B")
+
+        payment = frappe.get_doc({
+            "doctype": "Loan Payment",
+            "loan": loan,
+            "amount": 500,
+            "payment_date": "2026-03-01"
+        })
+        payment.insert()
+        payment.submit()
+
+    def make_customer(self, name, mobile_number, pin_code):
+        if not frappe.db.exists("Loan Customer", name):
+            frappe.get_doc({
+                "doctype": "Loan Customer",
+                "customer_name": name,
+                "mobile_number": mobile_number,
+                "customer_type": "Individual",
+                "status": "Active",
+                "city": CITY,
+                "pin_code": pin_code
+            }).insert()
+
+    def make_loan(self, customer):
+        loan = frappe.get_doc({
+            "doctype": "Loan",
+            "customer": customer,
+            "loan_date": add_months(DATE, -2),
+            "loan_type": "Flat Rate",
+            "loan_amount": 12000,
+            "interest_rate": 2,
+            "tenure_months": 12
+        })
+        loan.insert()
+        loan.generate_repayment_schedule()
+        loan.save()
+        return loan.name
+
+    def test_one_row_per_customer_in_pin_code_order(self):
+        rows = get_data(frappe._dict(date=DATE, city=CITY))
+
+        self.assertEqual([(row.pin_code, row.customer, row.loans) for row in rows], [
+            ("999991", "Route Sheet Customer A", 2),
+            ("999992", "Route Sheet Customer B", 1)
+        ])
+
+        # Both loans' installments add up; the counter's flat 1% is charged on the overdue part
+        a, b = rows
+        self.assertEqual((flt(a.due_today), flt(a.overdue_amount), a.overdue_installments), (2480, 2480, 2))
+        self.assertEqual((a.penalty, flt(a.total_due, 2)), (24.8, 4984.8))
+
+        # 500 paid towards B's first installment
+        self.assertEqual((flt(b.due_today), flt(b.overdue_amount)), (1240, 740))
+        self.assertEqual((b.penalty, flt(b.total_due, 2)), (7.4, 1987.4))
+
+    def test_one_sheet_per_pin_code(self):
+        saved = {}
+
+        def save_file(file_name, content):
+            saved[file_name] = content
+            return f"/private/files/{file_name}"
+
+        with patch("custom_loan.report.collection_route_sheet.collection_route_sheet.save_file", save_file), \
+                patch("frappe.utils.pdf.get_pdf", return_value=b"%PDF"):
+            result = make_route_sheets(DATE, city=CITY)
+
+        self.assertEqual((result["customers"], result["sheets"]), (2, 2))
+        self.assertEqual(sorted(saved), [
+            f"route-sheet-{DATE}-999991.csv", f"route-sheet-{DATE}-999991.pdf",
+            f"route-sheet-{DATE}-999992.csv", f"route-sheet-{DATE}-999992.pdf"
+        ])
+
+        lines = saved[f"route-sheet-{DATE}-999991.csv"].splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertTrue(lines[0].startswith("Pin Code,City"))
+        self.assertIn("Route Sheet Customer A", lines[1])
+
+    def test_job_keeps_to_the_callers_branches(self):
+        """A sheet queued by a branch manager leaves other branches' customers out"""
+        with patch("custom_loan.report.collection_route_sheet.collection_route_sheet.save_file"), \
+                patch("frappe.utils.pdf.get_pdf"):
+            result = make_route_sheets(DATE, city=CITY, allowed_branches=["Route Sheet Other Branch"])
+
+        self.assertEqual((result["customers"], result["sheets"]), (0, 0))
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.db.rollback()
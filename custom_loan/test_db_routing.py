@@ -0,0 +1,121 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from custom_loan.db_routing import ROUTING_STATS_KEY, get_routing_stats, record_route, use_replica
+
+READ_ONLY_TRANSACTION_ERROR = 1792
+
+
+@use_replica
+def get_connection():
+    """Which connection a routed function runs on"""
+    return frappe.db, frappe.db.sql("SELECT CONNECTION_ID()")[0][0]
+
+
+@use_replica
+def write_settings():
+    frappe.db.sql("""
+        UPDATE `tabSingles` SET value = value
+        WHERE doctype = 'Loan Settings' AND field = 'route_reads_to_replica'
+    """)
+
+
+class TestDbRouting(unittest.TestCase):
+    def setUp(self):
+        """A second connection to the site's own database server stands in for the replica"""
+        self.primary = frappe.local.db
+        self.primary_id = frappe.db.sql("SELECT CONNECTION_ID()")[0][0]
+        self.settings = {"route_reads_to_replica": 1, "replica_max_lag_seconds": 30}
+        self.lag = 0
+
+        self.patches = [
+            patch.dict(frappe.local.conf, {
+                "replica_host": frappe.conf.db_host or "127.0.0.1",
+                "replica_db_port": frappe.conf.db_port
+            }),
+            patch.object(frappe.db, "get_single_value",
+                         side_effect=lambda doctype, field, cache=False: self.settings[field]),
+            patch("custom_loan.db_routing.get_replica_lag", side_effect=lambda: self.lag),
+            patch("custom_loan.db_routing.record_route")
+        ]
+        self.record_route = [p.start() for p in self.patches][-1]
+
+    def assert_routed(self, outcome):
+        self.record_route.assert_called_once()
+        self.assertEqual(self.record_route.call_args[0][1], outcome)
+
+    def assert_back_on_primary(self):
+        self.assertIs(frappe.local.db, self.primary)
+        self.assertIsNone(getattr(frappe.local, "replica_db", None))
+
+    def test_read_runs_on_replica(self):
+        db, connection_id = get_connection()
+
+        self.assertIsNot(db, self.primary)
+        self.assertNotEqual(connection_id, self.primary_id)
+        self.assert_routed("replica")
+        self.assert_back_on_primary()
+
+    def test_lagging_replica_falls_back_to_primary(self):
+        self.lag = 120
+
+        db, connection_id = get_connection()
+
+        self.assertIs(db, self.primary)
+        self.assertEqual(connection_id, self.primary_id)
+        self.assert_routed("fallback_lag")
+        self.assert_back_on_primary()
+
+    def test_unreachable_replica_falls_back_to_primary(self):
+        with patch.dict(frappe.local.conf, {"replica_host": "127.0.0.1", "replica_db_port": 1}), \
+                patch("frappe.log_error"):
+            db, connection_id = get_connection()
+
+        self.assertIs(db, self.primary)
+        self.assertEqual(connection_id, self.primary_id)
+        self.assert_routed("fallback_error")
+        self.assert_back_on_primary()
+
+    def test_routing_switched_off_stays_on_primary(self):
+        self.settings["route_reads_to_replica"] = 0
+
+        db, connection_id = get_connection()
+
+        self.assertIs(db, self.primary)
+        self.assertEqual(connection_id, self.primary_id)
+        self.record_route.assert_not_called()
+
+    def test_write_on_replica_is_refused(self):
+        with self.assertRaises(Exception) as context:
+            write_settings()
+
+        self.assertEqual(context.exception.args[0], READ_ONLY_TRANSACTION_ERROR)
+        self.assert_back_on_primary()
+
+    def tearDown(self):
+        """Clean up test data"""
+        for p in reversed(self.patches):
+            p.stop()
+        frappe.db.rollback()
+
+
+class TestRoutingStats(unittest.TestCase):
+    def setUp(self):
+        cache = frappe.cache()
+        cache.delete(cache.make_key(ROUTING_STATS_KEY))
+
+    def test_outcomes_are_read_back(self):
+        name = "custom_loan.test_db_routing.get_connection"
+        for outcome in ("replica", "replica", "fallback_lag"):
+            record_route(name, outcome)
+
+        self.assertEqual(get_routing_stats()["functions"],
+                         {name: {"replica": 2, "fallback_lag": 1, "fallback_error": 0}})
+
+    def tearDown(self):
+        cache = frappe.cache()
+        cache.delete(cache.make_key(ROUTING_STATS_KEY))
@@ -0,0 +1,85 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import flt, today
+from custom_loan.doctype.loan_payment.test_loan_payment import make_test_loan
+from custom_loan.gl_posting import post_queue_group, queue_postings
+
+POSTING_DATE = "2001-01-01"
+
+
+def get_queued_disbursals(loan):
+    return frappe.get_all("Loan GL Queue Entry",
+                          filters={"reference_doctype": "Loan", "reference_name": loan, "entry_type": "Disbursal"},
+                          fields=["name", "posting_date", "amount", "is_posted"],
+                          order_by="creation asc")
+
+
+class TestGLPosting(unittest.TestCase):
+    def setUp(self):
+        """Turn GL posting on for the test transaction"""
+        frappe.db.set_single_value("Loan Settings", "enable_gl_posting", 1)
+        frappe.clear_cache(doctype="Loan Settings")
+
+    def test_loan_edit_replaces_pending_disbursal(self):
+        """Changing the amount of an unposted loan requeues the disbursal"""
+        loan = make_test_loan()
+        self.assertEqual([flt(e.amount) for e in get_queued_disbursals(loan.name)], [12000])
+
+        loan.loan_amount = 15000
+        loan.save()
+
+        entries = get_queued_disbursals(loan.name)
+        self.assertEqual([flt(e.amount) for e in entries], [15000])
+        self.assertEqual(str(entries[0].posting_date), str(loan.loan_date))
+
+    def test_loan_edit_after_posting_queues_adjustment(self):
+        """A posted disbursal is corrected with an entry for the difference"""
+        loan = make_test_loan()
+        frappe.db.set_value("Loan GL Queue Entry", get_queued_disbursals(loan.name)[0].name,
+                            {"is_posted": 1, "journal_entry": "JV-TEST"})
+
+        loan.loan_amount = 10000
+        loan.save()
+
+        entries = get_queued_disbursals(loan.name)
+        self.assertEqual([(flt(e.amount), e.is_posted) for e in entries], [(12000, 1), (-2000, 0)])
+        self.assertEqual(str(entries[1].posting_date), today())
+
+        with self.assertRaises(frappe.ValidationError):
+            frappe.delete_doc("Loan", loan.name)
+
+    def test_loan_delete_withdraws_pending_disbursal(self):
+        loan = make_test_loan()
+        frappe.delete_doc("Loan", loan.name)
+
+        self.assertEqual(get_queued_disbursals(loan.name), [])
+
+    def test_flush_marks_only_entries_it_posted(self):
+        """An entry queued while the Journal Entry is made waits for the next flush"""
+        payment = frappe._dict(doctype="Loan Payment", name="GL-TEST-PAYMENT", loan="GL-TEST-LOAN")
+        queue_postings(payment, [(POSTING_DATE, "Principal", 100), (POSTING_DATE, "Interest", 20)])
+
+        def make_journal_entry(settings, posting_date, rows, cost_center=None):
+            queue_postings(payment, [(POSTING_DATE, "Principal", 50)])
+            self.assertEqual({row.entry_type: row.amount for row in rows}, {"Principal": 100, "Interest": 20})
+            return "JV-TEST"
+
+        with patch("custom_loan.gl_posting.make_journal_entry", side_effect=make_journal_entry):
+            self.assertEqual(post_queue_group(frappe._dict(), POSTING_DATE, "", None), "JV-TEST")
+
+        entries = frappe.get_all("Loan GL Queue Entry",
+                                 filters={"reference_name": payment.name},
+                                 fields=["amount", "is_posted", "journal_entry"],
+                                 order_by="amount asc")
+        self.assertEqual([(flt(e.amount), e.is_posted, e.journal_entry) for e in entries],
+                         [(20, 1, "JV-TEST"), (50, 0, None), (100, 1, "JV-TEST")])
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.db.rollback()
+        frappe.clear_cache(doctype="Loan Settings")
@@ -0,0 +1,75 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from custom_loan.interest_accrual import compute_accruals
+
+
+class TestInterestAccrual(unittest.TestCase):
+    def setUp(self):
+        """12000 flat at 2% from 1 January 2026: twelve installments of 1000 principal and 240 interest"""
+        if not frappe.db.exists("Loan Customer", "Accrual Test Customer"):
+            frappe.get_doc({
+                "doctype": "Loan Customer",
+                "customer_name": "Accrual Test Customer",
+                "mobile_number": "9876500037",
+                "customer_type": "Individual",
+                "status": "Active"
+            }).insert()
+
+        loan = frappe.get_doc({
+            "doctype": "Loan",
+            "customer": "Accrual Test Customer",
+            "loan_date": "2026-01-01",
+            "loan_type": "Flat Rate",
+            "loan_amount": 12000,
+            "interest_rate": 2,
+            "tenure_months": 12
+        })
+        loan.insert()
+        loan.generate_repayment_schedule()
+        loan.save()
+        self.loan = loan.name
+
+    def pay(self, amount, payment_date):
+        payment = frappe.get_doc({
+            "doctype": "Loan Payment",
+            "loan": self.loan,
+            "amount": amount,
+            "payment_date": payment_date
+        })
+        payment.insert()
+        payment.submit()
+
+    def get_accruals(self, from_date, to_date):
+        return [
+            (str(a.period_start), a.accrued_interest, a.interest_due, a.accrued_unpaid_interest)
+            for a in sorted(compute_accruals(from_date, to_date), key=lambda a: a.period_start)
+            if a.loan == self.loan
+        ]
+
+    def test_open_loan(self):
+        """January earns the first installment; February earns the second while the first falls due"""
+        self.pay(1240, "2026-02-05")
+
+        self.assertEqual(self.get_accruals("2026-01-01", "2026-02-28"), [
+            ("2026-01-01", 240, 0, 0),
+            # The first installment is paid; all of the second's interest is earned but unpaid
+            ("2026-02-01", 240, 240, 240)
+        ])
+
+    def test_closed_loan_stops_at_last_payment(self):
+        """Paid off on 10 February: the second installment earns 10 of its 28 days, later ones nothing"""
+        self.pay(14880, "2026-02-10")
+        self.assertEqual(frappe.db.get_value("Loan", self.loan, "status"), "Closed")
+
+        self.assertEqual(self.get_accruals("2026-02-01", "2026-02-28"), [
+            ("2026-02-01", 85.71, 240, 0)
+        ])
+        self.assertEqual(self.get_accruals("2026-03-01", "2026-03-31"), [])
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.db.rollback()
@@ -0,0 +1,43 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from custom_loan.doctype.loan_payment.test_loan_payment import make_test_loan
+from custom_loan.loan_state import LOAN_STATE_KEY, METRICS_KEY, get_loan_state, get_loan_state_metrics
+
+
+class TestLoanStateMetrics(unittest.TestCase):
+    def setUp(self):
+        """Start from empty counters, both in Redis and in this worker"""
+        cache = frappe.cache()
+        cache.delete(cache.make_key(METRICS_KEY))
+        self.lookups = patch.dict("custom_loan.loan_state._lookups", hits=0, misses=0)
+        self.lookups.start()
+        self.loan = make_test_loan()
+
+    def test_lookups_are_read_back(self):
+        """A miss builds the state, the next lookup hits, and both show in the metrics"""
+        frappe.cache().hdel(LOAN_STATE_KEY, self.loan.name)
+
+        first = get_loan_state(self.loan.name)
+        second = get_loan_state(self.loan.name)
+        self.assertEqual(first, second)
+
+        metrics = get_loan_state_metrics()
+        self.assertEqual((metrics["hits"], metrics["misses"], metrics["hit_rate"]), (1, 1, 50))
+        self.assertGreaterEqual(metrics["cached_loans"], 1)
+
+        # Flushed counts are not counted twice
+        get_loan_state(self.loan.name)
+        self.assertEqual(get_loan_state_metrics()["hits"], 2)
+
+    def tearDown(self):
+        """Clean up test data"""
+        self.lookups.stop()
+        cache = frappe.cache()
+        cache.hdel(LOAN_STATE_KEY, self.loan.name)
+        cache.delete(cache.make_key(METRICS_KEY))
+        frappe.db.rollback()
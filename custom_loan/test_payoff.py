@@ -0,0 +1,81 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from frappe.utils import getdate
+from custom_loan.payoff import PAYOFF_KEY, get_customer_payoff_quotes, get_payoff_quotes
+
+CUSTOMER = "Payoff Test Customer"
+AS_OF = "2026-02-15"
+
+
+class TestPayoffQuote(unittest.TestCase):
+    def setUp(self):
+        """12000 flat at 2% from 1 January 2026 with a 2% foreclosure charge; nothing paid yet"""
+        frappe.db.set_single_value("Loan Settings", "foreclosure_charge_percent", 2)
+        frappe.clear_cache(doctype="Loan Settings")
+
+        if not frappe.db.exists("Loan Customer", CUSTOMER):
+            frappe.get_doc({
+                "doctype": "Loan Customer",
+                "customer_name": CUSTOMER,
+                "mobile_number": "9876500039",
+                "customer_type": "Individual",
+                "status": "Active"
+            }).insert()
+
+        loan = frappe.get_doc({
+            "doctype": "Loan",
+            "customer": CUSTOMER,
+            "loan_date": "2026-01-01",
+            "loan_type": "Flat Rate",
+            "loan_amount": 12000,
+            "interest_rate": 2,
+            "tenure_months": 12
+        })
+        loan.insert()
+        loan.generate_repayment_schedule()
+        loan.save()
+        self.loan = loan.name
+
+    def get_quote(self):
+        return get_payoff_quotes([self.loan], getdate(AS_OF))[self.loan]
+
+    def test_quote_matches_hand_computed_payoff(self):
+        quote = self.get_quote()
+
+        self.assertEqual(quote.principal_outstanding, 12000)
+        # All 240 of the first installment's interest, 15 of 28 days of the second's
+        self.assertEqual(quote.accrued_interest, 368.57)
+        # The first installment fell due on 1 February; the counter charges 1% of it
+        self.assertEqual((quote.overdue_amount, quote.penalty), (1240, 12.4))
+        self.assertEqual(quote.foreclosure_charge, 240)
+        self.assertEqual(quote.payoff_amount, 12620.97)
+
+        totals = get_customer_payoff_quotes([CUSTOMER], AS_OF)[CUSTOMER]
+        self.assertEqual((len(totals["loans"]), totals["payoff_amount"]), (1, 12620.97))
+
+    def test_payment_invalidates_cached_quote(self):
+        self.assertEqual(self.get_quote().payoff_amount, 12620.97)
+
+        payment = frappe.get_doc({
+            "doctype": "Loan Payment",
+            "loan": self.loan,
+            "amount": 1240,
+            "payment_date": "2026-02-10"
+        })
+        payment.insert()
+        payment.submit()
+
+        # First installment paid: 11000 principal, the second's accrued interest and 2% of the principal
+        quote = self.get_quote()
+        self.assertEqual((quote.principal_outstanding, quote.penalty), (11000, 0))
+        self.assertEqual(quote.payoff_amount, 11348.57)
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.cache().hdel(PAYOFF_KEY, self.loan)
+        frappe.db.rollback()
+        frappe.clear_cache(doctype="Loan Settings")
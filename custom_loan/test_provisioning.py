@@ -0,0 +1,107 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from custom_loan.provisioning import run_provisioning
+
+CUSTOMER = "Provisioning Test Customer"
+
+
+class TestProvisioning(unittest.TestCase):
+    def setUp(self):
+        """12000 flat at 2% from 1 December 2025, nothing paid; the first installment fell due on 1 January"""
+        frappe.db.delete("Loan Provisioning Rule")
+        self.make_rule("1-30", "", 5)
+        self.make_rule("31-60", "", 10)
+        self.make_rule("31-60", "Flat Rate", 25)
+
+        if not frappe.db.exists("Loan Customer", CUSTOMER):
+            frappe.get_doc({
+                "doctype": "Loan Customer",
+                "customer_name": CUSTOMER,
+                "mobile_number": "9876500036",
+                "customer_type": "Individual",
+                "status": "Active"
+            }).insert()
+
+        loan = frappe.get_doc({
+            "doctype": "Loan",
+            "customer": CUSTOMER,
+            "loan_date": "2025-12-01",
+            "loan_type": "Flat Rate",
+            "loan_amount": 12000,
+            "interest_rate": 2,
+            "tenure_months": 12
+        })
+        loan.insert()
+        loan.generate_repayment_schedule()
+        loan.save()
+        self.loan = loan.name
+
+    def make_rule(self, dpd_bucket, loan_type, provision_percent):
+        frappe.get_doc({
+            "doctype": "Loan Provisioning Rule",
+            "dpd_bucket": dpd_bucket,
+            "loan_type": loan_type,
+            "provision_percent": provision_percent
+        }).insert()
+
+    def get_entries(self, as_of_date):
+        return frappe.get_all("Loan Provision Entry",
+                              filters={"loan": self.loan, "provisioning_date": as_of_date},
+                              fields=["run_id", "superseded_by", "dpd", "dpd_bucket", "provision_percent",
+                                      "provision_amount", "previous_provision", "provision_change"],
+                              order_by="creation")
+
+    def test_loan_type_rule_takes_precedence(self):
+        run_provisioning("2026-02-15")
+
+        entry, = self.get_entries("2026-02-15")
+        self.assertEqual((entry.dpd, entry.dpd_bucket), (45, "31-60"))
+        self.assertEqual((entry.provision_percent, entry.provision_amount), (25, 3000))
+
+    def test_blank_loan_type_rule_is_the_fallback(self):
+        frappe.db.delete("Loan Provisioning Rule", {"dpd_bucket": "31-60", "loan_type": "Flat Rate"})
+
+        run_provisioning("2026-02-15")
+
+        entry, = self.get_entries("2026-02-15")
+        self.assertEqual((entry.provision_percent, entry.provision_amount), (10, 1200))
+
+    def test_rerun_supersedes_earlier_run(self):
+        first = run_provisioning("2026-02-15")["run_id"]
+        second = run_provisioning("2026-02-15")["run_id"]
+
+        old, new = self.get_entries("2026-02-15")
+        self.assertEqual((old.run_id, old.superseded_by), (first, second))
+        self.assertEqual((new.run_id, new.superseded_by or None), (second, None))
+        self.assertEqual(old.provision_amount, new.provision_amount)
+
+    def test_movement_against_previous_run(self):
+        run_provisioning("2026-01-31")
+        entry, = self.get_entries("2026-01-31")
+        self.assertEqual((entry.dpd_bucket, entry.provision_amount), ("1-30", 600))
+
+        # A superseded rerun of the earlier date is not the baseline
+        run_provisioning("2026-01-31")
+        run_provisioning("2026-02-15")
+
+        entry, = self.get_entries("2026-02-15")
+        self.assertEqual((entry.previous_provision, entry.provision_change), (600, 2400))
+
+    def test_closed_loan_releases_its_provision(self):
+        run_provisioning("2026-01-31")
+        frappe.db.set_value("Loan", self.loan, "status", "Closed")
+
+        result = run_provisioning("2026-02-28")
+
+        self.assertGreaterEqual(result["released"], 1)
+        entry, = self.get_entries("2026-02-28")
+        self.assertEqual(entry.dpd_bucket, "Closed")
+        self.assertEqual((entry.provision_amount, entry.previous_provision, entry.provision_change), (0, 600, -600))
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.db.rollback()
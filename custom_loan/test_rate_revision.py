@@ -0,0 +1,114 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+
+import frappe
+from frappe.utils import add_months, flt, today
+from custom_loan.rate_revision import (apply_tail, get_loan_tails, get_proposed_setting, preview_rate_revision,
+                                       reprice_tails)
+
+SETTING = "Rate Revision Test"
+PROPOSAL = {"default_rate": 3}
+
+
+class TestRateRevision(unittest.TestCase):
+    def setUp(self):
+        """A 12000 flat rate loan at 2% with its first two installments paid"""
+        frappe.get_doc({
+            "doctype": "Interest Setting",
+            "setting_name": SETTING,
+            "interest_type": "Flat Rate",
+            "default_rate": 2,
+            "penalty_rate": 0
+        }).insert()
+
+        if not frappe.db.exists("Loan Customer", "Rate Revision Customer"):
+            frappe.get_doc({
+                "doctype": "Loan Customer",
+                "customer_name": "Rate Revision Customer",
+                "mobile_number": "9876500046",
+                "customer_type": "Individual",
+                "status": "Active"
+            }).insert()
+
+        application = self.make_application("Disbursed", 12000)
+        self.make_application("Draft", 5000)
+
+        loan = frappe.get_doc({
+            "doctype": "Loan",
+            "customer": "Rate Revision Customer",
+            "loan_application": application.name,
+            "loan_date": add_months(today(), -2),
+            "loan_type": "Flat Rate",
+            "loan_amount": 12000,
+            "interest_rate": 2,
+            "tenure_months": 12
+        })
+        loan.insert()
+        loan.generate_repayment_schedule()
+        loan.save()
+        self.loan = loan.name
+
+        payment = frappe.get_doc({
+            "doctype": "Loan Payment",
+            "loan": self.loan,
+            "amount": 2480,
+            "payment_date": today(),
+            "reference_number": "RATE-REVISION-TEST"
+        })
+        payment.insert()
+        payment.submit()
+
+    def make_application(self, status, amount):
+        return frappe.get_doc({
+            "doctype": "Loan Application",
+            "customer": "Rate Revision Customer",
+            "application_date": today(),
+            "status": status,
+            "loan_type": "Flat Rate",
+            "requested_amount": amount,
+            "interest_setting": SETTING,
+            "tenure_months": 12
+        }).insert()
+
+    def test_preview(self):
+        """Only the ten unpaid installments are re-priced"""
+        preview = preview_rate_revision(SETTING, PROPOSAL, include_loans=1, effective_date=today())
+
+        self.assertEqual(preview["applications"]["count"], 1)
+        self.assertEqual(preview["loans"]["count"], 1)
+        # 10000 principal over 10 installments, from 2% to 3% a month
+        self.assertEqual(preview["loans"]["interest_before"], 2400)
+        self.assertEqual(preview["loans"]["interest_after"], 3000)
+        self.assertEqual(preview["affected_customers"], 1)
+
+    def test_totals_survive_loan_save(self):
+        """A revised loan keeps its blended totals when it is saved again"""
+        setting_doc = get_proposed_setting(SETTING, PROPOSAL)
+        (row,) = reprice_tails(get_loan_tails(SETTING, today(), [self.loan]), setting_doc)
+        apply_tail(row)
+
+        loan = frappe.get_doc("Loan", self.loan)
+        self.assertEqual(flt(loan.interest_rate), 2)
+        self.assertEqual(flt(loan.revised_rate), 3)
+        self.assertEqual(loan.revised_from_installment, 3)
+
+        # Two installments at 240 interest, ten at 300
+        for _ in range(2):
+            self.assertAlmostEqual(flt(loan.total_interest), 3480, places=2)
+            self.assertAlmostEqual(flt(loan.total_amount), 15480, places=2)
+            self.assertAlmostEqual(flt(loan.outstanding_amount), 13000, places=2)
+            self.assertAlmostEqual(flt(loan.repayment_schedule[0].interest_amount), 240, places=2)
+            self.assertAlmostEqual(flt(loan.repayment_schedule[2].interest_amount), 300, places=2)
+
+            loan.purpose = "Saved after the rate revision"
+            loan.save()
+            loan.reload()
+
+        # Running the revision again finds nothing left at the old rate
+        self.assertEqual(reprice_tails(get_loan_tails(SETTING, today(), [self.loan]), setting_doc), [])
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.db.rollback()
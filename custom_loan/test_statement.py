@@ -0,0 +1,86 @@
+# Copyright (c) 2025, Your Company and Contributors
+# See license.txt
+
+import unittest
+from unittest.mock import patch
+
+import frappe
+from frappe.utils import getdate
+from custom_loan.statement import build_statements, make_month_end_statements
+
+CUSTOMER = "Statement Test Customer"
+
+
+class TestStatement(unittest.TestCase):
+    def setUp(self):
+        """12000 flat at 2% for 12 months from 1 January 2026 (14880 owed), 1240 paid on 20 January"""
+        if not frappe.db.exists("Loan Customer", CUSTOMER):
+            frappe.get_doc({
+                "doctype": "Loan Customer",
+                "customer_name": CUSTOMER,
+                "mobile_number": "9876500040",
+                "customer_type": "Individual",
+                "status": "Active"
+            }).insert()
+
+        loan = frappe.get_doc({
+            "doctype": "Loan",
+            "customer": CUSTOMER,
+            "loan_date": "2026-01-01",
+            "loan_type": "Flat Rate",
+            "loan_amount": 12000,
+            "interest_rate": 2,
+            "tenure_months": 12
+        })
+        loan.insert()
+        loan.generate_repayment_schedule()
+        loan.save()
+        self.loan = loan.name
+
+        payment = frappe.get_doc({
+            "doctype": "Loan Payment",
+            "loan": self.loan,
+            "amount": 1240,
+            "payment_date": "2026-01-20"
+        })
+        payment.insert()
+        payment.submit()
+
+    def get_statement(self, from_date, to_date):
+        statement, = build_statements([self.loan], getdate(from_date), getdate(to_date))
+        return statement
+
+    def test_disbursal_period_lines_and_running_balance(self):
+        statement = self.get_statement("2026-01-01", "2026-01-31")
+
+        self.assertEqual(statement.opening_balance, 0)
+        self.assertEqual(
+            [(entry.particulars, entry.amount, entry.balance) for entry in statement.entries[:2]],
+            [("Loan Disbursed", 12000, 12000), ("Interest Charged", 2880, 14880)]
+        )
+        payment = statement.entries[2]
+        self.assertTrue(payment.particulars.startswith("Regular Payment"))
+        self.assertEqual((payment.amount, payment.balance), (1240, 13640))
+        self.assertEqual(payment.principal + payment.interest + payment.penalty, 1240)
+        self.assertEqual(statement.closing_balance, 13640)
+        self.assertEqual(len(statement.schedule), 12)
+
+    def test_later_period_opens_at_previous_closing(self):
+        statement = self.get_statement("2026-02-01", "2026-02-28")
+
+        self.assertEqual((statement.opening_balance, statement.closing_balance), (13640, 13640))
+        self.assertEqual(statement.entries, [])
+
+    def test_loan_closed_in_month_gets_month_end_statement(self):
+        frappe.db.set_value("Loan", self.loan, {"status": "Closed", "last_payment_date": "2026-03-20"})
+
+        with patch("custom_loan.statement.make_statement_chunk", return_value=1) as make_chunk, \
+                patch.object(frappe.db, "commit"):
+            make_month_end_statements(month="2026-03-01", chunk_size=1000, workers=1)
+
+        customers = [customer for call in make_chunk.call_args_list for customer in call.args[1]]
+        self.assertIn(CUSTOMER, customers)
+
+    def tearDown(self):
+        """Clean up test data"""
+        frappe.db.rollback()
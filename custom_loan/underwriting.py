@@ -0,0 +1,220 @@
+"""
+Rules-plus-score underwriting for loan applications
+"""
+
+import frappe
+from frappe.utils import cint, flt, now_datetime
+import math
+import time
+from custom_loan.utils import RATE_DIVISOR, calculate_loan_totals, get_period_rate
+
+# Share of monthly income (%) that all installments, including the new one, may take
+MAX_EMI_TO_INCOME = 50
+
+# Scores at or above these marks are recommended for approval / referred to a manager
+APPROVE_SCORE = 70
+REFER_SCORE = 40
+
+# Added to the base rate (% per month) as the score drops
+RISK_PREMIUMS = [(70, 0), (55, 0.25), (0, 0.5)]
+
+UNDERWRITING_FIELDS = [
+    "risk_score", "underwriting_recommendation", "emi_to_income_ratio", "existing_exposure",
+    "recommended_amount", "recommended_rate", "underwriting_remarks"
+]
+
+
+def get_loan_payment_frequency():
+    """Payment frequency of a Loan made from an application; make_loan leaves it at the default"""
+    return frappe.get_meta("Loan").get_field("payment_frequency").default
+
+
+def get_installment(loan_type, principal, interest_rate, tenure_months, payment_frequency=None):
+    """Installment the Loan made from an application will charge"""
+    if not cint(tenure_months):
+        return 0
+
+    return calculate_loan_totals("EMI" if loan_type == "EMI" else "Flat Rate", principal, interest_rate,
+                                 tenure_months, payment_frequency)["emi_amount"]
+
+
+def get_max_principal(loan_type, installment_budget, interest_rate, tenure_months, payment_frequency=None):
+    """Largest principal whose installment fits in the budget; the inverse of get_installment"""
+    tenure = cint(tenure_months)
+
+    if installment_budget <= 0 or not tenure:
+        return 0
+
+    if loan_type == "EMI":
+        rate = get_period_rate(interest_rate, payment_frequency)
+        if rate:
+            growth = math.pow(1 + rate, tenure)
+            return installment_budget * (growth - 1) / (rate * growth)
+        return installment_budget * tenure
+
+    # Flat rate: installment = principal * (1 / tenure + rate)
+    return installment_budget / (1.0 / tenure + flt(interest_rate) / RATE_DIVISOR)
+
+
+def get_customer_exposure(customers):
+    """
+    Preload open-loan exposure for many customers in one query
+
+    Args:
+        customers (list): Loan Customer names
+
+    Returns:
+        dict: customer -> {loans, outstanding, monthly_obligation, overdue_loans}
+    """
+    if not customers:
+        return {}
+
+    rows = frappe.db.sql("""
+        SELECT customer,
+            COUNT(*) as loans,
+            SUM(outstanding_amount) as outstanding,
+            SUM(emi_amount) as monthly_obligation,
+            SUM(CASE WHEN status = 'Overdue' THEN 1 ELSE 0 END) as overdue_loans
+        FROM `tabLoan`
+        WHERE customer IN %(customers)s
+        AND status IN ('Active', 'Overdue')
+        GROUP BY customer
+    """, {"customers": tuple(set(customers))}, as_dict=True)
+
+    return {row.customer: row for row in rows}
+
+
+def score_application(application, exposure=None):
+    """
+    Evaluate one application against preloaded exposure
+
+    Pure computation; no database access, so it can be run over a whole
+    queue once exposure has been loaded.
+
+    Args:
+        application (dict): Loan Application fields, with the payment_frequency of the Loan it would become
+        exposure (dict): Row from get_customer_exposure, if the customer has open loans
+
+    Returns:
+        dict: Values for UNDERWRITING_FIELDS
+    """
+    exposure = exposure or frappe._dict()
+    income = flt(application.get("monthly_income"))
+    requested = flt(application.get("requested_amount"))
+    rate = flt(application.get("interest_rate"))
+    loan_type = application.get("loan_type")
+    tenure = cint(application.get("tenure_months"))
+    payment_frequency = application.get("payment_frequency")
+    remarks = []
+
+    installment = get_installment(loan_type, requested, rate, tenure, payment_frequency)
+    obligations = flt(exposure.get("monthly_obligation"))
+    emi_to_income = (installment + obligations) * 100.0 / income if income else 100.0
+
+    # Score out of 100: credit 40, affordability 30, existing debt 20, repayment conduct 10
+    credit_points = 40 * min(max(cint(application.get("credit_score")), 0), 10) / 10.0
+    affordability_points = 30 * max(0, 1 - emi_to_income / MAX_EMI_TO_INCOME)
+    debt_points = 20 * max(0, 1 - flt(exposure.get("outstanding")) / (income * 12)) if income else 0
+    conduct_points = 0 if cint(exposure.get("overdue_loans")) else 10
+    risk_score = flt(credit_points + affordability_points + debt_points + conduct_points, 2)
+
+    if not income:
+        remarks.append("Monthly income not provided")
+    if emi_to_income > MAX_EMI_TO_INCOME:
+        remarks.append(f"Installments take {flt(emi_to_income, 1)}% of income, limit is {MAX_EMI_TO_INCOME}%")
+    if cint(exposure.get("overdue_loans")):
+        remarks.append(f"{cint(exposure.overdue_loans)} existing loan(s) overdue")
+
+    if risk_score >= APPROVE_SCORE and emi_to_income <= MAX_EMI_TO_INCOME:
+        recommendation = "Approve"
+    elif risk_score >= REFER_SCORE:
+        recommendation = "Refer"
+    else:
+        recommendation = "Reject"
+
+    recommended_rate = rate + next(premium for floor, premium in RISK_PREMIUMS if risk_score >= floor) if rate else 0
+    installment_budget = income * MAX_EMI_TO_INCOME / 100.0 - obligations
+    recommended_amount = min(requested, get_max_principal(loan_type, installment_budget, recommended_rate, tenure,
+                                                          payment_frequency))
+
+    return {
+        "risk_score": risk_score,
+        "underwriting_recommendation": recommendation,
+        "emi_to_income_ratio": flt(emi_to_income, 2),
+        "existing_exposure": flt(exposure.get("outstanding")),
+        "recommended_amount": flt(max(recommended_amount, 0), 2) if recommendation != "Reject" else 0,
+        "recommended_rate": recommended_rate,
+        "underwriting_remarks": "\n".join(remarks)
+    }
+
+
+def evaluate_applications(applications):
+    """
+    Score a list of applications and store the results
+
+    Customer income and exposure are loaded once for the whole batch, so the
+    only per-application database work is writing the result back.
+    """
+    start = time.monotonic()
+    customers = [application.customer for application in applications]
+    exposure = get_customer_exposure(customers)
+
+    # Fall back to the income recorded on the customer when the application has none
+    missing_income = [application.customer for application in applications if not application.monthly_income]
+    customer_income = dict(frappe.get_all("Loan Customer",
+                                          filters={"name": ["in", missing_income]},
+                                          fields=["name", "monthly_income"],
+                                          as_list=True)) if missing_income else {}
+
+    now = now_datetime()
+    payment_frequency = get_loan_payment_frequency()
+    recommendations = {}
+
+    for application in applications:
+        application.payment_frequency = payment_frequency
+        if not application.monthly_income:
+            application.monthly_income = customer_income.get(application.customer)
+
+        result = score_application(application, exposure.get(application.customer))
+        result["underwritten_on"] = now
+
+        frappe.db.set_value("Loan Application", application.name, result, update_modified=False)
+        recommendations[result["underwriting_recommendation"]] = recommendations.get(result["underwriting_recommendation"], 0) + 1
+
+    elapsed = time.monotonic() - start
+
+    return {
+        "evaluated": len(applications),
+        "recommendations": recommendations,
+        "elapsed": round(elapsed, 3),
+        "per_second": round(len(applications) / elapsed, 1) if elapsed else None
+    }
+
+
+def get_applications(filters):
+    return frappe.get_all("Loan Application",
+                          filters=filters,
+                          fields=["name", "customer", "loan_type", "requested_amount", "interest_rate",
+                                  "tenure_months", "monthly_income", "credit_score"])
+
+
+@frappe.whitelist()
+def evaluate_application(application_name):
+    """Score a single application"""
+    frappe.has_permission("Loan Application", "write", application_name, throw=True)
+
+    evaluate_applications(get_applications({"name": application_name}))
+
+    return frappe.db.get_value("Loan Application", application_name, UNDERWRITING_FIELDS, as_dict=True)
+
+
+@frappe.whitelist()
+def evaluate_review_queue(branch=None):
+    """Score every application that is Under Review, optionally for one branch, in one batch"""
+    frappe.only_for(["System Manager", "Loan Manager"])
+
+    filters = {"status": "Under Review"}
+    if branch:
+        filters["branch"] = branch
+
+    return evaluate_applications(get_applications(filters))
@@ -5,7 +5,25 @@ Utility functions for loan calculations and management
 import frappe
 from frappe.utils import flt, cint, add_months, get_datetime
 import math
+import re
 from datetime import datetime, date
+from custom_loan.api_payload import encode_payload, get_page_length, make_page, parse_fields
+from custom_loan.db_routing import use_replica
+from custom_loan.permissions import get_branch_conditions
+
+# Penalty charged on overdue installments, a flat % of the overdue amount (see get_penalty_due)
+DEFAULT_PENALTY_RATE = 1
+
+# Loan calculator rules, shipped to the browser calculator by get_calculator_spec
+LOAN_TYPES = ["Flat Rate", "EMI"]
+RATE_DIVISOR = 100
+# EMI rates are quoted per year for these payment frequencies and split over the periods
+EMI_RATE_PERIODS = {"Monthly": 12}
+
+CUSTOMER_LOAN_FIELDS = ["name", "loan_amount", "outstanding_amount", "status", "loan_date", "loan_type",
+                        "interest_rate"]
+# Fields a caller may project get_customer_loan_summary's loans down to
+CUSTOMER_LOAN_PROJECTABLE_FIELDS = CUSTOMER_LOAN_FIELDS + ["branch", "emi_amount", "paid_amount", "last_payment_date"]
 
 
 def calculate_flat_interest(principal, rate_per_month, tenure_months):
@@ -135,11 +153,162 @@ def generate_payment_schedule(loan_type, principal, rate_per_month, tenure_month
     return schedule
 
 
-def get_overdue_loans():
-    """Get all overdue loans"""
-    today = frappe.utils.today()
+def calculate_loan_totals(loan_type, principal, interest_rate, tenure_months, payment_frequency=None):
+    """
+    Calculate total interest, total amount and installment as stored on a Loan
+
+    Mirrored by calculate_loan_totals in public/js/loan_calculator.js; keep
+    both in step (test_loan.py runs the same cases through each).
+
+    Args:
+        loan_type (str): "Flat Rate" or "EMI"
+        principal (float): Principal amount
+        interest_rate (float): Interest rate (as percentage)
+        tenure_months (int): Number of installments
+        payment_frequency (str): Loan payment frequency
+
+    Returns:
+        dict: total_interest, total_amount, emi_amount
+    """
+    principal = flt(principal)
+    rate = flt(interest_rate) / RATE_DIVISOR
+    tenure = cint(tenure_months)
+
+    if loan_type == "Flat Rate":
+        total_interest = principal * rate * tenure
+        total_amount = principal + total_interest
+        emi_amount = total_amount / tenure
+
+    elif loan_type == "EMI":
+        # Reducing balance
+        period_rate = get_period_rate(interest_rate, payment_frequency)
+
+        if period_rate == 0:
+            emi_amount = principal / tenure
+        else:
+            emi_amount = (principal * period_rate * math.pow(1 + period_rate, tenure)) / \
+                         (math.pow(1 + period_rate, tenure) - 1)
+
+        total_amount = emi_amount * tenure
+        total_interest = total_amount - principal
+
+    else:
+        frappe.throw("Invalid loan type")
+
+    return {
+        "total_interest": total_interest,
+        "total_amount": total_amount,
+        "emi_amount": emi_amount
+    }
+
+
+def get_period_rate(interest_rate, payment_frequency=None):
+    """EMI interest rate per installment, as a fraction"""
+    return flt(interest_rate) / RATE_DIVISOR / EMI_RATE_PERIODS.get(payment_frequency, 1)
+
+
+def build_repayment_schedule(loan_type, principal, interest_rate, tenure_months, start_date, total_amount, emi_amount,
+                             payment_frequency=None):
+    """
+    Build the repayment schedule rows of a Loan
+
+    Mirrored by build_repayment_schedule in public/js/loan_calculator.js.
+
+    Args:
+        loan_type (str): "Flat Rate" or "EMI"
+        principal (float): Principal amount
+        interest_rate (float): Interest rate (as percentage), as passed to calculate_loan_totals
+        tenure_months (int): Number of installments
+        start_date (date): Loan date; installments fall due monthly from it
+        total_amount (float): Total amount from calculate_loan_totals
+        emi_amount (float): Installment from calculate_loan_totals
+        payment_frequency (str): Loan payment frequency, as passed to calculate_loan_totals
+
+    Returns:
+        list: Schedule rows
+    """
+    schedule = []
+    tenure = cint(tenure_months)
+    remaining_principal = flt(principal)
+    period_rate = get_period_rate(interest_rate, payment_frequency)
+
+    for month in range(1, tenure + 1):
+        if loan_type == "Flat Rate":
+            # Flat rate - same amount each month
+            installment_amount = flt(total_amount) / tenure
+            principal_amount = flt(principal) / tenure
+            interest_amount = installment_amount - principal_amount
+
+        else:
+            # EMI - reducing balance
+            installment_amount = flt(emi_amount)
+            interest_amount = remaining_principal * period_rate
+            principal_amount = installment_amount - interest_amount
+
+            if principal_amount > remaining_principal:
+                principal_amount = remaining_principal
+                installment_amount = principal_amount + interest_amount
+
+        remaining_principal -= principal_amount
+
+        schedule.append({
+            "installment_number": month,
+            "due_date": add_months(start_date, month),
+            "installment_amount": installment_amount,
+            "principal_amount": principal_amount,
+            "interest_amount": interest_amount,
+            "remaining_balance": max(0, remaining_principal)
+        })
+
+    return schedule
+
+
+def get_calculator_spec():
+    """Calculator rules for the browser, generated from the server constants and Loan meta"""
+    return {
+        "loan_types": LOAN_TYPES,
+        "rate_divisor": RATE_DIVISOR,
+        "emi_rate_periods": EMI_RATE_PERIODS,
+        "default_payment_frequency": frappe.get_meta("Loan").get_field("payment_frequency").default
+    }
+
+
+def boot_session(bootinfo):
+    bootinfo.custom_loan_calculator = get_calculator_spec()
+
+
+def normalize_mobile_number(value):
+    """Digits of a mobile number, without the spaces, dashes, +91 or leading 0 it was typed with"""
+    digits = re.sub(r"\D", "", value or "")
+    if len(digits) == 12 and digits.startswith("91"):
+        return digits[2:]
+    if len(digits) == 11 and digits.startswith("0"):
+        return digits[1:]
+    return digits
+
+
+def lock_loan(loan):
+    """
+    Lock a loan row for the rest of the current transaction
+    
+    Anything that reads and then rewrites a loan's balance or schedule must
+    call this first so that concurrent postings against the same loan queue
+    up instead of overwriting each other. Keep the work done while holding
+    the lock short; the lock is released on commit or rollback.
+    
+    Args:
+        loan (str): Loan name
+    """
+    frappe.db.sql("SELECT name FROM `tabLoan` WHERE name = %s FOR UPDATE", (loan,))
+
+
+@use_replica
+def get_overdue_loans(branch=None):
+    """Get all overdue loans, optionally for one branch"""
+    filters = frappe._dict(date=frappe.utils.today(), branch=branch)
+    conditions = get_branch_conditions(filters, "l.branch")
     
-    return frappe.db.sql("""
+    return frappe.db.sql(f"""
         SELECT DISTINCT l.name, l.customer, l.customer_name, l.loan_amount, 
                l.outstanding_amount, l.mobile_number,
                COUNT(lrs.name) as overdue_installments,
@@ -149,13 +318,25 @@ def get_overdue_loans():
         INNER JOIN `tabLoan Repayment Schedule` lrs ON lrs.parent = l.name
         WHERE l.status = 'Active' 
         AND lrs.status = 'Pending' 
-        AND lrs.due_date < %s
+        AND lrs.due_date < %(date)s
+        {conditions}
         GROUP BY l.name
         ORDER BY first_overdue_date ASC
-    """, (today,), as_dict=True)
+    """, filters, as_dict=True)
+
 
+def get_penalty_due(overdue_amount):
+    """
+    Penalty charged at the counter on overdue installments
 
-def calculate_penalty(overdue_amount, overdue_days, penalty_rate_per_month=1):
+    A flat DEFAULT_PENALTY_RATE percent of the overdue amount, however long it
+    has been overdue. Payment allocation, the counter state, payoff quotes,
+    the collection route sheet and the delinquency aging report all use this.
+    """
+    return flt(flt(overdue_amount) * DEFAULT_PENALTY_RATE / 100, 2)
+
+
+def calculate_penalty(overdue_amount, overdue_days, penalty_rate_per_month=DEFAULT_PENALTY_RATE):
     """
     Calculate penalty for overdue payments
     
@@ -176,39 +357,149 @@ def calculate_penalty(overdue_amount, overdue_days, penalty_rate_per_month=1):
     return penalty
 
 
-def get_customer_loan_summary(customer):
-    """Get comprehensive loan summary for a customer"""
-    customer_doc = frappe.get_doc("Loan Customer", customer)
+# Days-past-due buckets as (label, from day, to day); None leaves the bucket open ended
+DPD_BUCKETS = [
+    ("0", None, 0),
+    ("1-30", 1, 30),
+    ("31-60", 31, 60),
+    ("61-90", 61, 90),
+    ("90+", 91, None)
+]
+
+
+def get_dpd_bucket(dpd):
+    """Get the DPD bucket label for a number of days past due"""
+    dpd = cint(dpd)
+    for label, from_day, to_day in DPD_BUCKETS:
+        if (from_day is None or dpd >= from_day) and (to_day is None or dpd <= to_day):
+            return label
+
+
+def get_dpd_bucket_sql(dpd_column):
+    """SQL CASE expression mapping a days-past-due column to its DPD bucket label"""
+    cases = " ".join(
+        f"WHEN {dpd_column} <= {to_day} THEN '{label}'"
+        for label, from_day, to_day in DPD_BUCKETS if to_day is not None
+    )
+    return f"CASE {cases} ELSE '{DPD_BUCKETS[-1][0]}' END"
+
+
+def get_loan_delinquency_sql(conditions=""):
+    """
+    SQL returning one row per open loan with its delinquency as of %(date)s
     
-    # Get all loans
-    loans = frappe.get_all("Loan",
-                          filters={"customer": customer},
-                          fields=["name", "loan_amount", "outstanding_amount", "status", 
-                                 "loan_date", "loan_type", "interest_rate"])
-    
-    # Get recent payments
-    payments = frappe.get_all("Loan Payment",
-                             filters={"customer": customer, "docstatus": 1},
-                             fields=["name", "payment_date", "amount", "loan"],
-                             order_by="payment_date desc",
-                             limit=10)
-    
-    # Calculate totals
-    total_borrowed = sum(loan.loan_amount for loan in loans)
-    total_outstanding = sum(loan.outstanding_amount for loan in loans if loan.status != "Closed")
-    active_loans = len([loan for loan in loans if loan.status == "Active"])
+    Only unpaid installments are read, through the (parent, status, due_date)
+    index on the schedule. Partial payments are treated as settling interest
+    before principal, the same order used when allocating a payment.
     
-    return {
-        "customer_details": customer_doc.as_dict(),
-        "loans": loans,
-        "recent_payments": payments,
-        "summary": {
-            "total_borrowed": total_borrowed,
-            "total_outstanding": total_outstanding,
-            "active_loans": active_loans,
-            "closed_loans": len([loan for loan in loans if loan.status == "Closed"])
-        }
-    }
+    Args:
+        conditions (str): Extra SQL conditions on `l` (Loan) or `s` (schedule)
+    
+    Returns:
+        str: Query expecting a %(date)s parameter; the penalty on overdue_amount is get_penalty_due's
+    """
+    return f"""
+        SELECT
+            l.name as loan,
+            l.customer,
+            l.loan_type,
+            l.branch,
+            l.loan_date,
+            l.loan_amount,
+            l.status,
+            IFNULL(DATEDIFF(%(date)s, MIN(CASE WHEN s.due_date < %(date)s THEN s.due_date END)), 0) as dpd,
+            SUM(LEAST(s.principal_amount, s.installment_amount - IFNULL(s.paid_amount, 0))) as outstanding_principal,
+            SUM(GREATEST(s.interest_amount - IFNULL(s.paid_amount, 0), 0)) as outstanding_interest,
+            SUM(CASE WHEN s.due_date < %(date)s
+                THEN GREATEST(s.interest_amount - IFNULL(s.paid_amount, 0), 0) ELSE 0 END) as overdue_interest,
+            SUM(CASE WHEN s.due_date < %(date)s
+                THEN s.installment_amount - IFNULL(s.paid_amount, 0) ELSE 0 END) as overdue_amount
+        FROM `tabLoan` l
+        INNER JOIN `tabLoan Repayment Schedule` s ON s.parent = l.name AND s.parenttype = 'Loan'
+        WHERE l.status IN ('Active', 'Overdue')
+        AND s.status IN ('Pending', 'Partial')
+        {conditions}
+        GROUP BY l.name, l.customer, l.loan_type, l.loan_date, l.loan_amount, l.status
+    """
+
+
+@frappe.whitelist()
+@use_replica
+def get_customer_loan_summary(customer, customer_fields=None, loan_fields=None, cursor=None, page_length=None,
+                              encoding=None):
+    """
+    Get comprehensive loan summary for a customer
+
+    Passing loan_fields, cursor or page_length returns the loans a page at a
+    time, newest first; customer details, payments and totals come with the
+    first page only.
+    """
+    frappe.has_permission("Loan Customer", doc=customer, throw=True)
+    customer_doc = frappe.get_doc("Loan Customer", customer)
+
+    customer_fields = parse_fields(customer_fields, frappe.get_meta("Loan Customer").get_valid_columns())
+    customer_details = {field: customer_doc.get(field) for field in customer_fields} \
+        if customer_fields else customer_doc.as_dict()
+
+    if not (loan_fields or cursor or page_length):
+        # Get all loans
+        loans = frappe.get_all("Loan",
+                              filters={"customer": customer},
+                              fields=CUSTOMER_LOAN_FIELDS)
+
+        # Calculate totals
+        total_borrowed = sum(loan.loan_amount for loan in loans)
+        total_outstanding = sum(loan.outstanding_amount for loan in loans if loan.status != "Closed")
+        active_loans = len([loan for loan in loans if loan.status == "Active"])
+
+        return encode_payload("get_customer_loan_summary", {
+            "customer_details": customer_details,
+            "loans": loans,
+            "recent_payments": get_recent_payments(customer),
+            "summary": {
+                "total_borrowed": total_borrowed,
+                "total_outstanding": total_outstanding,
+                "active_loans": active_loans,
+                "closed_loans": len([loan for loan in loans if loan.status == "Closed"])
+            }
+        }, encoding)
+
+    page_length = get_page_length(page_length)
+    filters = {"customer": customer}
+    if cursor:
+        filters["name"] = ["<", cursor]
+
+    loans = frappe.get_all("Loan",
+                           filters=filters,
+                           fields=parse_fields(loan_fields, CUSTOMER_LOAN_PROJECTABLE_FIELDS, always=["name"])
+                           or CUSTOMER_LOAN_FIELDS,
+                           order_by="name desc",
+                           limit_page_length=page_length + 1)
+    loans, next_cursor = make_page(loans, page_length)
+
+    payload = {"loans": loans, "next_cursor": next_cursor}
+    if not cursor:
+        summary = frappe.db.sql("""
+            SELECT
+                IFNULL(SUM(loan_amount), 0) as total_borrowed,
+                IFNULL(SUM(IF(status != 'Closed', outstanding_amount, 0)), 0) as total_outstanding,
+                IFNULL(SUM(status = 'Active'), 0) as active_loans,
+                IFNULL(SUM(status = 'Closed'), 0) as closed_loans
+            FROM `tabLoan`
+            WHERE customer = %s
+        """, (customer,), as_dict=True)[0]
+        payload.update(customer_details=customer_details, recent_payments=get_recent_payments(customer),
+                       summary=summary)
+
+    return encode_payload("get_customer_loan_summary", payload, encoding)
+
+
+def get_recent_payments(customer):
+    return frappe.get_all("Loan Payment",
+                          filters={"customer": customer, "docstatus": 1},
+                          fields=["name", "payment_date", "amount", "loan"],
+                          order_by="payment_date desc",
+                          limit=10)
 
 
 @frappe.whitelist()
@@ -223,9 +514,9 @@ def get_loan_calculator_data(loan_type, principal, rate_per_month, tenure_months
 
 
 @frappe.whitelist()
-def bulk_sms_reminder():
+def bulk_sms_reminder(branch=None):
     """Send SMS reminders to customers with overdue payments"""
-    overdue_loans = get_overdue_loans()
+    overdue_loans = get_overdue_loans(branch)
     sent_count = 0
     
     for loan in overdue_loans: